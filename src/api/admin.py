@@ -1,3 +1,11 @@
 from django.contrib import admin
+from api.models import OutboxEmail
 
-# Register your models here.
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ["subject", "to", "status", "attempts", "created", "sent_at"]
+    readonly_fields = ["subject", "body", "from_email", "to", "created", "sent_at", "last_error"]
+    list_filter = ["status"]
+
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,269 @@
+from asgiref.sync import sync_to_async
+from ninja import Query, Router
+from api.author_schema import AuthorSchema, PaginatedAuthorsSchema, SingleAuthorSchema
+from api.book_schema import (
+    BookChaptersSchema,
+    BookPagesSchema,
+    BookSchema,
+    ChapterSchema,
+    PageSchema,
+    PaginatedBooksSchema,
+    SingleBookSchema,
+    TopBooksSchema,
+)
+from api.cache import acache_tagged
+from api.info_schema import AnnouncementSchema, SingleAnnouncementSchema
+from api.utils import api_response, apaginate_keyset, apaginate_offset, page_links
+from announcement.models import Announcement
+from books.leaderboard import get_leaderboard
+from books.models import AuthorEntry, Book
+
+# ============================
+# Async read endpoints
+# ============================
+# Async versions of the read-only book, author and info endpoints, for the
+# ASGI (uvicorn worker) run mode. Querysets that are serialized with
+# BookSchema prefetch their many-to-many fields since lazy loading is not
+# allowed in async code.
+book_router = Router(tags=["books (async)"])
+author_router = Router(tags=["author (async)"])
+info_router = Router(tags=["info (async)"])
+
+
+def _books():
+    return Book.released.for_listing()
+
+
+async def _paginated(queryset, keys, schema, name, limit, offset, cursor):
+    if cursor is not None:
+        try:
+            rows, next_cursor = await apaginate_keyset(queryset, keys, cursor, limit)
+        except ValueError as e:
+            return api_response(
+                success=False, message="Invalid cursor", error=e, status_code=400
+            )
+        if not rows:
+            return api_response(
+                success=False,
+                message="This page is empty",
+                error="empty page",
+                status_code=404,
+            )
+        return api_response(
+            success=True,
+            message=f"all {name} fetched successfully",
+            payload={
+                name: [schema.from_orm(row) for row in rows],
+                "next_cursor": next_cursor,
+            },
+        )
+
+    page = await apaginate_offset(queryset.order_by(*keys), limit, offset)
+    if page is None:
+        return api_response(
+            success=False,
+            message="This page is empty",
+            error="empty page",
+            status_code=404,
+        )
+    rows, next, prev = page
+    return api_response(
+        success=True,
+        message=f"all {name} fetched successfully",
+        payload={
+            name: [schema.from_orm(row) for row in rows],
+            **page_links(next, prev),
+        },
+    )
+
+
+@book_router.get("/get_all_books", response=PaginatedBooksSchema)
+@acache_tagged("catalog")
+async def get_all_books(
+    request,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
+    try:
+        return await _paginated(
+            _books(), ["title", "id"], BookSchema, "books", limit, offset, cursor
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@book_router.get("/get_book", response=SingleBookSchema)
+@acache_tagged("book:{book_id}")
+async def get_book(request, book_id: int):
+    try:
+        book = await _books().aget(id=book_id)
+        return api_response(
+            success=True,
+            message="Book fetched successfully.",
+            payload=BookSchema.from_orm(book).dict(),
+            status_code=200,
+        )
+    except Book.DoesNotExist:
+        return api_response(
+            success=False,
+            message="Book not found.",
+            error="No book with this book id exists.",
+            status_code=404,
+        )
+
+
+@book_router.get("/top_books", response=TopBooksSchema)
+@acache_tagged("catalog")
+async def top_books(request, n: int = 3, genre_id: int = None):
+    try:
+        book_ids = await sync_to_async(get_leaderboard().top)(
+            min(max(n, 0), 100), genre_id
+        )
+        books = await _books().ain_bulk(book_ids)
+        books_data = [
+            BookSchema.from_orm(books[book_id]) for book_id in book_ids if book_id in books
+        ]
+        return api_response(
+            success=True,
+            message="top books fetched successfully",
+            payload={"books": books_data},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@book_router.get("/get_book_chapters", response=BookChaptersSchema)
+@acache_tagged("book:{book_id}")
+async def get_book_chapters(request, book_id: int):
+    try:
+        book = await Book.released.aget(id=book_id)
+        chapters_data = [
+            ChapterSchema.from_orm(chapter) async for chapter in book.chapters.all()
+        ]
+        return api_response(
+            success=True,
+            message="book chapters fetched successfully",
+            payload={"chapters": chapters_data},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@book_router.get("/get_chapter_pages", response=BookPagesSchema)
+@acache_tagged("book:{book_id}")
+async def get_chapter_pages(request, book_id: int, chapter_number: int):
+    try:
+        book = await Book.released.aget(id=book_id)
+        chapter = await book.chapters.aget(chapter_number=chapter_number)
+        # content is not deferred: re-rendering a stale page must not lazy load
+        pages_data = [PageSchema.from_orm(page) async for page in chapter.pages.all()]
+        return api_response(
+            success=True,
+            message="chapter pages fetched successfully",
+            payload={"pages": pages_data},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@author_router.get("/get_all_authors", response=PaginatedAuthorsSchema)
+@acache_tagged("authors")
+async def get_all_authors(
+    request,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
+    try:
+        return await _paginated(
+            AuthorEntry.objects.all(),
+            ["author_id"],
+            AuthorSchema,
+            "authors",
+            limit,
+            offset,
+            cursor,
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@author_router.get("/get_author", response=SingleAuthorSchema)
+@acache_tagged("author:{author_id}")
+async def get_author(request, author_id: int):
+    try:
+        author = await AuthorEntry.objects.aget(author_id=author_id)
+        return api_response(
+            success=True,
+            message="Author fetched successfully.",
+            payload=AuthorSchema.from_orm(author).dict(),
+            status_code=200,
+        )
+    except AuthorEntry.DoesNotExist:
+        return api_response(
+            success=False,
+            message="Author not found.",
+            error="No Author with this author id exists.",
+            status_code=404,
+        )
+
+
+@author_router.get("/get_author_books", response=PaginatedBooksSchema)
+@acache_tagged("author:{author_id}", "catalog")
+async def get_author_books(
+    request,
+    author_id: int,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
+    try:
+        author = await AuthorEntry.objects.only("author_id").aget(author_id=author_id)
+    except AuthorEntry.DoesNotExist:
+        return api_response(
+            success=False,
+            message="Author not found.",
+            error="No Author with this author id exists.",
+            status_code=404,
+        )
+    try:
+        return await _paginated(
+            _books().filter(authors__id=author.author_id),
+            ["title", "id"],
+            BookSchema,
+            "books",
+            limit,
+            offset,
+            cursor,
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@info_router.get("/get_announcement", response=SingleAnnouncementSchema)
+async def get_announcement(request):
+    try:
+        announcement = await Announcement.objects.alast()
+        announcement_data = AnnouncementSchema.from_orm(announcement)
+        return api_response(
+            success=True,
+            message="last announcement fetched successfully",
+            payload=announcement_data.dict(),
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
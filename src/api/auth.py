@@ -1,8 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
 from ninja_jwt.authentication import JWTAuth
+from ninja_jwt.exceptions import AuthenticationFailed, InvalidToken
+from ninja_jwt.settings import api_settings
+from .cache import bump_tags, get_tag_versions
 from .utils import api_response
 from ninja.errors import HttpError
 
+# the version is bumped whenever the user changes, see `forget_cached_user`
+USER_CACHE_KEY = "auth_user:{}:{}"
+USER_VERSION_TAG = "auth_user:{}"
+
+_local_users = OrderedDict()
+_local_lock = threading.Lock()
+# bumped by every `forget_cached_user` of this process
+_local_generation = 0
+
+
+def _user_fields(user_model):
+    # the password hash is left out of the caches, it is loaded on access
+    return [
+        field.attname
+        for field in user_model._meta.concrete_fields
+        if field.attname != "password"
+    ]
+
+
+def get_cached_user(user_model, user_id):
+    """
+    Return the user whose USER_ID_FIELD is `user_id`, or None.
+
+    Looks in a small per-process LRU first (entries live for
+    AUTH_USER_LOCAL_TTL seconds, so other processes see changes quickly),
+    then in the shared cache, then in the database.
+
+    Shared cache entries are keyed by the user's version, read before the
+    database: a request that read the row just before a change committed
+    stores it under the old version, which is never read again.
+    """
+    now = time.monotonic()
+    with _local_lock:
+        generation = _local_generation
+        entry = _local_users.get(user_id)
+        if entry is not None and entry[0] > now:
+            _local_users.move_to_end(user_id)
+            field_names, values = entry[1]
+        else:
+            entry = None
+    if entry is None:
+        (version,) = get_tag_versions([USER_VERSION_TAG.format(user_id)])
+        key = USER_CACHE_KEY.format(user_id, version)
+        cached = cache.get(key)
+        if cached is None:
+            field_names = _user_fields(user_model)
+            values = (
+                user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values_list(*field_names)
+                .first()
+            )
+            if values is None:
+                return None
+            cache.set(key, (field_names, values), settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            field_names, values = cached
+        with _local_lock:
+            # a user forgotten meanwhile may be this one, read before the change
+            if generation == _local_generation:
+                _local_users[user_id] = (
+                    now + settings.AUTH_USER_LOCAL_TTL, (field_names, values)
+                )
+                _local_users.move_to_end(user_id)
+                while len(_local_users) > settings.AUTH_USER_LOCAL_SIZE:
+                    _local_users.popitem(last=False)
+    return user_model.from_db(router.db_for_read(user_model), field_names, values)
+
+
+def forget_cached_user(user_id):
+    """
+    Drop a user from the LRU of this process and move to a new version in
+    the shared cache, called once a change to the user commits (see
+    api.signals).
+    """
+    global _local_generation
+    with _local_lock:
+        _local_generation += 1
+        _local_users.pop(user_id, None)
+    bump_tags(USER_VERSION_TAG.format(user_id))
+
+
 class CustomJWTAuth(JWTAuth):
+    def get_user(self, validated_token):
+        """
+        Like JWTAuth.get_user, but through `get_cached_user` so identifying
+        the caller does not cost a database query on every request.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken("Token contained no recognizable user identification") from e
+        user = get_cached_user(self.user_model, user_id)
+        if user is None:
+            raise AuthenticationFailed("User not found")
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive")
+        return user
+
     def authenticate(self, request,token):
         try:
             user = super().authenticate(request,token)
@@ -11,10 +11,12 @@ from .schema import (
     EmailVerificationSchema,
 )
 from .auth import CustomJWTAuth
+from .throttling import AnonSlidingWindowThrottle
 from users.models import User
 from django.contrib.auth.tokens import default_token_generator
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db import transaction
+from .outbox import queue_mail
 from django.utils.encoding import force_bytes
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_encode
@@ -46,7 +48,7 @@ def get_csrf_token(request):
         status_code=200
     )
 
-@router.post("/login", response=ApiResponseSchema)
+@router.post("/login", response=ApiResponseSchema, throttle=AnonSlidingWindowThrottle("10/m", scope="login"))
 def login_view(request, payload: SignInSchema):
     """
     Authenticate a user and log them in.
@@ -94,7 +96,7 @@ def logout_view(request):
     )
 
 
-@router.post("/register", response=ApiResponseSchema)
+@router.post("/register", response=ApiResponseSchema, throttle=AnonSlidingWindowThrottle("5/m", scope="register"))
 def register(request, payload: SignInSchema):
     """
     Register a new user and send a verification email.
@@ -116,26 +118,26 @@ def register(request, payload: SignInSchema):
                 status_code=200
             )
 
-        # Create the user
-        user = User.objects.create_user( email=payload.email, password=payload.password)
-        user.is_verified = False  # Mark the user as inactive until email verification
-        user.save()
-
-        # Generate email verification token
-        token = default_token_generator.make_token(user)
-        uid = urlsafe_base64_encode(force_bytes(user.id))
-
-        # Construct the email verification URL
-        verification_url = f"{settings.FRONTEND_URL}/verify-email/{uid}/{token}/"
-
-        # Send verification email
-        send_mail(
-            subject="Email Verification",
-            message=f"Click the link to verify your email: {verification_url}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            fail_silently=False,
-        )
+        with transaction.atomic():
+            # Create the user
+            user = User.objects.create_user( email=payload.email, password=payload.password)
+            user.is_verified = False  # Mark the user as inactive until email verification
+            user.save()
+
+            # Generate email verification token
+            token = default_token_generator.make_token(user)
+            uid = urlsafe_base64_encode(force_bytes(user.id))
+
+            # Construct the email verification URL
+            verification_url = f"{settings.FRONTEND_URL}/verify-email/{uid}/{token}/"
+
+            # Queue the verification email, send_outbox sends it
+            queue_mail(
+                subject="Email Verification",
+                message=f"Click the link to verify your email: {verification_url}",
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=[user.email],
+            )
         return api_response(
             success=True,
             message="User registered successfully. Please check your email to verify your account.",
@@ -251,7 +253,7 @@ def change_password(request, data: ChangePasswordSchema):
     )
 
 
-@router.post("/reset-password", response=ApiResponseSchema)
+@router.post("/reset-password", response=ApiResponseSchema, throttle=AnonSlidingWindowThrottle("5/m", scope="reset-password"))
 def request_password_reset(request, data: PasswordResetRequestSchema):
     """
     Request a password reset and send a reset email.
@@ -279,13 +281,12 @@ def request_password_reset(request, data: PasswordResetRequestSchema):
     # Construct the password reset URL
     password_reset_url = f"{settings.FRONTEND_URL}/reset-password-confirm/{user_id}/{token}/"
 
-    # Send email with the reset URL
-    send_mail(
+    # Queue the email with the reset URL, send_outbox sends it
+    queue_mail(
         subject="Password Reset",
         message=f"Click the link to reset your password: {password_reset_url}",
         from_email=settings.DEFAULT_FROM_EMAIL,
         recipient_list=[user.email],
-        fail_silently=False,
     )
 
     return api_response(
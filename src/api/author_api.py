@@ -1,10 +1,9 @@
-from ninja import Router
+from ninja import Query, Router
 from api.author_schema import AuthorSchema, SingleAuthorSchema, PaginatedAuthorsSchema
 from api.book_schema import BookSchema, PaginatedBooksSchema
-from api.utils import api_response
-from books.models import Book
-from users.models import User
-from django.views.decorators.cache import cache_page
+from api.cache import cache_tagged
+from api.utils import api_response, page_links, paginate_keyset, paginate_offset
+from books.models import AuthorEntry, Book
 
 # ============================
 # author Endpoints
@@ -13,36 +12,52 @@ router = Router(tags=["author"])
 
 
 @router.get("/get_all_authors", response=PaginatedAuthorsSchema)
-@cache_page(60 * 60)
-def get_all_authors(request, limit: int = 1, offset: int = 0):
+@cache_tagged("authors")
+def get_all_authors(
+    request,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
     try:
-        authors = User.objects.filter(authored_books__isnull=False).distinct()
-        if limit * offset >= len(authors):
+        authors = AuthorEntry.objects.all()
+        if cursor is not None:
+            # keyset pagination, pass an empty cursor to fetch the first page
+            try:
+                authors, next_cursor = paginate_keyset(authors, ["author_id"], cursor, limit)
+            except ValueError as e:
+                return api_response(
+                    success=False, message="Invalid cursor", error=e, status_code=400
+                )
+            if not authors:
+                return api_response(
+                    success=False,
+                    message="This page is empty",
+                    error="empty page",
+                    status_code=404,
+                )
+            authors_data = [AuthorSchema.from_orm(author) for author in authors]
+            return api_response(
+                success=True,
+                message="all authors fetched successfully",
+                payload={"authors": authors_data, "next_cursor": next_cursor},
+            )
+
+        page = paginate_offset(authors.order_by("author_id"), limit, offset)
+        if page is None:
             return api_response(
                 success=False,
                 message="This page is empty",
                 error="empty page",
                 status_code=404,
             )
-        if len(authors) == limit * offset + limit:
-            next = -1
-        elif len(authors) < limit * offset + limit and len(authors) >= limit * offset:
-            next = -1
-            limit = len(authors) % limit
-        else:
-            next = offset + 1
-        if offset == 0:
-            prev = -1
-        else:
-            prev = offset - 1
-
-        authors = authors[offset * limit : offset * limit + limit]
+        authors, next, prev = page
         authors_data = [AuthorSchema.from_orm(author) for author in authors]
         # return authors_data
         return api_response(
             success=True,
             message="all authors fetched successfully",
-            payload={"authors": authors_data, "next_page": next, "perv_page": prev},
+            payload={"authors": authors_data, **page_links(next, prev)},
         )
 
     except Exception as e:
@@ -52,14 +67,10 @@ def get_all_authors(request, limit: int = 1, offset: int = 0):
 
 
 @router.get("/get_author", response=SingleAuthorSchema)
-@cache_page(60 * 60)
+@cache_tagged("author:{author_id}")
 def get_author(request, author_id: int):
     try:
-        author = (
-            User.objects.filter(authored_books__isnull=False)
-            .distinct()
-            .get(id=author_id)
-        )
+        author = AuthorEntry.objects.get(author_id=author_id)
         author_data = AuthorSchema.from_orm(author)
         return api_response(
             success=True,
@@ -67,7 +78,7 @@ def get_author(request, author_id: int):
             payload=author_data.dict(),
             status_code=200,
         )
-    except User.DoesNotExist:
+    except AuthorEntry.DoesNotExist:
         return api_response(
             success=False,
             message="Author not found.",
@@ -77,49 +88,64 @@ def get_author(request, author_id: int):
 
 
 @router.get("/get_author_books", response=PaginatedBooksSchema)
-@cache_page(60 * 60)
-def get_author_books(request, author_id: int, limit: int = 1, offset: int = 0):
+@cache_tagged("author:{author_id}", "catalog")
+def get_author_books(
+    request,
+    author_id: int,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
     try:
-        author = (
-            User.objects.filter(authored_books__isnull=False)
-            .distinct()
-            .get(id=author_id)
-        )
+        author = AuthorEntry.objects.only("author_id").get(author_id=author_id)
         try:
-            books = Book.released.filter(authors__id=author.id)
-            if limit * offset >= len(books):
+            books = Book.released.for_listing().filter(authors__id=author.author_id)
+            if cursor is not None:
+                # keyset pagination, pass an empty cursor to fetch the first page
+                try:
+                    books, next_cursor = paginate_keyset(
+                        books, ["title", "id"], cursor, limit
+                    )
+                except ValueError as e:
+                    return api_response(
+                        success=False, message="Invalid cursor", error=e, status_code=400
+                    )
+                if not books:
+                    return api_response(
+                        success=False,
+                        message="This page is empty",
+                        error="empty page",
+                        status_code=404,
+                    )
+                books_data = [BookSchema.from_orm(book) for book in books]
+                return api_response(
+                    success=True,
+                    message="all books fetched successfully",
+                    payload={"books": books_data, "next_cursor": next_cursor},
+                )
+
+            page = paginate_offset(books, limit, offset)
+            if page is None:
                 return api_response(
                     success=False,
                     message="This page is empty",
                     error="empty page",
                     status_code=404,
                 )
-            if len(books) == limit * offset + limit:
-                next = -1
-            elif len(books) < limit * offset + limit and len(books) >= limit * offset:
-                next = -1
-                limit = len(books) % limit
-            else:
-                next = offset + 1
-            if offset == 0:
-                prev = -1
-            else:
-                prev = offset - 1
-
-            books = books[offset * limit : offset * limit + limit]
+            books, next, prev = page
             books_data = [BookSchema.from_orm(book) for book in books]
             # return books_data
             return api_response(
                 success=True,
                 message="all books fetched successfully",
-                payload={"books": books_data, "next_page": next, "perv_page": prev},
+                payload={"books": books_data, **page_links(next, prev)},
             )
 
         except Exception as e:
             return api_response(
                 success=False, message="Error occurd", error=e, status_code=503
             )
-    except User.DoesNotExist:
+    except AuthorEntry.DoesNotExist:
         return api_response(
             success=False,
             message="Author not found.",
@@ -1,16 +1,22 @@
-from ninja import ModelSchema, Schema
+from datetime import date
+from typing import Optional
+from ninja import Field, Schema
 from api.schema import ApiResponseSchema, DataSchema
-from users.models import User
 
 
-class AuthorSchema(ModelSchema):
-    class Meta:
-        model = User
-        fields = [
-            "id",
-            "first_name",
-            "last_name",
-        ]
+class AuthorSchema(Schema):
+    """
+    An author as listed in the directory (books.models.AuthorEntry). The
+    id, first_name and last_name keys are those of the former User-based
+    schema; released_books, latest_published and genres were added.
+    """
+
+    id: int = Field(alias="author_id")
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    released_books: int
+    latest_published: Optional[date] = None
+    genres: list[int]
 
 
 class SingleAuthorDataSchema(DataSchema):
@@ -23,8 +29,9 @@ class SingleAuthorSchema(ApiResponseSchema):
 
 class PaginatedAuthors(Schema):
     authors: list[AuthorSchema]
-    next_page: int
-    prev_page: int
+    next_page: Optional[int] = None
+    prev_page: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 
 class PaginatedAuthorsDataSchema(DataSchema):
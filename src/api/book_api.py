@@ -1,19 +1,47 @@
-from ninja import Router
+import datetime
+import json
+import os
+from ninja import File, Query, Router
+from ninja.files import UploadedFile
 from api.book_schema import (
     BookChaptersSchema,
     BookPagesSchema,
     BookSchema,
     ChapterSchema,
+    GenreListingSchema,
+    GenresResponseSchema,
+    PageMetaSchema,
     PageSchema,
+    PageWindowResponseSchema,
+    PageWindowSchema,
     PaginatedBooksSchema,
+    ReadingProgressInSchema,
+    ReadingProgressResponseSchema,
+    SearchResultsSchema,
     SingleBookSchema,
     TopBooksSchema,
 )
-from api.schema import GenreSchema
-from api.utils import api_response
-from books.models import Book
-from typing import List
-from django.views.decorators.cache import cache_page
+from api.auth import CustomJWTAuth
+from api.cache import cache_tagged, conditional_tagged
+from api.schema import ApiResponseSchema
+from api.utils import (
+    api_response,
+    last_modified_from_dates,
+    page_links,
+    paginate_keyset,
+    paginate_offset,
+)
+from books.models import Book, BookImport, Chapter, Genre, Page
+from books import exports
+from books import importer
+from books import progress as reading_progress
+from books import search as books_search
+from books.leaderboard import get_leaderboard
+from django.conf import settings
+from django.db.models import F, Max
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.urls import reverse
 
 # ============================
 # Books Endpoints
@@ -23,37 +51,83 @@ router = Router(tags=["books"])
 # TODO: make all returns use api_response
 
 
+def book_last_modified(request, book_id, **kwargs):
+    updated = Book.released.filter(id=book_id).values_list("updated", flat=True).first()
+    return last_modified_from_dates(updated)
+
+
+def chapters_last_modified(request, book_id, **kwargs):
+    dates = Book.released.filter(id=book_id).aggregate(
+        book=Max("updated"), chapter=Max("chapters__updated")
+    )
+    return last_modified_from_dates(*dates.values())
+
+
+def book_pages_last_modified(request, book_id, **kwargs):
+    dates = Book.released.filter(id=book_id).aggregate(
+        book=Max("updated"),
+        chapter=Max("chapters__updated"),
+        page=Max("chapters__pages__updated"),
+    )
+    return last_modified_from_dates(*dates.values())
+
+
+def pages_last_modified(request, book_id, chapter_number, **kwargs):
+    dates = Chapter.objects.filter(
+        book__in=Book.released.filter(id=book_id), chapter_number=chapter_number
+    ).aggregate(
+        book=Max("book__updated"), chapter=Max("updated"), page=Max("pages__updated")
+    )
+    return last_modified_from_dates(*dates.values())
+
+
 @router.get("/get_all_books", response=PaginatedBooksSchema)
-@cache_page(60 * 60)
-def get_all_books(request, limit: int = 1, offset: int = 0):
+@cache_tagged("catalog")
+def get_all_books(
+    request,
+    limit: int = Query(1, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: str = None,
+):
     try:
-        books = Book.released.all()
-        if limit * offset >= len(books):
+        books = Book.released.for_listing()
+        if cursor is not None:
+            # keyset pagination, pass an empty cursor to fetch the first page
+            try:
+                books, next_cursor = paginate_keyset(books, ["title", "id"], cursor, limit)
+            except ValueError as e:
+                return api_response(
+                    success=False, message="Invalid cursor", error=e, status_code=400
+                )
+            if not books:
+                return api_response(
+                    success=False,
+                    message="This page is empty",
+                    error="empty page",
+                    status_code=404,
+                )
+            books_data = [BookSchema.from_orm(book) for book in books]
+            return api_response(
+                success=True,
+                message="all books fetched successfully",
+                payload={"books": books_data, "next_cursor": next_cursor},
+            )
+
+        page = paginate_offset(books, limit, offset)
+        if page is None:
             return api_response(
                 success=False,
                 message="This page is empty",
                 error="empty page",
                 status_code=404,
             )
-        if len(books) == limit * offset + limit:
-            next = -1
-        elif len(books) < limit * offset + limit and len(books) >= limit * offset:
-            next = -1
-            limit = len(books) % limit
-        else:
-            next = offset + 1
-        if offset == 0:
-            prev = -1
-        else:
-            prev = offset - 1
-
-        books = books[offset * limit : offset * limit + limit]
+        books, next, prev = page
         books_data = [BookSchema.from_orm(book) for book in books]
         # return books_data
         return api_response(
             success=True,
             message="all books fetched successfully",
-            payload={"books": books_data, "next_page": next, "perv_page": prev},
+            payload={"books": books_data, **page_links(next, prev)},
         )
 
     except Exception as e:
@@ -62,11 +136,44 @@ def get_all_books(request, limit: int = 1, offset: int = 0):
         )
 
 
+@router.get("/search", response=SearchResultsSchema)
+def search_books(request, q: str, limit: int = 10):
+    if not q.strip():
+        return api_response(
+            success=False,
+            message="Search query is empty",
+            error="empty query",
+            status_code=400,
+        )
+    try:
+        books = books_search.search_books(q, limit=min(max(limit, 1), 50))
+        results = [
+            {
+                "book": BookSchema.from_orm(book),
+                "rank": book.rank,
+                "headline": book.headline,
+                "page_id": book.page_id,
+                "page_headline": book.page_headline,
+            }
+            for book in books
+        ]
+        return api_response(
+            success=True,
+            message="search results fetched successfully",
+            payload={"results": results},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
 @router.get("/get_book", response=SingleBookSchema)
-@cache_page(60 * 60)
+@conditional_tagged("book:{book_id}")
+@cache_tagged("book:{book_id}", last_modified_func=book_last_modified)
 def get_book(request, book_id: int):
     try:
-        book = Book.released.get(id=book_id)
+        book = Book.released.for_listing().get(id=book_id)
         book_data = BookSchema.from_orm(book)
         return api_response(
             success=True,
@@ -84,14 +191,15 @@ def get_book(request, book_id: int):
 
 
 @router.get("/top_books", response=TopBooksSchema)
-@cache_page(60 * 60)
-def top_books(request):
+@cache_tagged("catalog")
+def top_books(request, n: int = 3, genre_id: int = None):
     try:
-        # TODO: use rating to pick top 3 books after rating implementation completed
-        books = Book.released.all().order_by("-rating", "published")
-        if len(books) > 3:
-            books = books[0:3]
-        books_data = [BookSchema.from_orm(book) for book in books]
+        # ranked by bayesian average rating, see books.leaderboard
+        book_ids = get_leaderboard().top(min(max(n, 0), 100), genre_id)
+        books = Book.released.for_listing().in_bulk(book_ids)
+        books_data = [
+            BookSchema.from_orm(books[book_id]) for book_id in book_ids if book_id in books
+        ]
         return api_response(
             success=True,
             message="top books fetched successfully",
@@ -107,7 +215,8 @@ def top_books(request):
 
 
 @router.get("/get_book_chapters", response=BookChaptersSchema)
-@cache_page(60 * 60)
+@conditional_tagged("book:{book_id}")
+@cache_tagged("book:{book_id}", last_modified_func=chapters_last_modified)
 def get_book_chapters(request, book_id: int):
     try:
         book = Book.released.get(id=book_id)
@@ -126,11 +235,12 @@ def get_book_chapters(request, book_id: int):
 
 
 @router.get("/get_chapter_pages", response=BookPagesSchema)
-@cache_page(60*60)
+@conditional_tagged("book:{book_id}")
+@cache_tagged("book:{book_id}", last_modified_func=pages_last_modified)
 def get_chapter_pages(request, book_id: int, chapter_number: int):
     try:
         book = Book.released.get(id=book_id)
-        pages = book.chapters.get(chapter_number=chapter_number).pages.all()
+        pages = book.chapters.get(chapter_number=chapter_number).pages.for_reading()
         pages_data = [PageSchema.from_orm(page) for page in pages]
 
         return api_response(
@@ -144,11 +254,374 @@ def get_chapter_pages(request, book_id: int, chapter_number: int):
         )
 
 
-@router.get("/get_genres", response=List[GenreSchema])
+MAX_PAGE_WINDOW = 100
+
+
+@router.get("/get_pages", response=PageWindowResponseSchema)
+@conditional_tagged("book:{book_id}")
+@cache_tagged("book:{book_id}", last_modified_func=book_pages_last_modified)
+def get_pages(
+    request, book_id: int, start: int = 1, end: int = None, metadata_only: bool = False
+):
+    """
+    Pages `start` to `end` (1-based positions in the whole book, both
+    included) across chapter boundaries, in reading order. At most
+    MAX_PAGE_WINDOW pages per call; the window that follows is given as
+    `next_start` and in a `Link: rel=next` header.
+    """
+    if end is None:
+        end = start + 19
+    if start < 1 or end < start:
+        return api_response(
+            success=False,
+            message="Invalid page range.",
+            error="start must be at least 1 and end at least start",
+            status_code=400,
+        )
+    end = min(end, start + MAX_PAGE_WINDOW - 1)
+    try:
+        pages = (
+            Page.objects.filter(chapter__book__in=Book.released.filter(id=book_id))
+            .annotate(chapter_number=F("chapter__chapter_number"))
+            .order_by("chapter__chapter_number", "page_number")
+        )
+        if metadata_only:
+            pages = pages.only("id", "chapter_id", "title", "page_number", "updated")
+            schema = PageMetaSchema
+        else:
+            pages = pages.for_reading()
+            schema = PageWindowSchema
+        # one row more tells whether there is a next window
+        pages = list(pages[start - 1 : end + 1])
+        if not pages and not Book.released.filter(id=book_id).exists():
+            return api_response(
+                success=False,
+                message="Book not found.",
+                error="No book with this book id exists.",
+                status_code=404,
+            )
+        next_start = end + 1 if len(pages) > end - start + 1 else None
+        pages_data = []
+        for position, page in enumerate(pages[: end - start + 1], start=start):
+            page.position = position
+            pages_data.append(schema.from_orm(page))
+
+        response = api_response(
+            success=True,
+            message="pages fetched successfully",
+            payload={"pages": pages_data, "next_start": next_start},
+        )
+        if next_start is not None:
+            query = request.GET.copy()
+            query["start"] = next_start
+            query["end"] = next_start + end - start
+            response["Link"] = f'<{request.path}?{query.urlencode()}>; rel="next"'
+        return response
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
+
+
+@router.get("/export_book")
+def export_book(request, book_id: int):
+    """
+    Stream the whole chapter/page tree of a released book as NDJSON: one book
+    record, then each chapter record followed by its pages.
+    """
+    try:
+        book = Book.released.get(id=book_id)
+    except Book.DoesNotExist:
+        return api_response(
+            success=False,
+            message="Book not found.",
+            error="No book with this book id exists.",
+            status_code=404,
+        )
+    lines = (
+        json.dumps(record, ensure_ascii=False) + "\n"
+        for record in book.iter_book_contents()
+    )
+    response = StreamingHttpResponse(lines, content_type="application/x-ndjson; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="book-{book.id}.ndjson"'
+    return response
+
+
+@router.get("/export_epub")
+def export_epub(request, book_id: int):
+    """
+    Redirect to the EPUB of a released book. Exports are built in the
+    background and kept under a digest of the book's contents; until the
+    current one is built this answers 202 with a Retry-After header.
+    """
+    try:
+        book = Book.released.get(id=book_id)
+    except Book.DoesNotExist:
+        return api_response(
+            success=False,
+            message="Book not found.",
+            error="No book with this book id exists.",
+            status_code=404,
+        )
+    digest = exports.export_digest(book)
+    if exports.ensure_epub(book, digest):
+        return redirect(
+            reverse(
+                f"{request.resolver_match.namespace}:download_export",
+                kwargs={"digest": digest},
+            )
+        )
+    response = api_response(
+        success=True,
+        message="The export is being built, try again shortly.",
+        payload={"status": "building"},
+        status_code=202,
+    )
+    response["Retry-After"] = "5"
+    return response
+
+
+@router.get("/exports/{digest}.epub", url_name="download_export")
+def download_export(request, digest: str):
+    """
+    Serve a built EPUB. The URL changes with the contents, so it is cached
+    for good.
+    """
+    if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        raise Http404
+    path = exports.export_path(digest)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        raise Http404
+    # keeps recently downloaded exports from collect_exports
+    os.utime(path)
+    response = FileResponse(
+        f,
+        as_attachment=True,
+        filename=f"book-{digest[:12]}.epub",
+        content_type="application/epub+zip",
+    )
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@router.post("/import", response=ApiResponseSchema, auth=CustomJWTAuth())
+def import_book_archive(
+    request, archive: UploadedFile = File(...), book_id: int = None, prune: bool = False
+):
+    """
+    Import a zip or tar archive of chapter directories holding Markdown or
+    HTML pages (see books.importer) into the book `book_id`, the book with
+    the same title or a new draft. Pruning needs `book_id`. The import is
+    queued for the run_book_imports worker: this answers 202 with the URL
+    of its state. Staff only.
+    """
+    if not request.user.is_staff:
+        return api_response(
+            success=False,
+            message="Access Denied.",
+            error="Only staff can import books",
+            status_code=403,
+        )
+    if archive.size > settings.IMPORT_MAX_UPLOAD_SIZE:
+        return api_response(
+            success=False,
+            message="Archive too large.",
+            error=f"Archives are limited to {settings.IMPORT_MAX_UPLOAD_SIZE} bytes.",
+            status_code=413,
+        )
+    if prune and book_id is None:
+        return api_response(
+            success=False,
+            message="Invalid book archive.",
+            error="Pruning needs the book_id of the book to import into.",
+            status_code=400,
+        )
+    book = None
+    if book_id is not None:
+        try:
+            book = Book.objects.get(id=book_id)
+        except Book.DoesNotExist:
+            return api_response(
+                success=False,
+                message="Book not found.",
+                error="No book with this book id exists.",
+                status_code=404,
+            )
+    job = importer.queue_import(
+        archive, book=book, prune=prune, requested_by=request.user
+    )
+    if job.status == "f":
+        # BACKGROUND_WORKERS = 0 imports right away
+        return api_response(
+            success=False, message="Invalid book archive.", error=job.error, status_code=400
+        )
+    response = api_response(
+        success=True,
+        message="Book import queued.",
+        payload=_import_state(job),
+        status_code=202,
+    )
+    response["Location"] = reverse(
+        f"{request.resolver_match.namespace}:import_state", kwargs={"job_id": job.id}
+    )
+    return response
+
+
+def _import_state(job):
+    return {
+        "job_id": job.id,
+        "status": job.get_status_display(),
+        "stats": job.stats,
+        "error": job.error,
+    }
+
+
+@router.get(
+    "/import/{job_id}",
+    response=ApiResponseSchema,
+    auth=CustomJWTAuth(),
+    url_name="import_state",
+)
+def get_import_state(request, job_id: int):
+    """
+    State of a book import queued with /import: pending, running, done (with
+    its counts) or failed (with the reason). Staff only.
+    """
+    if not request.user.is_staff:
+        return api_response(
+            success=False,
+            message="Access Denied.",
+            error="Only staff can import books",
+            status_code=403,
+        )
+    job = BookImport.objects.filter(pk=job_id).first()
+    if job is None:
+        return api_response(
+            success=False,
+            message="Import not found.",
+            error="No import with this job id exists.",
+            status_code=404,
+        )
+    return api_response(
+        success=True,
+        message=f"Import {job.get_status_display()}.",
+        payload=_import_state(job),
+    )
+
+
+@router.post("/progress", response=ReadingProgressResponseSchema, auth=CustomJWTAuth())
+def report_progress(request, data: ReadingProgressInSchema):
+    """
+    Report where the user is in a book. Clients send this every few seconds
+    while reading; reports are buffered and written to the database in bulk,
+    so ids that do not belong to a released book are only dropped then.
+    """
+    progress = reading_progress.record_progress(
+        request.user.id,
+        data.book_id,
+        chapter_id=data.chapter_id,
+        page_id=data.page_id,
+        percent=data.percent,
+    )
+    return api_response(
+        success=True,
+        message="Progress saved.",
+        payload={
+            "book_id": data.book_id,
+            "chapter_id": data.chapter_id,
+            "page_id": data.page_id,
+            "percent": data.percent,
+            "updated": datetime.datetime.fromtimestamp(progress["at"] / 1000, datetime.timezone.utc),
+        },
+    )
+
+
+@router.get("/progress", response=ReadingProgressResponseSchema, auth=CustomJWTAuth())
+def get_progress(request, book_id: int):
+    progress = reading_progress.get_progress(request.user.id, book_id)
+    if progress is None:
+        return api_response(
+            success=False,
+            message="No progress yet.",
+            error="The user has not started this book.",
+            status_code=404,
+        )
+    return api_response(
+        success=True,
+        message="Progress fetched successfully.",
+        payload={"book_id": book_id, **progress},
+    )
+
+
+@router.get("/get_genres", response=GenresResponseSchema)
+@cache_tagged("genres", "catalog")
 def get_genres(request):
-    pass
+    """
+    All genres with the number of released books in each, counted from the
+    per-genre leaderboards rather than through the genre table.
+    """
+    try:
+        genres = list(Genre.objects.order_by("title"))
+        counts = get_leaderboard().counts(genre.id for genre in genres)
+        genres_data = []
+        for genre in genres:
+            genre.book_count = counts[genre.id]
+            genres_data.append(GenreListingSchema.from_orm(genre))
+        return api_response(
+            success=True,
+            message="genres fetched successfully",
+            payload={"genres": genres_data},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
 
 
-@router.get("/get_genre_books", response=List[BookSchema])
-def get_genre_books(request):
-    pass
+@router.get("/get_genre_books", response=PaginatedBooksSchema)
+@cache_tagged("catalog")
+def get_genre_books(
+    request,
+    genre_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Released books of a genre, best rated first (see books.leaderboard),
+    `limit` per page.
+    """
+    try:
+        # one id more tells whether there is a next page
+        book_ids = get_leaderboard().page(offset * limit, limit + 1, genre_id)
+        if not book_ids:
+            if not Genre.objects.filter(id=genre_id).exists():
+                return api_response(
+                    success=False,
+                    message="Genre not found.",
+                    error="No genre with this genre id exists.",
+                    status_code=404,
+                )
+            return api_response(
+                success=False,
+                message="This page is empty",
+                error="empty page",
+                status_code=404,
+            )
+        next_page = offset + 1 if len(book_ids) > limit else -1
+        prev_page = offset - 1 if offset > 0 else -1
+        book_ids = book_ids[:limit]
+        books = Book.released.for_listing().in_bulk(book_ids)
+        books_data = [
+            BookSchema.from_orm(books[book_id]) for book_id in book_ids if book_id in books
+        ]
+        return api_response(
+            success=True,
+            message="genre books fetched successfully",
+            payload={"books": books_data, "next_page": next_page, "prev_page": prev_page},
+        )
+    except Exception as e:
+        return api_response(
+            success=False, message="Error occurd", error=e, status_code=503
+        )
@@ -1,6 +1,7 @@
-from typing import List
+import datetime
+from typing import List, Optional
 from ninja import Field, ModelSchema, Schema
-from api.schema import ApiResponseSchema, DataSchema
+from api.schema import ApiResponseSchema, DataSchema, GenreSchema
 from books.models import Book, Chapter, Page
 
 
@@ -18,6 +19,8 @@ class BookSchema(ModelSchema):
         ]
 
     rating: str = Field(alias="average_rating", default=None)
+    cover_srcset: Optional[dict[str, str]] = Field(alias="get_cover_srcset", default=None)
+    cover_placeholder: Optional[str] = Field(alias="get_cover_placeholder", default=None)
 
 
 class SingleBookDataSchema(DataSchema):
@@ -42,8 +45,9 @@ class TopBooksSchema(ApiResponseSchema):
 
 class PaginatedBooks(Schema):
     books: list[BookSchema]
-    next_page: int
-    prev_page: int
+    next_page: Optional[int] = None
+    prev_page: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 
 class PaginatedBooksDataSchema(DataSchema):
@@ -54,6 +58,26 @@ class PaginatedBooksSchema(ApiResponseSchema):
     data: PaginatedBooksDataSchema
 
 
+class SearchResultSchema(Schema):
+    book: BookSchema
+    rank: float
+    headline: str
+    page_id: Optional[int] = None
+    page_headline: Optional[str] = None
+
+
+class SearchResults(Schema):
+    results: list[SearchResultSchema]
+
+
+class SearchResultsDataSchema(DataSchema):
+    payload: SearchResults
+
+
+class SearchResultsSchema(ApiResponseSchema):
+    data: SearchResultsDataSchema
+
+
 class ChapterSchema(ModelSchema):
     class Meta:
         model = Chapter
@@ -84,3 +108,57 @@ class PageDataSchema(DataSchema):
 class BookPagesSchema(ApiResponseSchema):
     data:PageDataSchema
 
+class PageMetaSchema(ModelSchema):
+    class Meta:
+        model = Page
+        fields = ["id", "chapter", "title", "page_number", "updated"]
+
+    # 1-based position of the page in the whole book
+    position: int
+    chapter_number: int
+
+class PageWindowSchema(PageMetaSchema):
+    content: str = Field(alias="get_content", default=None)
+
+class PageWindow(Schema):
+    pages:list[PageWindowSchema]
+    next_start:Optional[int] = None
+
+class PageWindowDataSchema(DataSchema):
+    payload:PageWindow
+
+class PageWindowResponseSchema(ApiResponseSchema):
+    data:PageWindowDataSchema
+
+
+class ReadingProgressInSchema(Schema):
+    book_id:int
+    chapter_id:Optional[int] = None
+    page_id:Optional[int] = None
+    percent:float = Field(ge=0, le=100)
+
+class ReadingProgressSchema(Schema):
+    book_id:int
+    chapter_id:Optional[int] = None
+    page_id:Optional[int] = None
+    percent:float
+    updated:datetime.datetime
+
+class ReadingProgressDataSchema(DataSchema):
+    payload:ReadingProgressSchema
+
+class ReadingProgressResponseSchema(ApiResponseSchema):
+    data:ReadingProgressDataSchema
+
+class GenreListingSchema(GenreSchema):
+    # number of released books in the genre
+    book_count:int = 0
+
+class GenresSchema(Schema):
+    genres:list[GenreListingSchema]
+
+class GenresDataSchema(DataSchema):
+    payload:GenresSchema
+
+class GenresResponseSchema(ApiResponseSchema):
+    data:GenresDataSchema
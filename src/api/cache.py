@@ -0,0 +1,209 @@
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.views.decorators.cache import cache_page
+
+VERSION_KEY = "api_cache_version:{}"
+
+
+def get_tag_versions(tags):
+    """
+    Return the current version of every tag, reading them in one round trip.
+
+    A missing version (never bumped, or evicted) is seeded with the current
+    time so it can never collide with a version used before the eviction.
+    """
+    keys = [VERSION_KEY.format(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+async def aget_tag_versions(tags):
+    """
+    Async version of `get_tag_versions`.
+    """
+    keys = [VERSION_KEY.format(tag) for tag in tags]
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+        versions.update(await cache.aget_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump_tags(*tags):
+    """
+    Invalidate every cached response tagged with one of `tags`.
+    """
+    for tag in set(tags):
+        key = VERSION_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_tags_on_commit(*tags):
+    """
+    Bump `tags` once the current transaction commits, so a concurrent request
+    cannot cache the old data again between the bump and the commit.
+    """
+    transaction.on_commit(lambda: bump_tags(*tags))
+
+
+def patch_client_caching(response):
+    """
+    Responses stay in the server cache for API_CACHE_TIMEOUT, where a change
+    invalidates them. Clients and shared caches cannot be told about changes,
+    so they may only keep a response for API_CLIENT_MAX_AGE seconds and must
+    revalidate it afterwards.
+    """
+    patch_cache_control(
+        response, max_age=settings.API_CLIENT_MAX_AGE, must_revalidate=True
+    )
+    if "Expires" in response:
+        del response["Expires"]
+
+
+def cache_tagged(*tags, timeout=None, last_modified_func=None):
+    """
+    Like `cache_page`, but the cache key includes the version of each tag so
+    responses can be invalidated with `bump_tags`.
+
+    Tags may reference the view's keyword arguments, e.g. "book:{book_id}".
+    `last_modified_func(request, **kwargs)` is only called on a miss, its
+    result is stored as the Last-Modified header of the cached response (see
+    `conditional_tagged`).
+
+    The server cache keeps responses for `timeout` (API_CACHE_TIMEOUT by
+    default), clients for API_CLIENT_MAX_AGE (see `patch_client_caching`).
+
+    Sets `request.api_cache_result` to "hit" or "miss" for the metrics
+    middleware.
+    """
+    def decorator(view_func):
+        def view_on_miss(request, *args, **kwargs):
+            request.api_cache_result = "miss"
+            response = view_func(request, *args, **kwargs)
+            if last_modified_func is not None and response.status_code == 200:
+                last_modified = last_modified_func(request, *args, **kwargs)
+                if last_modified is not None:
+                    response["Last-Modified"] = http_date(last_modified.timestamp())
+            return response
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            resolved = [tag.format(**kwargs) for tag in tags]
+            versions = get_tag_versions(resolved)
+            key_prefix = "api:" + ",".join(
+                f"{tag}@{version}" for tag, version in zip(resolved, versions)
+            )
+            cached_view = cache_page(
+                timeout or settings.API_CACHE_TIMEOUT, key_prefix=key_prefix
+            )(view_on_miss)
+            request.api_cache_result = "hit"
+            response = cached_view(request, *args, **kwargs)
+            if response.status_code == 200:
+                # cache_page hands out its own timeout as the max-age
+                patch_client_caching(response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def conditional_tagged(*tags):
+    """
+    Answer conditional GETs for a view whose content is invalidated through
+    `tags` with 304 Not Modified.
+
+    The strong ETag is derived from the tag versions and the full path, so
+    If-None-Match is answered before the view (or `cache_tagged`) runs, at
+    the cost of one cache round trip. If-Modified-Since is checked against
+    the Last-Modified header of the response, which `cache_tagged` stores
+    with the cached response, so neither costs a database query on a hit.
+    Responses are marked for revalidation (see `patch_client_caching`).
+    """
+    def etag_func(request, **kwargs):
+        resolved = [tag.format(**kwargs) for tag in tags]
+        versions = get_tag_versions(resolved)
+        state = "{}|{}".format(
+            ",".join(f"{tag}@{version}" for tag, version in zip(resolved, versions)),
+            request.get_full_path(),
+        )
+        return quote_etag(hashlib.sha1(state.encode()).hexdigest())
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+            etag = etag_func(request, **kwargs)
+            if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+            if etag in [tag.removeprefix("W/") for tag in if_none_match]:
+                response = HttpResponseNotModified()
+            else:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                last_modified = response.get("Last-Modified")
+                response = get_conditional_response(
+                    request,
+                    etag=etag,
+                    last_modified=last_modified and parse_http_date_safe(last_modified),
+                    response=response,
+                )
+            if response.status_code in (200, 304):
+                response["ETag"] = etag
+                patch_client_caching(response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def acache_tagged(*tags, timeout=None):
+    """
+    Async counterpart of `cache_tagged`, for async views. Reads and writes
+    the cache through the async cache API.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view_func(request, *args, **kwargs)
+            resolved = [tag.format(**kwargs) for tag in tags]
+            versions = await aget_tag_versions(resolved)
+            url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+            key = "api:async:{}:{}".format(
+                ",".join(f"{tag}@{version}" for tag, version in zip(resolved, versions)),
+                url,
+            )
+            response = await cache.aget(key)
+            if response is not None:
+                request.api_cache_result = "hit"
+                return response
+            request.api_cache_result = "miss"
+            response = await view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                patch_client_caching(response)
+                await cache.aset(key, response, timeout or settings.API_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+
+    return decorator
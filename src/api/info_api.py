@@ -2,6 +2,7 @@ from ninja import Router
 from api.info_schema import AnnouncementSchema, ContactUsMessage, ContactUsSchema, SingleAnnouncementSchema
 from announcement.models import Announcement, ContactUs
 from api.schema import ApiResponseSchema
+from api.throttling import AnonSlidingWindowThrottle
 from api.utils import api_response
 
 # ============================
@@ -26,7 +27,11 @@ def get_announcement(request):
             success=False, message="Error occurd", error=e, status_code=503
         )
 
-@router.post("/contact-us", response=ContactUsSchema)
+@router.post(
+    "/contact-us",
+    response=ContactUsSchema,
+    throttle=AnonSlidingWindowThrottle("3/m", scope="contact-us"),
+)
 def contact_us(request, payload: ContactUsMessage):
     try:
         contact = ContactUs.objects.create(
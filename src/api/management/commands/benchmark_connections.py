@@ -0,0 +1,84 @@
+import copy
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+MODES = ("close", "persistent", "pool")
+
+
+def mode_settings(mode):
+    """
+    The default database settings with the connection handling of `mode`,
+    as core.settings configures it for DATABASE_CONNECTIONS.
+    """
+    database = copy.deepcopy(settings.DATABASES["default"])
+    database["CONN_MAX_AGE"] = 0
+    database["CONN_HEALTH_CHECKS"] = False
+    options = database.setdefault("OPTIONS", {})
+    options.pop("pool", None)
+    if mode == "persistent":
+        database["CONN_MAX_AGE"] = 600
+        database["CONN_HEALTH_CHECKS"] = True
+    elif mode == "pool":
+        options["pool"] = {"min_size": 2, "max_size": 10}
+    return database
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request database overhead of each DATABASE_CONNECTIONS "
+        "mode: every simulated request runs one cheap query between the "
+        "connection handling Django does at request start and finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--threads", type=int, default=1, help="Concurrent request threads, as in threaded or ASGI workers."
+        )
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+
+    def handle(self, *args, **options):
+        per_thread = max(options["requests"] // options["threads"], 1)
+        for mode in options["modes"]:
+            # an alias of its own, so a pool is not shared with the default connection
+            alias = f"benchmark_{mode}"
+            connections.settings[alias] = connections.configure_settings(
+                {"default": connections.settings["default"], alias: mode_settings(mode)}
+            )[alias]
+            timings = []
+            lock = threading.Lock()
+
+            def run():
+                connection = connections[alias]
+                own = []
+                for _ in range(per_thread):
+                    started = time.perf_counter()
+                    # what django.db.close_old_connections does on request_started
+                    # and request_finished
+                    connection.close_if_unusable_or_obsolete()
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                        cursor.fetchone()
+                    connection.close_if_unusable_or_obsolete()
+                    own.append(time.perf_counter() - started)
+                connection.close()
+                with lock:
+                    timings.extend(own)
+
+            threads = [threading.Thread(target=run) for _ in range(options["threads"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if mode == "pool":
+                connections[alias].close_pool()
+            del connections.settings[alias]
+
+            timings.sort()
+            self.stdout.write(
+                f"{mode:12} median {timings[len(timings) // 2] * 1000:7.2f} ms  "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1000:7.2f} ms"
+            )
@@ -0,0 +1,69 @@
+import datetime
+import json
+import time
+from django.core.management.base import BaseCommand
+from ninja.responses import Response
+from api.book_schema import BookSchema
+from api.schema import ApiResponseSchema, DataSchema, ErrorSchema
+from api.utils import api_response
+
+
+def legacy_api_response(success, message, payload=None, error=None, status_code=200):
+    # api_response before it built the envelope as a plain dict
+    error_message = error.__str__() if error else None
+    response_structure = ApiResponseSchema(
+        status="success" if success else "error",
+        data=DataSchema(
+            message=message,
+            payload=payload if success else None,
+            error=ErrorSchema(details=error_message) if not success else None,
+        ),
+    )
+    return Response(response_structure.dict(), status=status_code)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-response overhead of building and serializing the API "
+        "envelope, legacy pydantic path vs the current one. Needs no database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=100)
+        parser.add_argument("--iterations", type=int, default=500)
+
+    def handle(self, *args, **options):
+        books = [
+            BookSchema(
+                id=i,
+                title=f"کتاب شماره {i}",
+                description="توضیحات کتاب " * 20,
+                genre=[1, 2],
+                authors=[i % 7 + 1],
+                cover_image=f"book_covers/{i}.jpg",
+                published=datetime.date(2024, 1, 1),
+                average_rating="4.2",
+                get_cover_srcset={"160": f"/media/book_covers/{i}-160w.webp"},
+                get_cover_placeholder=None,
+            )
+            for i in range(options["books"])
+        ]
+        payload = {"books": books, "next_page": 2, "perv_page": None}
+
+        legacy = legacy_api_response(True, "all books fetched successfully", payload)
+        current = api_response(True, "all books fetched successfully", payload)
+        if json.loads(legacy.content) != json.loads(current.content):
+            self.stderr.write("The two paths produce different JSON!")
+
+        for label, func in (("legacy", legacy_api_response), ("current", api_response)):
+            timings = []
+            for _ in range(options["iterations"]):
+                started = time.perf_counter()
+                response = func(True, "all books fetched successfully", payload)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f"{label:8} median {timings[len(timings) // 2] * 1e6:8.0f} us  "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1e6:8.0f} us  "
+                f"{len(response.content)} bytes"
+            )
@@ -0,0 +1,48 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from ninja.throttling import AnonRateThrottle
+from api.throttling import AnonSlidingWindowThrottle
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request overhead of throttling: Ninja's cache based "
+        "AnonRateThrottle vs the sliding window throttle, against the "
+        "configured cache and THROTTLE_BACKEND."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checks", type=int, default=10000)
+        parser.add_argument("--clients", type=int, default=100)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        requests = [
+            factory.get("/", REMOTE_ADDR=f"10.0.{i // 256}.{i % 256}")
+            for i in range(options["clients"])
+        ]
+        # rates high enough that nothing is refused, only the checks are timed
+        throttles = [
+            (
+                f"ninja ({settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]})",
+                AnonRateThrottle("1000000/m"),
+            ),
+            (
+                f"sliding window ({settings.THROTTLE_BACKEND})",
+                AnonSlidingWindowThrottle("1000000/m", scope="benchmark"),
+            ),
+        ]
+        for label, throttle in throttles:
+            timings = []
+            for i in range(options["checks"]):
+                request = requests[i % len(requests)]
+                started = time.perf_counter()
+                throttle.allow_request(request)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f"{label:32} median {timings[len(timings) // 2] * 1e6:7.0f} us  "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1e6:7.0f} us"
+            )
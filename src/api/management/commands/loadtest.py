@@ -0,0 +1,65 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = [
+    "books/get_all_books?limit=20",
+    "books/top_books?n=10",
+    "authors/get_all_authors?limit=20",
+    "info/get_announcement",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent GET requests at a running server and report requests/sec "
+        "and latency percentiles for the sync endpoints and their /async/ twins."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000/api/v1/")
+        parser.add_argument("--path", action="append", dest="paths")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or DEFAULT_PATHS
+        for label, prefix in (("sync", ""), ("async", "async/")):
+            urls = [options["base_url"] + prefix + path for path in paths]
+            self.report(label, *self.run(urls, options["requests"], options["concurrency"]))
+
+    def run(self, urls, requests, concurrency):
+        def fetch(i):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urls[i % len(urls)], timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = "error"
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(fetch, range(requests)))
+        return results, time.perf_counter() - started
+
+    def report(self, label, results, elapsed):
+        latencies = sorted(latency * 1000 for _, latency in results)
+        statuses = Counter(status for status, _ in results)
+        self.stdout.write(
+            "{label:>5}: {rps:8.1f} req/s  p50 {p50:7.1f}ms  p99 {p99:7.1f}ms  "
+            "statuses {statuses}".format(
+                label=label,
+                rps=len(results) / elapsed,
+                p50=statistics.median(latencies),
+                p99=latencies[max(int(len(latencies) * 0.99) - 1, 0)],
+                statuses=dict(statuses),
+            )
+        )
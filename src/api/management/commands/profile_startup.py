@@ -0,0 +1,84 @@
+import json
+import subprocess
+import sys
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter, this process has imported everything already.
+# Times what a Gunicorn worker does before serving its first request.
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import django
+django.setup()
+ready = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls = time.perf_counter()
+from django.core.handlers.wsgi import WSGIHandler
+WSGIHandler()
+handler = time.perf_counter()
+print(json.dumps({
+    "django.setup() (settings, models, AppConfig.ready)": ready - started,
+    "URLconf (routers, views, schemas)": urls - ready,
+    "middleware": handler - urls,
+    "total": handler - started,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Parse the `-X importtime` report into {module: (self us, cumulative us)}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Report where a worker's startup time goes: the phases up to serving "
+        "the first request, the slowest imports and the import time of each "
+        "top-level package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20)
+
+    def handle(self, *args, **options):
+        # inherits DJANGO_SETTINGS_MODULE, set by manage.py
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            self.stderr.write(result.stderr[-2000:])
+            return
+        phases = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr)
+
+        self.stdout.write("Startup phases:")
+        for phase, seconds in phases.items():
+            self.stdout.write(f"  {phase:52} {seconds * 1000:8.1f} ms")
+
+        self.stdout.write(f"\nSlowest imports (cumulative, top {options['top']}):")
+        slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in slowest[: options["top"]]:
+            self.stdout.write(f"  {name:52} {cumulative_us / 1000:8.1f} ms")
+
+        packages = {}
+        for name, (self_us, _) in modules.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_us
+        self.stdout.write(f"\nImport time by package (top {options['top']}):")
+        for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[
+            : options["top"]
+        ]:
+            self.stdout.write(f"  {package:52} {self_us / 1000:8.1f} ms")
@@ -0,0 +1,38 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from api.models import OutboxEmail
+from api.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = "Send the emails queued in the outbox, in batches, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--interval", type=float, default=5, help="Seconds to wait when the outbox is empty."
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Send what is due now and exit."
+        )
+        parser.add_argument(
+            "--keep-days", type=int, default=30, help="Delete sent emails older than this."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            handled = send_pending(options["batch_size"])
+            if handled:
+                self.stdout.write(f"Handled {handled} email(s).")
+                continue
+            OutboxEmail.objects.filter(
+                status="s",
+                sent_at__lt=timezone.now() - datetime.timedelta(days=options["keep_days"]),
+            ).delete()
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
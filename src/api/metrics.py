@@ -0,0 +1,40 @@
+from prometheus_client import Counter, Histogram
+
+# Under gunicorn these are aggregated across workers through the files in
+# PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py), otherwise they live in
+# the default registry of the process.
+
+REQUEST_LATENCY = Histogram(
+    "api_request_duration_seconds",
+    "Time spent serving a request.",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    "api_requests_total",
+    "Requests served, by status code.",
+    ["method", "route", "status"],
+)
+DB_QUERIES = Histogram(
+    "api_request_db_queries",
+    "Database queries run while serving a request.",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "api_request_db_duration_seconds",
+    "Time spent in database queries while serving a request.",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+RESPONSE_CACHE = Counter(
+    "api_response_cache_total",
+    "Lookups in the response cache of cache_tagged views, by result.",
+    ["route", "result"],
+)
+RESPONSE_SIZE = Histogram(
+    "api_response_size_bytes",
+    "Size of non-streaming response bodies.",
+    ["route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
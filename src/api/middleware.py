@@ -1,4 +1,15 @@
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.utils.deprecation import MiddlewareMixin
+from .metrics import (
+    DB_QUERIES,
+    DB_TIME,
+    REQUEST_LATENCY,
+    REQUESTS,
+    RESPONSE_CACHE,
+    RESPONSE_SIZE,
+)
 from .utils import api_response
 from ninja.errors import HttpError
 from django.http import JsonResponse
@@ -17,4 +28,95 @@ class FormatExceptionMiddleware(MiddlewareMixin):
                     message=exception.message,
                     error=str(exception),
                     status_code=exception.status_code
-                )
\ No newline at end of file
+                )
+
+
+class QueryStats:
+    """
+    Database execute wrapper counting the queries of one request and the
+    time spent in them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+# QueryStats of the request being served. Context variables are copied into
+# the threads sync_to_async runs sync views and async ORM calls in, which
+# under ASGI have their own connections.
+request_query_stats = ContextVar("request_query_stats", default=None)
+
+
+def track_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection (see api.signals), adding
+    the query to the QueryStats of the current request, if any.
+    """
+    stats = request_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+class PrometheusMiddleware:
+    """
+    Record per-route latency, status, database and response cache usage and
+    response size, served in Prometheus format by api.views.metrics.
+
+    Routes are labelled with their URL pattern, unmatched paths share one
+    label so random URLs cannot blow up the number of series.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        started = time.perf_counter()
+        token = request_query_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_query_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        token = request_query_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_query_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, stats, duration):
+        match = request.resolver_match
+        route = match.route if match is not None else "<unmatched>"
+        REQUEST_LATENCY.labels(request.method, route).observe(duration)
+        REQUESTS.labels(request.method, route, response.status_code).inc()
+        DB_QUERIES.labels(route).observe(stats.count)
+        DB_TIME.labels(route).observe(stats.duration)
+        cache_result = getattr(request, "api_cache_result", None)
+        if cache_result is not None:
+            RESPONSE_CACHE.labels(route, cache_result).inc()
+        if not response.streaming:
+            RESPONSE_SIZE.labels(route).observe(len(response.content))
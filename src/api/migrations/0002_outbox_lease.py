@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboxemail',
+            name='outbox_pending_idx',
+        ),
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='status',
+            field=models.CharField(choices=[('p', 'pending'), ('l', 'sending'), ('s', 'sent'), ('f', 'failed')], default='p', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(condition=models.Q(('status__in', ['p', 'l'])), fields=['next_attempt_at'], name='outbox_due_idx'),
+        ),
+    ]
@@ -1,3 +1,42 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
-# Create your models here.
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the send_outbox command. Rows are written
+    in the transaction of the change that triggers them (see api.outbox).
+    """
+
+    STATUS_CHOICES = (
+        ("p", "pending"),
+        ("l", "sending"),
+        ("s", "sent"),
+        ("f", "failed"),
+    )
+    id = models.BigAutoField(primary_key=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="p")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # for emails being sent, when their worker's lease expires
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(status__in=["p", "l"]),
+                name="outbox_due_idx",
+            )
+        ]
@@ -0,0 +1,127 @@
+import datetime
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from api.models import OutboxEmail
+
+
+def queue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Drop-in for `send_mail` that writes the email to the outbox instead of
+    talking to the mail server. Call it inside the transaction of the change
+    the email is about: the email is sent if and only if it commits.
+    """
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff: OUTBOX_RETRY_DELAY seconds after the first failure,
+    doubling after each further one, at most a day.
+    """
+    return datetime.timedelta(
+        seconds=min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), 24 * 60 * 60)
+    )
+
+
+def claim_pending(batch_size=50):
+    """
+    Lease a batch of due emails to this worker in a short transaction.
+
+    The rows are locked with SKIP LOCKED while they are claimed, so several
+    workers can drain the outbox without sending an email twice. Claimed
+    rows are marked as sending until OUTBOX_LEASE seconds from now and
+    count one more attempt; if the worker dies before it reports back, they
+    are due again once the lease expires. Returns (emails, lease).
+    """
+    now = timezone.now()
+    lease = now + datetime.timedelta(seconds=settings.OUTBOX_LEASE)
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=["p", "l"], next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status="l", next_attempt_at=lease, attempts=F("attempts") + 1
+        )
+    for email in emails:
+        email.status, email.next_attempt_at = "l", lease
+        email.attempts += 1
+    return emails, lease
+
+
+def send_pending(batch_size=50):
+    """
+    Claim one batch of due emails and send it over a single mail server
+    connection, outside of any transaction, so a slow mail server does not
+    hold database locks. Returns the number of emails handled (sent or
+    rescheduled).
+    """
+    claimed_emails, lease = claim_pending(batch_size)
+    if not claimed_emails:
+        return 0
+
+    emails, sent, failed = [], [], []
+    for email in claimed_emails:
+        if email.attempts > settings.OUTBOX_MAX_ATTEMPTS:
+            # every worker that claimed it died before reporting back
+            _failed(email, "The email was interrupted too many times.")
+            failed.append(email)
+        else:
+            emails.append(email)
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # nothing can be sent, retry the whole batch later
+        for email in emails:
+            _failed(email, e)
+            failed.append(email)
+    else:
+        try:
+            for email in emails:
+                try:
+                    EmailMessage(
+                        subject=email.subject,
+                        body=email.body,
+                        from_email=email.from_email,
+                        to=email.to,
+                        connection=connection,
+                    ).send()
+                except Exception as e:
+                    _failed(email, e)
+                    failed.append(email)
+                else:
+                    sent.append(email.pk)
+        finally:
+            connection.close()
+
+    # rows whose lease expired meanwhile belong to another worker now
+    claimed = OutboxEmail.objects.filter(status="l", next_attempt_at=lease)
+    with transaction.atomic():
+        claimed.filter(pk__in=sent).update(status="s", sent_at=timezone.now())
+        for email in failed:
+            claimed.filter(pk=email.pk).update(
+                status=email.status,
+                next_attempt_at=email.next_attempt_at,
+                last_error=email.last_error,
+            )
+    return len(claimed_emails)
+
+
+def _failed(email, error):
+    # email.attempts already counts this attempt, see claim_pending
+    email.last_error = str(error)
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = "f"
+    else:
+        email.status = "p"
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
@@ -0,0 +1,29 @@
+import orjson
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+_fallback = NinjaJSONEncoder()
+
+
+def orjson_default(obj):
+    """
+    Called by orjson for types it cannot serialize natively: pydantic models
+    (schemas) are dumped, the rest (Decimal, lazy strings, ...) goes through
+    the encoder Ninja would have used.
+    """
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return _fallback.default(obj)
+
+
+def dumps(data):
+    return orjson.dumps(data, default=orjson_default, option=OPTIONS)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+
+    def render(self, request, data, *, response_status):
+        return dumps(data)
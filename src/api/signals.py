@@ -0,0 +1,153 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from ninja_jwt.settings import api_settings
+from api.auth import forget_cached_user
+from api.cache import bump_tags_on_commit
+from api.middleware import track_query
+from books.images import cover_derivatives_stored
+from books.importer import book_imported
+from books.models import Book, Chapter, Genre, Page, Rating
+from users.models import User
+
+# ============================
+# Cache invalidation
+# ============================
+
+
+def _book_tags(book_ids):
+    return [f"book:{book_id}" for book_id in book_ids]
+
+
+def _author_tags(author_ids):
+    return [f"author:{author_id}" for author_id in author_ids]
+
+
+@receiver(post_save, sender=Book)
+@receiver(pre_delete, sender=Book)
+def invalidate_book(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    author_ids = list(instance.authors.values_list("id", flat=True)) if instance.pk else []
+    bump_tags_on_commit(
+        "catalog", "authors", *_book_tags([instance.pk]), *_author_tags(author_ids)
+    )
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def invalidate_book_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # the cleared ids are gone by post_clear, remember them
+        related = instance.authored_books if reverse else instance.authors
+        instance._cleared_pks = set(related.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    changed = instance._cleared_pks if action == "post_clear" else pk_set or set()
+    book_ids, author_ids = (changed, [instance.pk]) if reverse else ([instance.pk], changed)
+    bump_tags_on_commit(
+        "catalog", "authors", *_book_tags(book_ids), *_author_tags(author_ids)
+    )
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def invalidate_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        related = instance.books if reverse else instance.genre
+        instance._cleared_pks = set(related.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    changed = instance._cleared_pks if action == "post_clear" else pk_set or set()
+    book_ids = changed if reverse else [instance.pk]
+    # the author directory lists the genres of each author
+    author_ids = Book.authors.through.objects.filter(book__in=book_ids).values_list(
+        "user_id", flat=True
+    )
+    bump_tags_on_commit(
+        "catalog", "genres", "authors", *_book_tags(book_ids), *_author_tags(author_ids)
+    )
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def invalidate_chapter(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_tags_on_commit(*_book_tags([instance.book_id]))
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def invalidate_page(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    book_id = (
+        Chapter.objects.filter(pk=instance.chapter_id).values_list("book_id", flat=True).first()
+    )
+    if book_id is not None:
+        bump_tags_on_commit(*_book_tags([book_id]))
+
+
+@receiver(cover_derivatives_stored)
+def invalidate_book_cover(sender, book, **kwargs):
+    # listings show the cover srcset of their books
+    author_ids = list(book.authors.values_list("id", flat=True))
+    bump_tags_on_commit("catalog", *_book_tags([book.pk]), *_author_tags(author_ids))
+
+
+@receiver(book_imported)
+def invalidate_imported_book(sender, book, **kwargs):
+    # imports write chapters and pages in bulk, without their signals
+    bump_tags_on_commit(*_book_tags([book.pk]))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_tags_on_commit("catalog", *_book_tags([instance.book_id]))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_tags_on_commit("catalog", "genres")
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and set(update_fields) <= {"last_login"}):
+        return
+    bump_tags_on_commit("authors", *_author_tags([instance.pk]))
+
+
+# ============================
+# Authenticated user cache
+# ============================
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # after commit, so a request racing the change cannot cache the old row
+    user_id = getattr(instance, api_settings.USER_ID_FIELD)
+    transaction.on_commit(lambda: forget_cached_user(user_id))
+
+
+# ============================
+# Request metrics
+# ============================
+
+
+@receiver(connection_created)
+def install_query_tracking(sender, connection, **kwargs):
+    # connections belong to the thread that opened them, so the wrapper is
+    # installed on each as it connects instead of per request
+    if track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_query)
@@ -1,3 +1,969 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from unittest import mock
+import fakeredis
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import resolve
+from django.utils import timezone
+from ninja_jwt.tokens import AccessToken
+from prometheus_client import REGISTRY
+from announcement.models import Announcement
+from api import auth, book_api
+from api.middleware import PrometheusMiddleware
+from api.models import OutboxEmail
+from api.outbox import claim_pending, queue_mail, send_pending
+from api.throttling import (
+    InMemorySlidingWindow,
+    RedisSlidingWindow,
+    SlidingWindowThrottle,
+    get_rate_limiter,
+)
+from books import exports, importer, tasks
+from books.authors import rebuild_author_directory
+from books.leaderboard import get_leaderboard, rebuild_leaderboard
+from books.models import Book, BookImport, Chapter, Genre, Page, Rating
+from users.models import User
 
-# Create your tests here.
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Maximum number of queries per endpoint, measured with a cold response
+# cache. Listings must stay constant in the page size, so every listing is
+# requested with a page of 50 books.
+QUERY_BUDGETS = {
+    "books/get_all_books?limit=50": 3,
+    "books/get_all_books?limit=50&cursor=": 3,
+    "books/get_book?book_id={book}": 4,
+    "books/top_books?n=50": 3,
+    "books/search?q=book&limit=50": 6,
+    "books/get_book_chapters?book_id={book}": 3,
+    "books/get_chapter_pages?book_id={book}&chapter_number=1": 4,
+    "books/get_pages?book_id={book}&start=2&end=5": 2,
+    "books/get_pages?book_id={book}&metadata_only=true": 2,
+    "books/export_book?book_id={book}": 3,
+    "books/get_genres": 1,
+    "books/get_genre_books?genre_id={genre}&limit=50": 3,
+    "authors/get_all_authors?limit=50": 1,
+    "authors/get_author?author_id={author}": 1,
+    "authors/get_author_books?author_id={author}&limit=50": 4,
+    "info/get_announcement": 1,
+    "async/books/get_all_books?limit=50": 3,
+    "async/books/get_book?book_id={book}": 3,
+    "async/books/top_books?n=50": 3,
+    "async/books/get_book_chapters?book_id={book}": 2,
+    "async/books/get_chapter_pages?book_id={book}&chapter_number=1": 3,
+    "async/authors/get_all_authors?limit=50": 1,
+    "async/authors/get_author?author_id={author}": 1,
+    "async/authors/get_author_books?author_id={author}&limit=50": 4,
+    "async/info/get_announcement": 1,
+}
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    BOOK_LEADERBOARD_BACKEND="memory",
+    THROTTLE_BACKEND="memory",
+    BACKGROUND_WORKERS=0,
+)
+class QueryBudgetTests(TestCase):
+    """
+    Fails when a change pushes a read endpoint over its query budget, e.g.
+    by serializing a relation that is not prefetched.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genres = genres = [Genre.objects.create(title=f"genre {i}") for i in range(3)]
+        cls.authors = [
+            User.objects.create_user(email=f"author{i}@example.com", password="x")
+            for i in range(5)
+        ]
+        for i in range(60):
+            book = Book.objects.create(
+                title=f"book {i}", description="a book about books", status="r"
+            )
+            book.authors.set(cls.authors[i % 5 : i % 5 + 2])
+            book.genre.set(genres[i % 3 : i % 3 + 2])
+            Rating.objects.create(book=book, user=cls.authors[0], rating=i % 5 + 1)
+            for number in (1, 2):
+                chapter = Chapter.objects.create(
+                    book=book, title=f"chapter {number}", chapter_number=number
+                )
+                for page_number in (1, 2, 3):
+                    Page.objects.create(
+                        chapter=chapter,
+                        title=f"page {page_number}",
+                        page_number=page_number,
+                        content='{"delta":"","html":"<p>some book text</p>"}',
+                    )
+        cls.book = book
+        # the directory is refreshed on commit, which test transactions never do
+        rebuild_author_directory()
+        Announcement.objects.create(title="welcome", content="")
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_leaderboard.cache_clear()
+        self.addCleanup(get_leaderboard.cache_clear)
+        rebuild_leaderboard()
+        cache.clear()
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label):
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            "{} ran {} queries, its budget is {}:\n{}".format(
+                label,
+                len(queries),
+                budget,
+                "\n".join(query["sql"] for query in queries.captured_queries),
+            ),
+        )
+
+    def test_query_budgets(self):
+        for path, budget in QUERY_BUDGETS.items():
+            url = "/api/v1/" + path.format(
+                book=self.book.id, author=self.authors[1].id, genre=self.genres[1].id
+            )
+            with self.subTest(path=path):
+                cache.clear()
+                with self.assertMaxQueries(budget, url):
+                    response = self.client.get(url)
+                    if response.streaming:
+                        body = b"".join(response.streaming_content)
+                    else:
+                        body = response.content
+                self.assertEqual(response.status_code, 200, body)
+
+    def test_listing_payload(self):
+        response = self.client.get("/api/v1/books/get_all_books?limit=50")
+        books = json.loads(response.content)["data"]["payload"]["books"]
+        self.assertEqual(len(books), 50)
+        for book in books:
+            stored = Book.objects.get(id=book["id"])
+            self.assertCountEqual(
+                book["authors"], stored.authors.values_list("id", flat=True)
+            )
+            self.assertCountEqual(book["genre"], stored.genre.values_list("id", flat=True))
+
+    def test_listing_limit_validated(self):
+        for path in (
+            "books/get_all_books",
+            "authors/get_all_authors",
+            f"authors/get_author_books?author_id={self.authors[1].id}",
+            "async/books/get_all_books",
+            f"books/get_genre_books?genre_id={self.genres[0].id}",
+        ):
+            for query in ("limit=0&cursor=", "limit=-2", "limit=101", "offset=-1"):
+                url = f"/api/v1/{path}{'&' if '?' in path else '?'}{query}"
+                with self.subTest(url=url):
+                    self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_author_payload(self):
+        author = self.authors[1]
+        response = self.client.get(f"/api/v1/authors/get_author?author_id={author.id}")
+        payload = json.loads(response.content)["data"]["payload"]
+        self.assertEqual(
+            payload,
+            {
+                "id": author.id,
+                "first_name": author.first_name,
+                "last_name": author.last_name,
+                "released_books": author.authored_books.filter(status="r").count(),
+                "latest_published": str(
+                    max(author.authored_books.values_list("published", flat=True))
+                ),
+                "genres": sorted(
+                    set(
+                        Genre.objects.filter(books__authors=author).values_list("id", flat=True)
+                    )
+                ),
+            },
+        )
+
+    def test_genre_books_ranked(self):
+        genre = self.genres[1]
+        # one rating per book, so the scores follow the rating sums; ties go
+        # to the greater id compared as a string, like Redis sorted sets
+        ranked = sorted(
+            Book.released.filter(genre=genre).values_list("rating_sum", "id"),
+            key=lambda book: (book[0], str(book[1])),
+            reverse=True,
+        )
+        expected = [book_id for _, book_id in ranked[:50]]
+        for backend in ("memory", "redis"):
+            with self.subTest(backend=backend), override_settings(
+                BOOK_LEADERBOARD_BACKEND=backend
+            ), mock.patch("core.redis.get_redis", return_value=fakeredis.FakeRedis()):
+                get_leaderboard.cache_clear()
+                rebuild_leaderboard()
+                cache.clear()
+                response = self.client.get(
+                    f"/api/v1/books/get_genre_books?genre_id={genre.id}&limit=50"
+                )
+                payload = json.loads(response.content)["data"]["payload"]
+                self.assertEqual([book["id"] for book in payload["books"]], expected)
+                self.assertEqual(payload["next_page"], -1 if len(ranked) <= 50 else 1)
+                self.assertEqual(payload["prev_page"], -1)
+
+                genres = json.loads(self.client.get("/api/v1/books/get_genres").content)
+                counts = {
+                    g["id"]: g["book_count"] for g in genres["data"]["payload"]["genres"]
+                }
+                self.assertEqual(counts[genre.id], len(ranked))
+
+    def test_listings_link_pages(self):
+        for path in (
+            "books/get_all_books?limit=2&offset=1",
+            "authors/get_all_authors?limit=2&offset=1",
+            "authors/get_author_books?author_id={author}&limit=2&offset=1",
+            "books/get_genre_books?genre_id={genre}&limit=2&offset=1",
+            "async/books/get_all_books?limit=2&offset=1",
+            "async/authors/get_all_authors?limit=2&offset=1",
+            "async/authors/get_author_books?author_id={author}&limit=2&offset=1",
+        ):
+            url = "/api/v1/" + path.format(author=self.authors[0].id, genre=self.genres[1].id)
+            with self.subTest(url=url):
+                payload = json.loads(self.client.get(url).content)["data"]["payload"]
+                self.assertEqual((payload["next_page"], payload["prev_page"]), (2, 0))
+                if "get_genre_books" not in url:
+                    # the misspelled key is kept for existing clients
+                    self.assertEqual(payload["perv_page"], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory", BACKGROUND_WORKERS=0)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="book", description="", status="r")
+        chapter = Chapter.objects.create(book=cls.book, title="chapter", chapter_number=1)
+        Page.objects.create(
+            chapter=chapter,
+            title="page",
+            page_number=1,
+            content='{"delta":"","html":"<p>text</p>"}',
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def test_revalidation_without_queries(self):
+        for path in (
+            "get_book?book_id={}",
+            "get_book_chapters?book_id={}",
+            "get_chapter_pages?book_id={}&chapter_number=1",
+            "get_pages?book_id={}",
+        ):
+            url = "/api/v1/books/" + path.format(self.book.id)
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("must-revalidate", response["Cache-Control"])
+                for headers in (
+                    {"HTTP_IF_NONE_MATCH": response["ETag"]},
+                    {"HTTP_IF_MODIFIED_SINCE": response["Last-Modified"]},
+                ):
+                    with CaptureQueriesContext(connection) as queries:
+                        revalidated = self.client.get(url, **headers)
+                    self.assertEqual(revalidated.status_code, 304)
+                    self.assertEqual(revalidated["ETag"], response["ETag"])
+                    self.assertEqual(len(queries), 0, queries.captured_queries)
+
+    def test_change_invalidates_etag(self):
+        url = f"/api/v1/books/get_book_chapters?book_id={self.book.id}"
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Chapter.objects.create(book=self.book, title="another", chapter_number=2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_missing_book_not_revalidated(self):
+        response = self.client.get("/api/v1/books/get_book?book_id=0", HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory", BACKGROUND_WORKERS=0)
+class PageWindowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="book", description="", status="r")
+        # created out of order, read in chapter and page order
+        for number, pages in ((2, 2), (1, 3)):
+            chapter = Chapter.objects.create(
+                book=cls.book, title=f"chapter {number}", chapter_number=number
+            )
+            for page_number in range(pages, 0, -1):
+                Page.objects.create(
+                    chapter=chapter,
+                    title=f"page {number}.{page_number}",
+                    page_number=page_number,
+                    content=f'{{"delta":"","html":"<p>text {number} {page_number}</p>"}}',
+                )
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def get(self, **params):
+        return self.client.get("/api/v1/books/get_pages", {"book_id": self.book.id, **params})
+
+    def payload(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content)["data"]["payload"]
+
+    def test_window_across_chapters(self):
+        response = self.get(start=2, end=4)
+        payload = self.payload(response)
+        self.assertEqual(
+            [
+                (page["position"], page["chapter_number"], page["page_number"], page["title"])
+                for page in payload["pages"]
+            ],
+            [(2, 1, 2, "page 1.2"), (3, 1, 3, "page 1.3"), (4, 2, 1, "page 2.1")],
+        )
+        self.assertEqual(payload["pages"][2]["content"].strip(), "text 2 1")
+        self.assertEqual(payload["next_start"], 5)
+        self.assertEqual(
+            response["Link"],
+            f'</api/v1/books/get_pages?book_id={self.book.id}&start=5&end=7>; rel="next"',
+        )
+
+    def test_last_window(self):
+        response = self.get(start=4, end=10)
+        payload = self.payload(response)
+        self.assertEqual([page["position"] for page in payload["pages"]], [4, 5])
+        self.assertIsNone(payload["next_start"])
+        self.assertNotIn("Link", response)
+        payload = self.payload(self.get(start=6))
+        self.assertEqual((payload["pages"], payload["next_start"]), ([], None))
+
+    def test_window_clamped(self):
+        with mock.patch.object(book_api, "MAX_PAGE_WINDOW", 2):
+            response = self.get(start=1, end=5)
+        payload = self.payload(response)
+        self.assertEqual([page["position"] for page in payload["pages"]], [1, 2])
+        self.assertEqual(payload["next_start"], 3)
+        self.assertIn("start=3&end=4", response["Link"])
+
+    def test_metadata_only(self):
+        pages = self.payload(self.get(start=1, end=5, metadata_only="true"))["pages"]
+        self.assertEqual(len(pages), 5)
+        for page in pages:
+            self.assertNotIn("content", page)
+            self.assertEqual(
+                set(page),
+                {"id", "chapter", "title", "page_number", "updated", "position", "chapter_number"},
+            )
+
+    def test_invalid_range(self):
+        for params in ({"start": 3, "end": 2}, {"start": 0}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_missing_book(self):
+        response = self.client.get("/api/v1/books/get_pages", {"book_id": 0})
+        self.assertEqual(response.status_code, 404)
+        Book.objects.filter(pk=self.book.pk).update(status="d")
+        self.assertEqual(self.get().status_code, 404)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    BOOK_LEADERBOARD_BACKEND="memory",
+    THROTTLE_BACKEND="memory",
+    BACKGROUND_WORKERS=0,
+)
+class ClientCachingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.create(title="book", description="", status="r")
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def assertClientCaching(self, max_age):
+        for url in (
+            "/api/v1/books/get_all_books",
+            "/api/v1/async/books/get_all_books",
+            "/api/v1/books/top_books",
+        ):
+            # a miss, then a hit from the server cache
+            for result in ("miss", "hit"):
+                with self.subTest(url=url, result=result):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        set(response["Cache-Control"].split(", ")),
+                        {f"max-age={max_age}", "must-revalidate"},
+                    )
+                    self.assertNotIn("Expires", response)
+
+    def test_listings_revalidated(self):
+        self.assertClientCaching(0)
+
+    @override_settings(API_CLIENT_MAX_AGE=60)
+    def test_client_max_age(self):
+        self.assertClientCaching(60)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory", BACKGROUND_WORKERS=0)
+class EpubExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="book", description="", status="r")
+        chapter = Chapter.objects.create(book=cls.book, title="chapter", chapter_number=1)
+        cls.page = Page.objects.create(
+            chapter=chapter,
+            title="page",
+            page_number=1,
+            content='{"delta":"","html":"<p>text</p>"}',
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        settings = override_settings(EXPORTS_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(exports._building.clear)
+        self.url = f"/api/v1/books/export_epub?book_id={self.book.id}"
+
+    def test_export_redirects_to_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        digest = exports.export_digest(self.book)
+        self.assertTrue(response["Location"].endswith(f"/exports/{digest}.epub"))
+
+        download = self.client.get(response["Location"])
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(download["Content-Type"], "application/epub+zip")
+        self.assertIn("immutable", download["Cache-Control"])
+        with zipfile.ZipFile(io.BytesIO(b"".join(download.streaming_content))) as epub:
+            self.assertEqual(epub.namelist()[0], "mimetype")
+            self.assertIn(b"<p>text</p>", epub.read("OEBPS/chapter-1.xhtml"))
+
+    def test_digest_cache_reused(self):
+        with mock.patch.object(exports, "build_epub", wraps=exports.build_epub) as build:
+            location = self.client.get(self.url)["Location"]
+            self.assertEqual(self.client.get(self.url)["Location"], location)
+            self.assertEqual(build.call_count, 1)
+
+            self.page.content = '{"delta":"","html":"<p>changed</p>"}'
+            self.page.save()
+            changed = self.client.get(self.url)["Location"]
+            self.assertNotEqual(changed, location)
+            self.assertEqual(build.call_count, 2)
+        self.assertEqual(len(os.listdir(self.root)), 2)
+
+    def test_building_answers_accepted(self):
+        with mock.patch.object(tasks, "submit") as submit:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response["Retry-After"], "5")
+            # a second request does not queue the same build again
+            self.assertEqual(self.client.get(self.url).status_code, 202)
+        submit.assert_called_once()
+
+    def test_download_unknown_digest(self):
+        for digest in ("0" * 64, "not-a-digest"):
+            with self.subTest(digest=digest):
+                response = self.client.get(f"/api/v1/books/exports/{digest}.epub")
+                self.assertEqual(response.status_code, 404)
+
+    def test_unreleased_book(self):
+        Book.objects.filter(pk=self.book.pk).update(status="d")
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+BOOK_SOURCE = {
+    "book.json": '{"title": "imported", "description": "from an archive"}',
+    "01-first/01-intro.md": "# Intro\n\nSome *text*.",
+    "01-first/02-more.html": "<html><body><p>More text</p></body></html>",
+    "02-second/01-end.md": "The end.",
+}
+
+
+def book_archive(files, kind="zip"):
+    buffer = io.BytesIO()
+    if kind == "zip":
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, text in files.items():
+                archive.writestr(f"book/{name}", text)
+    else:
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            for name, text in files.items():
+                data = text.encode()
+                info = tarfile.TarInfo(f"book/{name}")
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    return SimpleUploadedFile(f"book.{kind}", buffer.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory", BACKGROUND_WORKERS=0)
+class BookImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            email="staff@example.com", password="x", is_staff=True
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.uploads = os.path.join(media.name, "book_imports")
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post(self, archive, user=None, **params):
+        token = AccessToken.for_user(user or self.staff)
+        query = "&".join(f"{name}={value}" for name, value in params.items())
+        return self.client.post(
+            f"/api/v1/books/import?{query}",
+            {"archive": archive},
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+
+    def state(self, response):
+        self.assertEqual(response.status_code, 202, response.content)
+        state = self.client.get(
+            response["Location"], HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.staff)}"
+        )
+        self.assertEqual(state.status_code, 200)
+        return json.loads(state.content)["data"]["payload"]
+
+    def assertUploadsRemoved(self):
+        self.assertEqual(os.listdir(self.uploads), [])
+
+    def test_import_archives(self):
+        for kind in ("zip", "tar"):
+            with self.subTest(kind=kind):
+                Book.objects.filter(title="imported").delete()
+                state = self.state(self.post(book_archive(BOOK_SOURCE, kind)))
+                self.assertEqual(state["status"], "done", state)
+                book = Book.objects.get(pk=state["stats"]["book_id"])
+                self.assertEqual((book.title, book.status), ("imported", "d"))
+                pages = Page.objects.filter(chapter__book=book).order_by(
+                    "chapter__chapter_number", "page_number"
+                )
+                self.assertEqual(
+                    [(page.chapter.title, page.title) for page in pages],
+                    [("first", "intro"), ("first", "more"), ("second", "end")],
+                )
+                self.assertIn("<em>text</em>", pages[0].content.html)
+                self.assertEqual(pages[1].content.html, "<p>More text</p>")
+                self.assertEqual(pages[1].get_content().strip(), "More text")
+                self.assertUploadsRemoved()
+
+    def test_prune_needs_book(self):
+        response = self.post(book_archive(BOOK_SOURCE), prune="true")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Book.objects.exists())
+
+        book = Book.objects.create(title="something else", status="d")
+        stale = Chapter.objects.create(book=book, title="stale", chapter_number=9)
+        state = self.state(self.post(book_archive(BOOK_SOURCE), book_id=book.id, prune="true"))
+        self.assertEqual(state["stats"]["chapters_deleted"], 1)
+        self.assertFalse(Chapter.objects.filter(pk=stale.pk).exists())
+        self.assertEqual(book.chapters.count(), 2)
+        with self.assertRaises(importer.BookImportError):
+            # checked before the source is even opened
+            importer.import_book("book.zip", prune=True)
+
+    def test_size_limits(self):
+        with override_settings(IMPORT_MAX_UPLOAD_SIZE=100):
+            self.assertEqual(self.post(book_archive(BOOK_SOURCE)).status_code, 413)
+        # a small archive of a large, highly compressible page
+        bomb = {"01-chapter/01-page.md": "a" * 200_000}
+        with override_settings(IMPORT_MAX_EXTRACTED_SIZE=100_000):
+            for kind in ("zip", "tar"):
+                with self.subTest(kind=kind):
+                    archive = book_archive(bomb, kind)
+                    self.assertLess(archive.size, 100_000)
+                    response = self.post(archive)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(b"more than the 100000 allowed", response.content)
+        self.assertFalse(Book.objects.exists())
+        self.assertUploadsRemoved()
+
+    def test_broken_archive(self):
+        response = self.post(SimpleUploadedFile("book.zip", b"not an archive"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)["status"], "error")
+
+    @override_settings(BACKGROUND_WORKERS=2)
+    def test_queued_for_worker(self):
+        response = self.post(book_archive(BOOK_SOURCE))
+        self.assertEqual(self.state(response)["status"], "pending")
+        self.assertEqual(len(os.listdir(self.uploads)), 1)
+        self.assertFalse(Book.objects.exists())
+
+        self.assertEqual(importer.run_pending_imports(), 1)
+        self.assertEqual(importer.run_pending_imports(), 0)
+        state = self.state(response)
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(Book.objects.get().pk, state["stats"]["book_id"])
+        self.assertUploadsRemoved()
+
+    @override_settings(BACKGROUND_WORKERS=2, IMPORT_MAX_ATTEMPTS=2)
+    def test_interrupted_import_retried(self):
+        job_id = json.loads(self.post(book_archive(BOOK_SOURCE)).content)["data"]["payload"][
+            "job_id"
+        ]
+        # the worker dies while importing
+        self.assertEqual(importer.claim_import().pk, job_id)
+        self.assertIsNone(importer.claim_import())
+        BookImport.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(importer.run_pending_imports(), 1)
+        job = BookImport.objects.get()
+        self.assertEqual((job.status, job.attempts), ("d", 2))
+
+        self.post(book_archive(BOOK_SOURCE))
+        for _ in range(2):
+            importer.claim_import()
+            BookImport.objects.update(next_attempt_at=timezone.now())
+        importer.run_pending_imports()
+        job = BookImport.objects.latest("id")
+        self.assertEqual((job.status, job.attempts), ("f", 3))
+        self.assertIn("interrupted", job.error)
+        self.assertUploadsRemoved()
+
+    def test_staff_only(self):
+        user = User.objects.create_user(email="reader@example.com", password="x")
+        self.assertEqual(self.post(book_archive(BOOK_SOURCE), user=user).status_code, 403)
+        self.assertEqual(
+            self.client.get(
+                "/api/v1/books/import/0", HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+            ).status_code,
+            403,
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory")
+class CachedUserTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email="reader@example.com", password="x")
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        auth._local_users.clear()
+        self.addCleanup(auth._local_users.clear)
+
+    def get(self):
+        return auth.get_cached_user(User, self.user.id)
+
+    def test_cache_hit(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get().email, "reader@example.com")
+        with self.assertNumQueries(0):
+            self.get()
+        # from the shared cache, as another process would
+        auth._local_users.clear()
+        with self.assertNumQueries(0):
+            user = self.get()
+        self.assertEqual(user.email, "reader@example.com")
+        # the hash is not cached but loaded on access
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("x"))
+
+    def test_invalidated_on_save(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        url = "/api/v1/books/import/0"
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"}
+        # a staff user: no such import rather than denied
+        self.assertEqual(self.client.get(url, **headers).status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = False
+            self.user.save()
+        self.assertFalse(self.get().is_staff)
+        self.assertEqual(self.client.get(url, **headers).status_code, 403)
+
+    def test_invalidated_on_password_change(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("changed")
+            self.user.save()
+        with self.assertNumQueries(2):
+            self.assertTrue(self.get().check_password("changed"))
+
+    def test_invalidated_on_delete(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=self.user.pk).delete()
+        self.assertIsNone(self.get())
+
+    def test_stale_read_not_cached(self):
+        set_cache = cache.set
+
+        def commit_change_then_set(*args, **kwargs):
+            # the change commits after this request read the row
+            with self.captureOnCommitCallbacks(execute=True):
+                User.objects.filter(pk=self.user.pk).update(first_name="changed")
+                auth.forget_cached_user(self.user.id)
+            set_cache(*args, **kwargs)
+
+        with mock.patch.object(auth.cache, "set", side_effect=commit_change_then_set):
+            self.assertIsNone(self.get().first_name)
+        self.assertEqual(self.get().first_name, "changed")
+
+
+class MetricsTests(TestCase):
+    @override_settings(METRICS_TOKEN="")
+    def test_closed_without_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE", response.content)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_BACKEND="memory", BACKGROUND_WORKERS=0)
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.create(title="book", description="", status="r")
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            SlidingWindowThrottle, "allow_request", return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def queries_observed(self, path):
+        route = resolve(path).route
+        labels = {"route": route}
+        return (
+            REGISTRY.get_sample_value("api_request_db_queries_count", labels) or 0,
+            REGISTRY.get_sample_value("api_request_db_queries_sum", labels) or 0,
+        )
+
+    def test_sync_queries_counted(self):
+        path = "/api/v1/books/get_book"
+        before = self.queries_observed(path)
+        book_id = Book.objects.get().id
+        self.assertEqual(self.client.get(path, {"book_id": book_id}).status_code, 200)
+        requests, queries = self.queries_observed(path)
+        self.assertEqual(requests, before[0] + 1)
+        self.assertGreater(queries, before[1])
+
+    async def test_async_queries_counted(self):
+        # under ASGI the middleware runs on the event loop, while the async
+        # ORM runs its queries in another thread, with its own connection
+        path = "/api/v1/async/books/get_all_books"
+
+        async def get_response(request):
+            await Book.objects.acount()
+            return HttpResponse()
+
+        middleware = PrometheusMiddleware(get_response)
+        request = RequestFactory().get(path)
+        request.resolver_match = resolve(path)
+        before = self.queries_observed(path)
+        await middleware(request)
+        requests, queries = self.queries_observed(path)
+        self.assertEqual(requests, before[0] + 1)
+        self.assertEqual(queries, before[1] + 1)
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    OUTBOX_RETRY_DELAY=60,
+    OUTBOX_MAX_ATTEMPTS=3,
+)
+class OutboxTests(TestCase):
+    def queue(self, subject="hello"):
+        return queue_mail(subject, "body", ["reader@example.com"])
+
+    def test_queued_with_its_transaction(self):
+        self.queue("kept")
+        try:
+            with transaction.atomic():
+                self.queue("rolled back")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(
+            list(OutboxEmail.objects.values_list("subject", "status")), [("kept", "p")]
+        )
+        self.assertEqual(mail.outbox, [])
+
+    def test_send(self):
+        email = self.queue()
+        self.assertEqual(send_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["reader@example.com"])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("s", 1))
+        self.assertIsNotNone(email.sent_at)
+        self.assertEqual(send_pending(), 0)
+
+    def test_retry_with_backoff_then_give_up(self):
+        email = self.queue()
+        failing = mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("mail server down"),
+        )
+        with failing:
+            for attempt in (1, 2):
+                before = timezone.now()
+                self.assertEqual(send_pending(), 1)
+                email.refresh_from_db()
+                self.assertEqual((email.status, email.attempts), ("p", attempt))
+                self.assertEqual(email.last_error, "mail server down")
+                delay = datetime.timedelta(seconds=60 * 2 ** (attempt - 1))
+                self.assertGreaterEqual(email.next_attempt_at, before + delay)
+                # not due again before the delay
+                self.assertEqual(send_pending(), 0)
+                OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(send_pending(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("f", 3))
+        self.assertEqual(send_pending(), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_claimed_until_lease_expires(self):
+        email = self.queue()
+        claimed, lease = claim_pending()
+        self.assertEqual(claimed, [email])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.next_attempt_at, email.attempts), ("l", lease, 1))
+        self.assertEqual(claim_pending()[0], [])
+
+        # the worker died, the email is sent once the lease expired
+        OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_pending(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("s", 2))
+
+    def test_give_up_when_interrupted(self):
+        email = self.queue()
+        for _ in range(3):
+            # a worker claims the email and dies before its lease expires
+            self.assertEqual(claim_pending()[0], [email])
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_pending(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("f", 4))
+        self.assertEqual(email.last_error, "The email was interrupted too many times.")
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(send_pending(), 0)
+
+
+class SlidingWindowTestsMixin:
+    def test_blocks_over_limit(self):
+        limiter = self.limiter()
+        for _ in range(3):
+            self.assertEqual(limiter.hit("throttle:test:a", 3, 10), (True, None))
+        allowed, wait = limiter.hit("throttle:test:a", 3, 10)
+        self.assertFalse(allowed)
+        # until the oldest of the three requests leaves the window
+        self.assertGreater(wait, 9)
+        self.assertLessEqual(wait, 10)
+
+    def test_window_expires(self):
+        limiter = self.limiter()
+        self.assertTrue(limiter.hit("throttle:test:a", 2, 0.2)[0])
+        self.assertTrue(limiter.hit("throttle:test:a", 2, 0.2)[0])
+        self.assertFalse(limiter.hit("throttle:test:a", 2, 0.2)[0])
+        time.sleep(0.25)
+        self.assertTrue(limiter.hit("throttle:test:a", 2, 0.2)[0])
+
+    def test_keys_independent(self):
+        limiter = self.limiter()
+        self.assertTrue(limiter.hit("throttle:login:a", 1, 10)[0])
+        self.assertFalse(limiter.hit("throttle:login:a", 1, 10)[0])
+        self.assertTrue(limiter.hit("throttle:register:a", 1, 10)[0])
+        self.assertTrue(limiter.hit("throttle:login:b", 1, 10)[0])
+
+
+class RedisSlidingWindowTests(SlidingWindowTestsMixin, SimpleTestCase):
+    def limiter(self):
+        return RedisSlidingWindow(fakeredis.FakeRedis())
+
+    def test_fails_open(self):
+        server = fakeredis.FakeServer()
+        server.connected = False
+        limiter = RedisSlidingWindow(fakeredis.FakeRedis(server=server))
+        self.assertEqual(limiter.hit("throttle:test:a", 1, 10), (True, None))
+
+
+class InMemorySlidingWindowTests(SlidingWindowTestsMixin, SimpleTestCase):
+    def limiter(self):
+        return InMemorySlidingWindow()
+
+
+class ThrottleScopeTests(TestCase):
+    def test_route_scopes(self):
+        for backend in ("memory", "redis"):
+            with self.subTest(backend=backend), override_settings(
+                THROTTLE_BACKEND=backend
+            ), mock.patch("core.redis.get_redis", return_value=fakeredis.FakeRedis()):
+                get_rate_limiter.cache_clear()
+                self.addCleanup(get_rate_limiter.cache_clear)
+                # /auth/login allows 10 requests a minute per client
+                for _ in range(10):
+                    response = self.client.post("/api/v1/auth/login", {}, "application/json")
+                    self.assertNotEqual(response.status_code, 429)
+                response = self.client.post("/api/v1/auth/login", {}, "application/json")
+                self.assertEqual(response.status_code, 429)
+                self.assertGreater(int(response["Retry-After"]), 50)
+                # other routes keep their own windows
+                response = self.client.post("/api/v1/auth/register", {}, "application/json")
+                self.assertNotEqual(response.status_code, 429)
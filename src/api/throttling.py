@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from functools import cache
+import redis
+from django.conf import settings
+from ninja.throttling import BaseThrottle
+
+# Sliding window log: one sorted set per client holding the time of each
+# allowed request. Trimming, counting and recording happen in one script,
+# so concurrent workers cannot both take the last slot.
+SLIDING_WINDOW_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) < limit then
+    redis.call('ZADD', KEYS[1], now, now .. ':' .. ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return -1
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return tonumber(oldest[2]) + window - now
+"""
+
+
+class RedisSlidingWindow:
+    """
+    Rate limiter shared by all workers, one EVALSHA per check.
+    """
+
+    def __init__(self, client):
+        self.script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, key, limit, window):
+        """
+        Record a request for `key` if fewer than `limit` were made in the
+        last `window` seconds. Returns (allowed, seconds to wait).
+        """
+        try:
+            wait_ms = self.script(
+                keys=[key], args=[int(window * 1000), limit, os.urandom(4).hex()]
+            )
+        except redis.RedisError:
+            # fail open, an unreachable redis must not take the API down
+            return True, None
+        if wait_ms < 0:
+            return True, None
+        return False, wait_ms / 1000
+
+
+class InMemorySlidingWindow:
+    """
+    Process-local stand-in for RedisSlidingWindow, for tests and development.
+    """
+
+    def __init__(self):
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        now = time.monotonic()
+        with self.lock:
+            history = self.windows.setdefault(key, deque())
+            while history and history[0] <= now - window:
+                history.popleft()
+            if len(history) < limit:
+                history.append(now)
+                return True, None
+            return False, history[0] + window - now
+
+
+@cache
+def get_rate_limiter():
+    if settings.THROTTLE_BACKEND == "memory":
+        return InMemorySlidingWindow()
+    from core.redis import get_redis
+
+    return RedisSlidingWindow(get_redis())
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Throttle allowing `rate` requests ("number/period", period one of s, m,
+    h, d like Ninja's throttles) per client in any sliding window.
+
+    Routes can pass their own instance with a stricter rate and a scope of
+    their own, e.g. `throttle=AnonSlidingWindowThrottle("10/m", scope="login")`.
+    """
+
+    scope = None
+
+    def __init__(self, rate, scope=None):
+        num, period = rate.split("/")
+        self.num_requests = int(num)
+        self.duration = {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+        if scope is not None:
+            self.scope = scope
+        # instances are shared by every request of the routes they guard
+        self.state = threading.local()
+
+    def get_client(self, request):
+        """
+        Identify the client, None to not throttle the request.
+        """
+        raise NotImplementedError(".get_client() must be overridden")
+
+    def allow_request(self, request):
+        client = self.get_client(request)
+        if client is None:
+            return True
+        allowed, self.state.wait = get_rate_limiter().hit(
+            f"throttle:{self.scope}:{client}", self.num_requests, self.duration
+        )
+        return allowed
+
+    def wait(self):
+        return getattr(self.state, "wait", None)
+
+
+class AnonSlidingWindowThrottle(SlidingWindowThrottle):
+    """
+    Throttles unauthenticated requests by IP address.
+    """
+
+    scope = "anon"
+
+    def get_client(self, request):
+        if getattr(request, "auth", None) is not None:
+            return None
+        return self.get_ident(request)
+
+
+class AuthSlidingWindowThrottle(SlidingWindowThrottle):
+    """
+    Throttles authenticated requests by user, others by IP address.
+    """
+
+    scope = "auth"
+
+    def get_client(self, request):
+        auth = getattr(request, "auth", None)
+        if auth is None:
+            return self.get_ident(request)
+        if hasattr(auth, "pk"):
+            return f"user:{auth.pk}"
+        return hashlib.sha256(str(auth).encode()).hexdigest()
@@ -1,3 +1,4 @@
+import math
 from ninja_jwt.controller import NinjaJWTDefaultController
 from ninja_extra import NinjaExtraAPI
 from ninja import Swagger
@@ -7,13 +8,18 @@ from .auth_api import router as auth_router
 from .book_api import router as book_router
 from .author_api import router as author_router
 from .info_api import router as info_router
-from ninja.errors import ValidationError,AuthenticationError
+from .async_api import author_router as async_author_router
+from .async_api import book_router as async_book_router
+from .async_api import info_router as async_info_router
+from ninja.errors import ValidationError,AuthenticationError,Throttled
 from .utils import api_response
-from ninja.throttling import AnonRateThrottle, AuthRateThrottle
+from .views import metrics
+from .renderers import ORJSONRenderer
+from .throttling import AnonSlidingWindowThrottle, AuthSlidingWindowThrottle
 
-api = NinjaExtraAPI(title='PersianCCBooks',docs=Swagger(),throttle=[
-        AnonRateThrottle('5/s'),
-        AuthRateThrottle('20/s'),
+api = NinjaExtraAPI(title='PersianCCBooks',docs=Swagger(),renderer=ORJSONRenderer(),throttle=[
+        AnonSlidingWindowThrottle('5/s'),
+        AuthSlidingWindowThrottle('20/s'),
     ])
 
 # jwt controler
@@ -36,13 +42,28 @@ def authemtication_errors(request, exc):
             error="Not Authenticated.",
             status_code=401
         )
+@api.exception_handler(Throttled)
+def throttled_errors(request, exc):
+    response = api_response(
+            success=False,
+            message="Too many requests, try again later.",
+            error="Throttled.",
+            status_code=429
+        )
+    if exc.wait is not None:
+        response["Retry-After"] = str(math.ceil(exc.wait))
+    return response
 # routers
 api.add_router("/users/",users_router)
 api.add_router("/auth/",auth_router)
 api.add_router("/books/",book_router)
 api.add_router("/authors/",author_router)
 api.add_router("/info/",info_router)
+api.add_router("/async/books/",async_book_router)
+api.add_router("/async/authors/",async_author_router)
+api.add_router("/async/info/",async_info_router)
 
 urlpatterns = [
     path("api/v1/", api.urls),
+    path("metrics", metrics),
 ]
\ No newline at end of file
@@ -1,17 +1,148 @@
-from ninja.responses import Response
-from .schema import ApiResponseSchema, DataSchema, ErrorSchema
+import base64
+import datetime
+import json
+from django.db.models import Q
+from django.utils import timezone
+from django.http import HttpResponse
+from .renderers import dumps
 
 def api_response(success: bool, message: str, payload=None, error=None, status_code=200):
     """
     Utility function to standardize API responses.
+
+    The envelope follows ApiResponseSchema but is built as a plain dict and
+    serialized with orjson, so payload schemas are not validated and dumped
+    a second time.
     """
     error_message = error.__str__() if error else None
-    response_structure = ApiResponseSchema(
-        status='success' if success else 'error',
-        data=DataSchema(
-            message=message,
-            payload=payload if success else None,
-            error=ErrorSchema(details=error_message) if not success else None
-        )
+    data = {
+        "status": "success" if success else "error",
+        "data": {
+            "message": message,
+            "payload": payload if success else None,
+            "error": None if success else {"details": error_message},
+        },
+    }
+    return HttpResponse(dumps(data), status=status_code, content_type="application/json")
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering key of the last row of a page into an opaque cursor.
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by `encode_cursor`. Raises ValueError if it is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def paginate_offset(queryset, limit, offset):
+    """
+    Slice one page out of `queryset` using limit/offset pagination.
+
+    Fetches a single extra row to find out whether a next page exists, so the
+    queryset is never counted. Returns (rows, next_page, prev_page) where the
+    page numbers are -1 when there is no such page, or None if the page is empty.
+    """
+    start = offset * limit
+    rows = list(queryset[start : start + limit + 1])
+    return _offset_page(rows, limit, offset)
+
+
+async def apaginate_offset(queryset, limit, offset):
+    """
+    Async version of `paginate_offset`.
+    """
+    start = offset * limit
+    rows = [row async for row in queryset[start : start + limit + 1]]
+    return _offset_page(rows, limit, offset)
+
+
+def page_links(next_page, prev_page):
+    """
+    Payload fields linking an offset page to its neighbours. Also sent as
+    "perv_page", the misspelled name earlier releases used, until clients
+    have moved to "prev_page".
+    """
+    return {"next_page": next_page, "prev_page": prev_page, "perv_page": prev_page}
+
+
+def _offset_page(rows, limit, offset):
+    if not rows:
+        return None
+    next_page = offset + 1 if len(rows) > limit else -1
+    prev_page = offset - 1 if offset > 0 else -1
+    return rows[:limit], next_page, prev_page
+
+
+def paginate_keyset(queryset, keys, cursor, limit):
+    """
+    Slice one page out of `queryset` using keyset (seek) pagination.
+
+    `keys` are the field names the page is ordered by; the last one must be
+    unique (normally "id"). An empty cursor starts from the beginning. Returns
+    (rows, next_cursor) where next_cursor is None on the last page.
+    """
+    rows = list(_seek(queryset, keys, cursor)[: limit + 1])
+    return _keyset_page(rows, keys, limit)
+
+
+async def apaginate_keyset(queryset, keys, cursor, limit):
+    """
+    Async version of `paginate_keyset`.
+    """
+    rows = [row async for row in _seek(queryset, keys, cursor)[: limit + 1]]
+    return _keyset_page(rows, keys, limit)
+
+
+def _seek(queryset, keys, cursor):
+    queryset = queryset.order_by(*keys)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise ValueError("Invalid cursor.")
+        # (k1, k2, ...) > (v1, v2, ...) expanded to k1 > v1 OR (k1 = v1 AND k2 > v2) ...
+        condition = None
+        for i, key in enumerate(keys):
+            term = Q(**{f"{key}__gt": values[i]})
+            for prev_key, prev_value in zip(keys[:i], values[:i]):
+                term &= Q(**{prev_key: prev_value})
+            condition = term if condition is None else condition | term
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _keyset_page(rows, keys, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], key) for key in keys])
+    return rows, next_cursor
+
+
+def last_modified_from_dates(*dates):
+    """
+    Turn `updated` DateFields into a Last-Modified datetime.
+
+    A date only says the row changed some time that day, so the end of the
+    latest day is used, capped at now. Returns None if every date is None.
+    """
+    dates = [date for date in dates if date is not None]
+    if not dates:
+        return None
+    end_of_day = datetime.datetime.combine(
+        max(dates), datetime.time.max, tzinfo=datetime.timezone.utc
     )
-    return Response(response_structure.dict(), status=status_code)
\ No newline at end of file
+    return min(end_of_day, timezone.now())
@@ -1,3 +1,31 @@
-from django.shortcuts import render
+import os
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
 
-# Create your views here.
+
+def metrics(request):
+    """
+    Serve the api.metrics in Prometheus text format. Under gunicorn the
+    values of all workers are merged from PROMETHEUS_MULTIPROC_DIR.
+
+    Scrapers must send METRICS_TOKEN as a bearer token, the endpoint is
+    closed while it is not set.
+    """
+    if not settings.METRICS_TOKEN or not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponseForbidden()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
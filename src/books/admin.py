@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Book, Chapter, Page, Genre
+from .models import Book, BookImport, Chapter, Page, Genre
 
 
 # Register your models here.
@@ -41,7 +41,14 @@ class GenreAdmin(admin.ModelAdmin):
     fields = ("title", "description")
 
 
+class BookImportAdmin(admin.ModelAdmin):
+    list_display = ["id", "book", "status", "attempts", "created", "finished_at"]
+    readonly_fields = ["stats", "error", "created", "finished_at"]
+    list_filter = ["status"]
+
+
 admin.site.register(Genre, GenreAdmin)
 admin.site.register(Book, BookAdmin)
 admin.site.register(Chapter)
 admin.site.register(Page, PageAdmin)
+admin.site.register(BookImport, BookImportAdmin)
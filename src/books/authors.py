@@ -0,0 +1,72 @@
+from django.db.models import Count, Max, Q
+
+
+def refresh_author_entries(author_ids):
+    """
+    Recompute the AuthorEntry rows of `author_ids` from their released books
+    in three queries, dropping authors left without one.
+    """
+    from books.models import AuthorEntry, Book
+    from users.models import User
+
+    author_ids = set(author_ids)
+    if not author_ids:
+        return
+    released = Q(authored_books__status="r")
+    authors = (
+        User.objects.filter(pk__in=author_ids)
+        .annotate(
+            released_books=Count("authored_books", filter=released),
+            latest_published=Max("authored_books__published", filter=released),
+        )
+        .filter(released_books__gt=0)
+        .values_list("pk", "first_name", "last_name", "released_books", "latest_published")
+    )
+    genres = {}
+    for author_id, genre_id in (
+        Book.genre.through.objects.filter(
+            book__status="r", book__authors__in=author_ids
+        )
+        .values_list("book__authors", "genre_id")
+        .distinct()
+    ):
+        genres.setdefault(author_id, []).append(genre_id)
+
+    entries = [
+        AuthorEntry(
+            author_id=author_id,
+            first_name=first_name,
+            last_name=last_name,
+            released_books=count,
+            latest_published=latest,
+            genres=sorted(genres.get(author_id, [])),
+        )
+        for author_id, first_name, last_name, count, latest in authors
+    ]
+    AuthorEntry.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=["author"],
+        update_fields=[
+            "first_name",
+            "last_name",
+            "released_books",
+            "latest_published",
+            "genres",
+        ],
+    )
+    AuthorEntry.objects.filter(pk__in=author_ids).exclude(
+        pk__in=[entry.author_id for entry in entries]
+    ).delete()
+
+
+def rebuild_author_directory():
+    """
+    Rebuild the whole author directory. Returns the number of authors listed.
+    """
+    from books.models import AuthorEntry, Book
+
+    author_ids = set(Book.authors.through.objects.values_list("user_id", flat=True))
+    AuthorEntry.objects.exclude(pk__in=author_ids).delete()
+    refresh_author_entries(author_ids)
+    return AuthorEntry.objects.count()
@@ -0,0 +1,257 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+from html import escape
+from django.conf import settings
+from books import tasks
+
+# bump when the generated EPUB changes, so every export is rebuilt
+EPUB_FORMAT_VERSION = 1
+
+# a build that failed in the pool never reports back, it is retried after this
+BUILD_TIMEOUT = 600
+
+# digest -> time its build was submitted, per process
+_building = {}
+_building_lock = threading.Lock()
+
+
+def export_digest(book):
+    """
+    Hash of everything that ends up in the EPUB of `book`. Reads page
+    content hashes, not the content itself.
+    """
+    from books.models import Page
+
+    digest = hashlib.sha256()
+    parts = [
+        f"epub{EPUB_FORMAT_VERSION}",
+        _language(),
+        book.title,
+        book.description,
+        *_author_names(book),
+    ]
+    for row in (
+        Page.objects.filter(chapter__book=book)
+        .order_by("chapter__chapter_number", "page_number")
+        .values_list("chapter__chapter_number", "chapter__title", "title", "content_hash")
+    ):
+        parts.extend(str(value) for value in row)
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def export_path(digest):
+    return os.path.join(settings.EXPORTS_ROOT, f"{digest}.epub")
+
+
+def ensure_epub(book, digest):
+    """
+    Return the path of the EPUB of `book` if it is built, otherwise start
+    building it in the background process pool and return None.
+    """
+    path = export_path(digest)
+    if os.path.exists(path):
+        # the mtime orders exports for collect_exports
+        os.utime(path)
+        return path
+    with _building_lock:
+        started = _building.get(digest)
+        if started is not None and time.monotonic() - started < BUILD_TIMEOUT:
+            return None
+        _building[digest] = time.monotonic()
+    try:
+        contents = epub_contents(book)
+    except Exception:
+        _built(digest)
+        raise
+    tasks.submit(build_epub, contents, path, on_done=lambda _: _built(digest))
+    return path if os.path.exists(path) else None
+
+
+def _built(digest):
+    with _building_lock:
+        _building.pop(digest, None)
+    collect_exports()
+
+
+def _author_names(book):
+    """
+    The author names written into the EPUB, the email if there is no name.
+    """
+    return [
+        " ".join(filter(None, [author.first_name, author.last_name])) or str(author)
+        for author in book.authors.order_by("id")
+    ]
+
+
+def _language():
+    return settings.LANGUAGE_CODE.split("-")[0]
+
+
+def epub_contents(book):
+    """
+    Everything build_epub needs, as plain data so it can be sent to a worker
+    process. Pages are taken from their stored HTML, EPUB wants XHTML.
+    """
+    from books.models import Page
+
+    chapters = {
+        chapter.id: {"title": chapter.title, "pages": []}
+        for chapter in book.chapters.order_by("chapter_number")
+    }
+    for page in (
+        Page.objects.filter(chapter__book=book)
+        .order_by("page_number")
+        .only("chapter_id", "title", "content")
+        .iterator(chunk_size=200)
+    ):
+        chapters[page.chapter_id]["pages"].append(
+            {"title": page.title, "html": page.content.html if page.content else ""}
+        )
+    return {
+        "title": book.title,
+        "description": book.description,
+        "authors": _author_names(book),
+        "language": _language(),
+        "chapters": list(chapters.values()),
+    }
+
+
+def _xhtml(title, body, language):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        f'xml:lang="{language}" lang="{language}">\n'
+        f"<head><title>{escape(title)}</title></head>\n"
+        f"<body>\n{body}\n</body>\n</html>\n"
+    )
+
+
+def _page_xhtml(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+    # the default formatter closes void elements (<br/>), as XHTML requires
+    return str(soup)
+
+
+def build_epub(contents, path):
+    """
+    Write an EPUB 3 file of `contents` (see epub_contents) to `path`.
+    Runs in a worker process and writes through a temporary file, so a
+    half-built export is never served.
+    """
+    language = contents["language"]
+    chapters = []
+    for number, chapter in enumerate(contents["chapters"], start=1):
+        sections = "\n".join(
+            f"<section><h2>{escape(page['title'])}</h2>\n{_page_xhtml(page['html'])}</section>"
+            for page in chapter["pages"]
+        )
+        body = f"<h1>{escape(chapter['title'])}</h1>\n{sections}"
+        chapters.append(
+            (f"chapter-{number}.xhtml", chapter["title"], _xhtml(chapter["title"], body, language))
+        )
+
+    toc = "\n".join(
+        f'<li><a href="{name}">{escape(title)}</a></li>' for name, title, _ in chapters
+    )
+    nav = _xhtml(
+        contents["title"],
+        f'<nav epub:type="toc" id="toc"><h1>{escape(contents["title"])}</h1><ol>\n{toc}\n</ol></nav>',
+        language,
+    )
+    identifier = os.path.splitext(os.path.basename(path))[0]
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    creators = "\n".join(
+        f"<dc:creator>{escape(author)}</dc:creator>" for author in contents["authors"]
+    )
+    manifest = "\n".join(
+        f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>'
+        for i, (name, _, _) in enumerate(chapters, start=1)
+    )
+    spine = "\n".join(f'<itemref idref="c{i}"/>' for i in range(1, len(chapters) + 1))
+    opf = f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="book-id">urn:sha256:{identifier}</dc:identifier>
+<dc:title>{escape(contents["title"])}</dc:title>
+<dc:language>{language}</dc:language>
+<dc:description>{escape(contents["description"])}</dc:description>
+{creators}
+<meta property="dcterms:modified">{modified}</meta>
+</metadata>
+<manifest>
+<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{manifest}
+</manifest>
+<spine>
+{spine}
+</spine>
+</package>
+"""
+    container = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles>
+<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+</rootfiles>
+</container>
+"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as epub:
+            # the mimetype must come first and uncompressed
+            epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            epub.writestr("META-INF/container.xml", container)
+            epub.writestr("OEBPS/content.opf", opf)
+            epub.writestr("OEBPS/nav.xhtml", nav)
+            for name, _, xhtml in chapters:
+                epub.writestr(f"OEBPS/{name}", xhtml)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+def collect_exports(quota=None):
+    """
+    Delete the least recently used exports until they fit in `quota` bytes
+    (EXPORTS_QUOTA by default). Returns the number of files deleted.
+    """
+    quota = settings.EXPORTS_QUOTA if quota is None else quota
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(settings.EXPORTS_ROOT)
+            if entry.is_file() and entry.name.endswith(".epub")
+        ]
+    except FileNotFoundError:
+        return 0
+    stats = sorted(
+        ((entry.stat(), entry.path) for entry in entries), key=lambda item: item[0].st_mtime
+    )
+    total = sum(stat.st_size for stat, _ in stats)
+    deleted = 0
+    for stat, path in stats:
+        if total <= quota:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= stat.st_size
+        deleted += 1
+    return deleted
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import io
+import posixpath
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+
+PLACEHOLDER_WIDTH = 24
+
+# Sent with the `book` whose derivatives were stored, they are written with
+# an update that does not send the model signals.
+cover_derivatives_stored = Signal()
+
+
+def derivative_name(source, width):
+    stem = posixpath.splitext(posixpath.basename(source))[0]
+    digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+    return f"book_covers/derivatives/{stem}-{digest}-{width}w.webp"
+
+
+def generate_cover_derivatives(source):
+    """
+    Build the resized WebP versions and the blurred placeholder of the cover
+    stored at `source`.
+
+    Returns the description stored in Book.cover_derivatives. Runs in a
+    worker process, so it only touches the file storage.
+    """
+    # Pillow is only loaded by the processes that build derivatives
+    from PIL import Image, ImageFilter
+
+    with default_storage.open(source) as f:
+        image = Image.open(f)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    srcset = {}
+    widths = sorted(w for w in settings.COVER_IMAGE_WIDTHS if w < image.width)
+    for width in [*widths, image.width]:
+        resized = _resize(image, width)
+        buffer = io.BytesIO()
+        resized.save(buffer, "WEBP", quality=settings.COVER_IMAGE_QUALITY, method=6)
+        name = derivative_name(source, width)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        srcset[str(width)] = default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    placeholder = _resize(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(2))
+    buffer = io.BytesIO()
+    placeholder.save(buffer, "WEBP", quality=30)
+    return {
+        "source": source,
+        "srcset": srcset,
+        "placeholder": "data:image/webp;base64,"
+        + base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def delete_cover_derivatives(derivatives):
+    for name in derivatives.get("srcset", {}).values():
+        default_storage.delete(name)
+
+
+def _resize(image, width):
+    from PIL import Image
+
+    if width >= image.width:
+        return image
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.LANCZOS)
@@ -0,0 +1,473 @@
+import datetime
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from books.rendering import MARKDOWN_RENDER_VERSION, render_page
+
+# Sent with the imported `book` once an import has written everything,
+# bulk writes do not send the model signals.
+book_imported = Signal()
+
+SOURCE_FORMATS = {
+    ".md": "markdown",
+    ".markdown": "markdown",
+    ".html": "html",
+    ".htm": "html",
+}
+METADATA_FILE = "book.json"
+NUMBERED_NAME = re.compile(r"^(\d+)[\s._-]*(.*)$")
+
+
+class BookImportError(Exception):
+    pass
+
+
+@contextmanager
+def open_source(path, max_size=None):
+    """
+    Yield a directory holding the book at `path`: the directory itself, or
+    a temporary copy of a .zip or .tar(.gz) archive extracted. Archives
+    that would extract to more than `max_size` bytes are refused.
+    """
+    if os.path.isdir(path):
+        yield path
+        return
+    with tempfile.TemporaryDirectory(prefix="book-import-") as root:
+        try:
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as archive:
+                    # extraction stops at the declared sizes, so they can be trusted
+                    _check_size(sum(info.file_size for info in archive.infolist()), max_size)
+                    # ZipFile drops absolute paths and ".." components itself
+                    archive.extractall(root)
+            elif tarfile.is_tarfile(path):
+                with tarfile.open(path) as archive:
+                    _check_size(sum(member.size for member in archive.getmembers()), max_size)
+                    archive.extractall(root, filter="data")
+            else:
+                raise BookImportError(f"{path} is neither a directory nor a zip or tar archive.")
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise BookImportError(f"Broken archive: {e}")
+        entries = [entry for entry in os.scandir(root) if not entry.name.startswith(".")]
+        # archives of a single top-level directory hold the book in it
+        if len(entries) == 1 and entries[0].is_dir():
+            yield entries[0].path
+        else:
+            yield root
+
+
+def _check_size(size, max_size):
+    if max_size is not None and size > max_size:
+        raise BookImportError(
+            f"The archive extracts to {size} bytes, more than the {max_size} allowed."
+        )
+
+
+def _numbered(entries):
+    """
+    Order directory entries named like "01-title" and number them: by their
+    prefix if every entry has one, by position otherwise. Yields
+    (number, title, entry).
+    """
+    entries = sorted(entries, key=lambda entry: entry.name)
+    matches = [NUMBERED_NAME.match(os.path.splitext(entry.name)[0]) for entry in entries]
+    if all(matches):
+        numbered = sorted(
+            zip(matches, entries), key=lambda item: (int(item[0][1]), item[1].name)
+        )
+        numbers = [int(match[1]) for match, _ in numbered]
+        if len(set(numbers)) != len(numbers):
+            raise BookImportError(
+                "Duplicate numbers in " + ", ".join(entry.name for entry in entries)
+            )
+        for match, entry in numbered:
+            yield int(match[1]), _title(match[2] or match[1]), entry
+    else:
+        for number, entry in enumerate(entries, start=1):
+            yield number, _title(os.path.splitext(entry.name)[0]), entry
+
+
+def _title(name):
+    return re.sub(r"[_-]+", " ", name).strip()[:200]
+
+
+def read_layout(root):
+    """
+    Read the layout of a book directory:
+
+        book.json             optional: title, description, status,
+                              authors (emails) and genres (titles)
+        01-first-chapter/
+            01-a-page.md      Markdown or HTML pages
+            02-another.html
+
+    Returns (metadata, chapters) where chapters are dicts with number,
+    title and pages, and pages are dicts with number, title, path and format.
+    """
+    metadata = {}
+    metadata_path = os.path.join(root, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        try:
+            with open(metadata_path, encoding="utf-8") as f:
+                metadata = json.load(f)
+        except ValueError as e:
+            raise BookImportError(f"Invalid {METADATA_FILE}: {e}")
+    metadata.setdefault("title", _title(os.path.basename(os.path.normpath(root))))
+
+    chapters = []
+    chapter_dirs = [
+        entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith(".")
+    ]
+    for number, title, entry in _numbered(chapter_dirs):
+        page_files = [
+            page
+            for page in os.scandir(entry.path)
+            if page.is_file() and os.path.splitext(page.name)[1].lower() in SOURCE_FORMATS
+        ]
+        pages = [
+            {
+                "number": page_number,
+                "title": page_title,
+                "path": page.path,
+                "format": SOURCE_FORMATS[os.path.splitext(page.name)[1].lower()],
+            }
+            for page_number, page_title, page in _numbered(page_files)
+        ]
+        chapters.append({"number": number, "title": title, "pages": pages})
+    if not chapters:
+        raise BookImportError("No chapter directories found.")
+    return metadata, chapters
+
+
+def markdown_to_html(text):
+    # imported here, only imports need the Markdown library
+    import markdown
+
+    return markdown.markdown(text, extensions=["extra"])
+
+
+def parse_page(path, source_format):
+    """
+    Convert a page file to the Quill JSON stored in Page.content. Returns
+    (json_string, content_hash, rendered_content). Does not touch the
+    database so it can run in a worker process.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if source_format == "markdown":
+        html = markdown_to_html(text)
+    else:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(text, "html.parser")
+        html = soup.body.decode_contents() if soup.body else str(soup)
+    # no delta: the Quill editor builds one from the HTML when it opens the page
+    json_string = json.dumps({"delta": "", "html": html.strip()}, separators=(",", ":"))
+    return (json_string, *render_page(json_string))
+
+
+def parse_batch(batch):
+    return [(key, *parse_page(path, source_format)) for key, path, source_format in batch]
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _save_book(metadata, book=None):
+    from books.models import Book, Genre
+    from users.models import User
+
+    emails = metadata.get("authors", [])
+    authors = list(User.objects.filter(email__in=emails))
+    missing = set(emails) - {author.email for author in authors}
+    if missing:
+        raise BookImportError("Unknown authors: " + ", ".join(sorted(missing)))
+    if book is None:
+        book = Book.objects.filter(title=metadata["title"]).order_by("id").first()
+    if book is None:
+        book = Book(status="d")
+    fields = {
+        name: metadata[name] for name in ("title", "description", "status") if name in metadata
+    }
+    if book.pk is None or any(getattr(book, name) != value for name, value in fields.items()):
+        for name, value in fields.items():
+            setattr(book, name, value)
+        try:
+            book.full_clean(exclude=["authors", "genre", "cover_image"])
+        except ValidationError as e:
+            raise BookImportError(f"Invalid {METADATA_FILE}: {e}")
+        book.save()
+    if emails:
+        book.authors.set(authors)
+    if "genres" in metadata:
+        book.genre.set(
+            [Genre.objects.get_or_create(title=title)[0] for title in metadata["genres"]]
+        )
+    return book
+
+
+def import_book(path, book=None, prune=False, executor=None, chunk_size=500, max_size=None):
+    """
+    Import the book directory or archive at `path` (see read_layout) into
+    `book`, or into the book with the same title, or a new draft. Archives
+    extracting to more than `max_size` bytes are refused.
+
+    Pages are parsed in `executor` (inline without one) and written with
+    bulk_create/bulk_update, `chunk_size` pages per transaction. Pages whose
+    content and title did not change are left alone, so importing the same
+    source twice writes nothing; `prune` deletes the chapters and pages that
+    are not in the source, and needs `book` so that it never prunes a book
+    that only happens to share the title. Returns a dict of counts and timings.
+    """
+    from books.models import Book, Chapter, Page
+
+    if prune and book is None:
+        raise BookImportError("Pruning needs the book to import into.")
+    started = time.perf_counter()
+    stats = dict.fromkeys(
+        [
+            "chapters_created",
+            "chapters_updated",
+            "chapters_deleted",
+            "pages_created",
+            "pages_updated",
+            "pages_unchanged",
+            "pages_deleted",
+        ],
+        0,
+    )
+    with open_source(path, max_size) as root:
+        metadata, layout = read_layout(root)
+        with transaction.atomic():
+            book = _save_book(metadata, book)
+            chapters = {chapter.chapter_number: chapter for chapter in book.chapters.all()}
+            renamed = []
+            for source in layout:
+                chapter = chapters.get(source["number"])
+                if chapter is None:
+                    chapters[source["number"]] = Chapter(
+                        book=book, chapter_number=source["number"], title=source["title"]
+                    )
+                elif chapter.title != source["title"]:
+                    chapter.title = source["title"]
+                    # bulk_update does not apply auto_now
+                    chapter.updated = datetime.date.today()
+                    renamed.append(chapter)
+            new = [chapter for chapter in chapters.values() if chapter.pk is None]
+            Chapter.objects.bulk_create(new)
+            Chapter.objects.bulk_update(renamed, ["title", "updated"])
+            stats["chapters_created"], stats["chapters_updated"] = len(new), len(renamed)
+            if prune:
+                numbers = {source["number"] for source in layout}
+                stale = [number for number in chapters if number not in numbers]
+                stats["chapters_deleted"] = len(stale)
+                Chapter.objects.filter(book=book, chapter_number__in=stale).delete()
+
+        existing = {
+            (chapter_id, page_number): (pk, title, content_hash, render_version)
+            for pk, chapter_id, page_number, title, content_hash, render_version in (
+                Page.objects.filter(chapter__book=book).values_list(
+                    "pk", "chapter_id", "page_number", "title", "content_hash", "render_version"
+                )
+            )
+        }
+        sources = {}
+        for source in layout:
+            chapter_id = chapters[source["number"]].pk
+            for page in source["pages"]:
+                sources[chapter_id, page["number"]] = page
+        pages_started = time.perf_counter()
+        batches = list(
+            _batches(
+                [(key, page["path"], page["format"]) for key, page in sources.items()],
+                max(chunk_size // 4, 1),
+            )
+        )
+        results = executor.map(parse_batch, batches) if executor else map(parse_batch, batches)
+
+        pending = []
+        for batch in results:
+            pending.extend(batch)
+            if len(pending) >= chunk_size:
+                _write_pages(pending, sources, existing, stats)
+                pending = []
+        _write_pages(pending, sources, existing, stats)
+        stats["pages_seconds"] = time.perf_counter() - pages_started
+
+        if prune:
+            stale = [pk for key, (pk, *_) in existing.items() if key not in sources]
+            stats["pages_deleted"] = len(stale)
+            Page.objects.filter(pk__in=stale).delete()
+
+    Book.objects.filter(pk=book.pk).update(updated=datetime.date.today())
+    book_imported.send(sender=Book, book=book)
+    stats["seconds"] = time.perf_counter() - started
+    pages = stats["pages_created"] + stats["pages_updated"] + stats["pages_unchanged"]
+    stats["pages_per_second"] = pages / stats["seconds"] if stats["seconds"] else 0
+    stats["book_id"] = book.pk
+    return stats
+
+
+def queue_import(archive, book=None, prune=False, requested_by=None):
+    """
+    Store the uploaded `archive` and queue its import (see import_book) for
+    the run_book_imports command. Returns the BookImport.
+
+    With BACKGROUND_WORKERS = 0 the import runs right away instead, like
+    books.tasks, and the returned BookImport holds its outcome.
+    """
+    from books.models import BookImport
+
+    job = BookImport(book=book, prune=prune, requested_by=requested_by)
+    job.archive.save(os.path.basename(archive.name), archive, save=False)
+    job.save()
+    if not settings.BACKGROUND_WORKERS:
+        run_import(claim_import(job.pk))
+        job.refresh_from_db()
+    return job
+
+
+def claim_import(job_id=None):
+    """
+    Lease the oldest due import (or the import `job_id`, if due) to this
+    worker until IMPORT_LEASE seconds from now, and count the attempt.
+    Imports whose worker died before reporting back are due again once the
+    lease expires. Returns the BookImport or None.
+    """
+    from books.models import BookImport
+
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = BookImport.objects.select_for_update(skip_locked=True).filter(
+            status__in=["p", "r"], next_attempt_at__lte=now
+        )
+        if job_id is not None:
+            jobs = jobs.filter(pk=job_id)
+        job = jobs.order_by("next_attempt_at").first()
+        if job is None:
+            return None
+        job.status = "r"
+        job.attempts += 1
+        job.next_attempt_at = now + datetime.timedelta(seconds=settings.IMPORT_LEASE)
+        job.save(update_fields=["status", "attempts", "next_attempt_at"])
+    return job
+
+
+def run_import(job, executor=None):
+    """
+    Import the archive of a claimed BookImport and record the outcome.
+    Returns the BookImport.
+    """
+    if job.attempts > settings.IMPORT_MAX_ATTEMPTS:
+        _finish(job, "f", error="The import was interrupted too many times.")
+        return job
+    try:
+        with job.archive.open("rb") as source, tempfile.NamedTemporaryFile(
+            prefix="book-import-"
+        ) as f:
+            shutil.copyfileobj(source, f)
+            f.flush()
+            stats = import_book(
+                f.name,
+                book=job.book,
+                prune=job.prune,
+                executor=executor,
+                max_size=settings.IMPORT_MAX_EXTRACTED_SIZE,
+            )
+    except BookImportError as e:
+        _finish(job, "f", error=str(e))
+    except Exception as e:
+        _finish(job, "f", error=f"The import failed: {e!r}")
+    else:
+        _finish(job, "d", stats=stats)
+    return job
+
+
+def run_pending_imports(executor=None):
+    """
+    Claim and run due imports until there are none. Returns the number of
+    imports run.
+    """
+    count = 0
+    while (job := claim_import()) is not None:
+        run_import(job, executor)
+        count += 1
+    return count
+
+
+def _finish(job, status, stats=None, error=""):
+    from books.models import BookImport
+
+    # an import whose lease expired meanwhile belongs to another worker now
+    finished = BookImport.objects.filter(
+        pk=job.pk, status="r", next_attempt_at=job.next_attempt_at
+    ).update(status=status, stats=stats, error=error, finished_at=timezone.now(), archive="")
+    if finished:
+        job.archive.delete(save=False)
+        job.status, job.stats, job.error = status, stats, error
+
+
+def _write_pages(results, sources, existing, stats):
+    from books.models import Page
+    from books.search import page_search_vector
+
+    created, updated = [], []
+    for key, json_string, content_hash, markdown in results:
+        chapter_id, page_number = key
+        title = sources[key]["title"]
+        page = Page(
+            chapter_id=chapter_id,
+            page_number=page_number,
+            title=title,
+            content=json_string,
+            content_hash=content_hash,
+            rendered_content=markdown,
+            render_version=MARKDOWN_RENDER_VERSION,
+            updated=datetime.date.today(),
+        )
+        if key not in existing:
+            created.append(page)
+            continue
+        pk, stored_title, stored_hash, render_version = existing[key]
+        if (stored_title, stored_hash, render_version) == (
+            title,
+            content_hash,
+            MARKDOWN_RENDER_VERSION,
+        ):
+            stats["pages_unchanged"] += 1
+            continue
+        page.pk = pk
+        updated.append(page)
+    if not created and not updated:
+        return
+    with transaction.atomic():
+        Page.objects.bulk_create(created)
+        Page.objects.bulk_update(
+            updated,
+            [
+                "title",
+                "content",
+                "content_hash",
+                "rendered_content",
+                "render_version",
+                "updated",
+            ],
+        )
+        Page.objects.filter(pk__in=[page.pk for page in created + updated]).update(
+            search_vector=page_search_vector()
+        )
+    stats["pages_created"] += len(created)
+    stats["pages_updated"] += len(updated)
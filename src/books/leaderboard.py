@@ -0,0 +1,205 @@
+from functools import cache
+from django.conf import settings
+
+
+def bayesian_score(rating_sum, rating_count):
+    """
+    Weighted average rating: every book starts with PRIOR_WEIGHT votes of
+    PRIOR_MEAN, so a single 5-star vote does not beat a hundred 4.8s.
+    """
+    weight = settings.BOOK_LEADERBOARD_PRIOR_WEIGHT
+    mean = settings.BOOK_LEADERBOARD_PRIOR_MEAN
+    return (weight * mean + rating_sum) / (weight + rating_count)
+
+
+class RedisLeaderboard:
+    """
+    Released books ranked by score in one sorted set for the whole catalog
+    and one per genre.
+    """
+
+    def __init__(self, client, prefix="leaderboard"):
+        self.client = client
+        self.prefix = prefix
+
+    def key(self, genre_id=None):
+        if genre_id is None:
+            return f"{self.prefix}:all"
+        return f"{self.prefix}:genre:{genre_id}"
+
+    def update(self, book_id, score, genre_ids=()):
+        pipe = self.client.pipeline()
+        for key in [self.key(), *(self.key(genre_id) for genre_id in genre_ids)]:
+            pipe.zadd(key, {book_id: score})
+        pipe.execute()
+
+    def add_to_genres(self, book_id, genre_ids):
+        score = self.client.zscore(self.key(), book_id)
+        if score is None:
+            return
+        pipe = self.client.pipeline()
+        for genre_id in genre_ids:
+            pipe.zadd(self.key(genre_id), {book_id: score})
+        pipe.execute()
+
+    def remove(self, book_id, genre_ids=()):
+        pipe = self.client.pipeline()
+        for key in [self.key(), *(self.key(genre_id) for genre_id in genre_ids)]:
+            pipe.zrem(key, book_id)
+        pipe.execute()
+
+    def remove_from_genres(self, book_id, genre_ids):
+        pipe = self.client.pipeline()
+        for genre_id in genre_ids:
+            pipe.zrem(self.key(genre_id), book_id)
+        pipe.execute()
+
+    def page(self, offset, limit, genre_id=None):
+        """
+        Ids of the books ranked `offset` to `offset + limit - 1`, best first.
+        """
+        if limit <= 0 or offset < 0:
+            return []
+        return [
+            int(book_id)
+            for book_id in self.client.zrevrange(
+                self.key(genre_id), offset, offset + limit - 1
+            )
+        ]
+
+    def top(self, n, genre_id=None):
+        return self.page(0, n, genre_id)
+
+    def counts(self, genre_ids):
+        """
+        Number of ranked books in each genre, as {genre_id: count}.
+        """
+        genre_ids = list(genre_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for genre_id in genre_ids:
+            pipe.zcard(self.key(genre_id))
+        return dict(zip(genre_ids, pipe.execute()))
+
+    def replace(self, entries):
+        """
+        Atomically replace the whole leaderboard with `entries`, an iterable
+        of (book_id, score, genre_ids).
+        """
+        members = {}
+        for book_id, score, genre_ids in entries:
+            for key in [self.key(), *(self.key(genre_id) for genre_id in genre_ids)]:
+                members.setdefault(key, {})[book_id] = score
+        pipe = self.client.pipeline(transaction=True)
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            pipe.delete(key)
+        for key, mapping in members.items():
+            pipe.zadd(key, mapping)
+        pipe.execute()
+
+
+class InMemoryLeaderboard:
+    """
+    Process-local stand-in for RedisLeaderboard, for tests and development.
+    """
+
+    def __init__(self):
+        self.sets = {}
+
+    def _set(self, genre_id=None):
+        return self.sets.setdefault(genre_id, {})
+
+    def update(self, book_id, score, genre_ids=()):
+        for genre_id in [None, *genre_ids]:
+            self._set(genre_id)[book_id] = score
+
+    def add_to_genres(self, book_id, genre_ids):
+        score = self._set().get(book_id)
+        if score is None:
+            return
+        for genre_id in genre_ids:
+            self._set(genre_id)[book_id] = score
+
+    def remove(self, book_id, genre_ids=()):
+        for genre_id in [None, *genre_ids]:
+            self._set(genre_id).pop(book_id, None)
+
+    def remove_from_genres(self, book_id, genre_ids):
+        for genre_id in genre_ids:
+            self._set(genre_id).pop(book_id, None)
+
+    def page(self, offset, limit, genre_id=None):
+        if limit <= 0 or offset < 0:
+            return []
+        # ties broken like ZREVRANGE: by member, compared as strings
+        ranked = sorted(
+            self._set(genre_id).items(),
+            key=lambda item: (item[1], str(item[0])),
+            reverse=True,
+        )
+        return [book_id for book_id, _ in ranked[offset : offset + limit]]
+
+    def top(self, n, genre_id=None):
+        return self.page(0, n, genre_id)
+
+    def counts(self, genre_ids):
+        return {genre_id: len(self.sets.get(genre_id, {})) for genre_id in genre_ids}
+
+    def replace(self, entries):
+        self.sets = {}
+        for book_id, score, genre_ids in entries:
+            self.update(book_id, score, genre_ids)
+
+
+@cache
+def get_leaderboard():
+    if settings.BOOK_LEADERBOARD_BACKEND == "memory":
+        return InMemoryLeaderboard()
+    from core.redis import get_redis
+
+    return RedisLeaderboard(get_redis())
+
+
+def sync_book(book_id):
+    """
+    Put a book in (or take it out of) the leaderboard according to its
+    current status, rating summary and genres.
+    """
+    from books.models import Book
+
+    book = (
+        Book.objects.filter(pk=book_id)
+        .values("status", "rating_sum", "rating_count")
+        .first()
+    )
+    genre_ids = list(
+        Book.genre.through.objects.filter(book_id=book_id).values_list(
+            "genre_id", flat=True
+        )
+    )
+    leaderboard = get_leaderboard()
+    if book is not None and book["status"] == "r":
+        leaderboard.update(
+            book_id, bayesian_score(book["rating_sum"], book["rating_count"]), genre_ids
+        )
+    else:
+        leaderboard.remove(book_id, genre_ids)
+
+
+def rebuild_leaderboard():
+    """
+    Rebuild the whole leaderboard from the database. Returns the number of books ranked.
+    """
+    from books.models import Book
+
+    books = Book.released.order_by().values_list("id", "rating_sum", "rating_count")
+    genres = {}
+    for book_id, genre_id in Book.genre.through.objects.filter(
+        book__status="r"
+    ).values_list("book_id", "genre_id"):
+        genres.setdefault(book_id, []).append(genre_id)
+    entries = [
+        (book_id, bayesian_score(rating_sum, rating_count), genres.get(book_id, []))
+        for book_id, rating_sum, rating_count in books
+    ]
+    get_leaderboard().replace(entries)
+    return len(entries)
@@ -0,0 +1,105 @@
+import itertools
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from books.models import Book, Chapter, Page
+from books.rendering import MARKDOWN_RENDER_VERSION
+from books.search import book_search_vector, page_search_vector, search_books
+
+VOCABULARY_SIZE = 20_000
+
+
+def make_vocabulary(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {
+        "".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+        for _ in range(VOCABULARY_SIZE)
+    }
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure /books/search query latency against a synthetic catalog. "
+        "The data is created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=100_000)
+        parser.add_argument("--pages-per-book", type=int, default=100)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = make_vocabulary(rng)
+        # zipf-like word frequencies, as in natural text
+        weights = list(
+            itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1))
+        )
+        with transaction.atomic():
+            started = time.monotonic()
+            self.seed(
+                rng, vocabulary, weights, options["pages"], options["pages_per_book"]
+            )
+            self.stdout.write(
+                f"Seeded {options['pages']} pages in {time.monotonic() - started:.1f}s"
+            )
+
+            timings = []
+            for _ in range(options["queries"]):
+                text = " ".join(rng.sample(vocabulary[:2000], rng.randint(1, 2)))
+                started = time.perf_counter()
+                list(search_books(text))
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                "search latency over {n} queries: p50 {p50:.1f}ms, p95 {p95:.1f}ms, "
+                "p99 {p99:.1f}ms, max {max:.1f}ms".format(
+                    n=len(timings),
+                    p50=statistics.median(timings),
+                    p95=timings[int(len(timings) * 0.95) - 1],
+                    p99=timings[int(len(timings) * 0.99) - 1],
+                    max=timings[-1],
+                )
+            )
+            transaction.set_rollback(True)
+
+    def seed(self, rng, vocabulary, weights, pages, pages_per_book):
+        def text(n):
+            return " ".join(rng.choices(vocabulary, cum_weights=weights, k=n))
+
+        books = Book.objects.bulk_create(
+            Book(title=text(3), description=text(30), status="r")
+            for _ in range(max(pages // pages_per_book, 1))
+        )
+        chapters = Chapter.objects.bulk_create(
+            Chapter(book=book, title=text(3), chapter_number=number)
+            for book in books
+            for number in range(1, 11)
+        )
+        per_chapter = max(pages_per_book // 10, 1)
+        Page.objects.bulk_create(
+            (
+                Page(
+                    chapter=chapter,
+                    title=text(3),
+                    page_number=number,
+                    rendered_content=text(250),
+                    render_version=MARKDOWN_RENDER_VERSION,
+                )
+                for chapter in chapters
+                for number in range(1, per_chapter + 1)
+            ),
+            batch_size=2000,
+        )
+        Book.objects.filter(pk__in=[book.pk for book in books]).update(
+            search_vector=book_search_vector()
+        )
+        Page.objects.filter(chapter__in=chapters).update(
+            search_vector=page_search_vector()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE books_book, books_chapter, books_page")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from books.images import generate_cover_derivatives
+from books.models import Book
+from books.signals import store_cover_derivatives
+
+
+class Command(BaseCommand):
+    help = "Generate the resized WebP versions and placeholders of book covers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every cover, not only missing ones.",
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        for book in (
+            Book.objects.exclude(cover_image="").exclude(cover_image=None).iterator()
+        ):
+            if (
+                not options["all"]
+                and book.cover_derivatives.get("source") == book.cover_image.name
+            ):
+                continue
+            try:
+                store_cover_derivatives(
+                    book.pk, generate_cover_derivatives(book.cover_image.name)
+                )
+            except (OSError, ValueError) as e:
+                self.stderr.write(
+                    f"Book {book.pk}: cannot process {book.cover_image.name}: {e}"
+                )
+                continue
+            built += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Built cover derivatives of {built} book(s).")
+        )
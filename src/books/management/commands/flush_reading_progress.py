@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from books.progress import flush_reading_progress
+
+
+class Command(BaseCommand):
+    help = "Write buffered reading progress to the database in bulk, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--interval", type=float, default=10, help="Seconds to wait between flushes."
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Flush what is buffered now and exit."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            started = time.perf_counter()
+            written = flush_reading_progress(options["batch_size"])
+            if written:
+                self.stdout.write(
+                    f"Wrote {written} report(s) in {time.perf_counter() - started:.2f}s."
+                )
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
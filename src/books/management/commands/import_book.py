@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from books.importer import BookImportError, import_book
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a book from a directory or a zip/tar archive of chapter "
+        "directories holding Markdown or HTML pages. Re-importing only writes "
+        "the pages that changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--book-id", type=int, help="Import into this book instead of the one with the same title."
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Delete chapters and pages missing from the source, needs --book-id.",
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        book = None
+        if options["book_id"] is not None:
+            try:
+                book = Book.objects.get(pk=options["book_id"])
+            except Book.DoesNotExist:
+                raise CommandError(f"No book with id {options['book_id']}.")
+        if options["prune"] and book is None:
+            raise CommandError("--prune needs --book-id.")
+        try:
+            with ProcessPoolExecutor(max_workers=max(options["workers"], 1)) as pool:
+                stats = import_book(
+                    options["path"],
+                    book=book,
+                    prune=options["prune"],
+                    executor=pool,
+                    chunk_size=max(options["chunk_size"], 1),
+                )
+        except BookImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported book {stats['book_id']} in {stats['seconds']:.1f}s "
+                f"({stats['pages_per_second']:.0f} pages/s, pages "
+                f"{stats['pages_seconds']:.1f}s): "
+                f"{stats['chapters_created']} chapter(s) created, "
+                f"{stats['chapters_updated']} renamed, {stats['chapters_deleted']} deleted; "
+                f"{stats['pages_created']} page(s) created, {stats['pages_updated']} updated, "
+                f"{stats['pages_unchanged']} unchanged, {stats['pages_deleted']} deleted."
+            )
+        )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from books.authors import rebuild_author_directory
+
+
+class Command(BaseCommand):
+    help = "Rebuild the author directory (released book counts, latest publication, genres)."
+
+    def handle(self, *args, **options):
+        listed = rebuild_author_directory()
+        self.stdout.write(self.style.SUCCESS(f"Listed {listed} author(s)."))
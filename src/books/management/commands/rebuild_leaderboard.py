@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from books.leaderboard import rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = "Rebuild the top books leaderboard (whole catalog and per genre) from the database."
+
+    def handle(self, *args, **options):
+        ranked = rebuild_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f"Ranked {ranked} released book(s)."))
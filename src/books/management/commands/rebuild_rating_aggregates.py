@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from books.models import Book
+from books.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recompute Book.rating_count and Book.rating_sum from the Rating table."
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_aggregates(Book.objects)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates of {updated} book(s)."))
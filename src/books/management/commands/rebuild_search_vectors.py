@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from books.models import Book, Page
+from books.search import book_search_vector, page_search_vector
+
+
+class Command(BaseCommand):
+    help = "Recompute the search vectors of every book and page, e.g. after changing SEARCH_CONFIG."
+
+    def handle(self, *args, **options):
+        books = Book.objects.update(search_vector=book_search_vector())
+        pages = Page.objects.update(search_vector=page_search_vector())
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the search vectors of {books} book(s) and {pages} page(s).")
+        )
@@ -0,0 +1,88 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from books.models import Page
+from books.rendering import MARKDOWN_RENDER_VERSION, render_page
+from books.search import page_search_vector
+
+RENDERED_FIELDS = ["rendered_content", "content_hash", "render_version"]
+
+
+def render_batch(batch):
+    return [(pk, *render_page(json_string)) for pk, json_string in batch]
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render the cached Markdown of pages rendered with an older converter "
+        "version, using a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--force", action="store_true", help="Re-render every page, not only stale ones."
+        )
+
+    def handle(self, *args, **options):
+        workers = max(options["workers"], 1)
+        batch_size = max(options["batch_size"], 1)
+        force = options["force"]
+
+        pages = Page.objects.order_by("pk")
+        if not force:
+            pages = pages.exclude(render_version=MARKDOWN_RENDER_VERSION)
+        rows = pages.values_list("pk", "content").iterator(chunk_size=batch_size)
+
+        started = time.monotonic()
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    pending.add(pool.submit(render_batch, batch))
+                    batch = []
+                # keep a bounded number of batches in flight so memory stays flat
+                while len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    rendered += sum(self.store(f.result(), force) for f in done)
+            if batch:
+                pending.add(pool.submit(render_batch, batch))
+            for future in pending:
+                rendered += self.store(future.result(), force)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered {rendered} page(s) with converter version "
+                f"{MARKDOWN_RENDER_VERSION} in {elapsed:.1f}s."
+            )
+        )
+
+    def store(self, results, force):
+        with transaction.atomic():
+            stale = Page.objects.select_for_update().filter(pk__in=[pk for pk, _, _ in results])
+            if not force:
+                # skip pages that were saved (and so re-rendered) while we worked
+                stale = stale.exclude(render_version=MARKDOWN_RENDER_VERSION)
+            stale = set(stale.values_list("pk", flat=True))
+            Page.objects.bulk_update(
+                [
+                    Page(
+                        pk=pk,
+                        rendered_content=markdown,
+                        content_hash=digest,
+                        render_version=MARKDOWN_RENDER_VERSION,
+                    )
+                    for pk, digest, markdown in results
+                    if pk in stale
+                ],
+                RENDERED_FIELDS,
+            )
+            Page.objects.filter(pk__in=stale).update(search_vector=page_search_vector())
+        return len(stale)
@@ -0,0 +1,47 @@
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from books.importer import run_pending_imports
+from books.models import BookImport
+
+
+class Command(BaseCommand):
+    help = "Run the book imports queued through the API, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes parsing the pages of an import.",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=5, help="Seconds to wait when nothing is queued."
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Run what is queued now and exit."
+        )
+        parser.add_argument(
+            "--keep-days", type=int, default=30, help="Delete finished imports older than this."
+        )
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=max(options["workers"], 1)) as pool:
+            while True:
+                close_old_connections()
+                ran = run_pending_imports(executor=pool)
+                if ran:
+                    self.stdout.write(f"Ran {ran} import(s).")
+                    continue
+                BookImport.objects.filter(
+                    status__in=["d", "f"],
+                    finished_at__lt=timezone.now()
+                    - datetime.timedelta(days=options["keep_days"]),
+                ).delete()
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
@@ -1,5 +1,39 @@
 from django.db import models
+from django.db.models import Case, F, Prefetch, TextField, Value, When
+from books.rendering import MARKDOWN_RENDER_VERSION
 
-class ReleasedManager(models.Manager):
+
+class BookQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Load what BookSchema serializes in a fixed number of queries: the
+        many-to-many fields are prefetched (ids only, that is all the schema
+        shows) and the search vector is left in the database.
+        """
+        prefetches = []
+        for name in ("authors", "genre"):
+            related = self.model._meta.get_field(name).related_model
+            prefetches.append(Prefetch(name, queryset=related.objects.only("id")))
+        return self.defer("search_vector").prefetch_related(*prefetches)
+
+
+class ReleasedManager(models.Manager.from_queryset(BookQuerySet)):
     def get_queryset(self):
-        return super().get_queryset().filter(status="r")
\ No newline at end of file
+        return super().get_queryset().filter(status="r")
+
+
+class PageQuerySet(models.QuerySet):
+    def for_reading(self):
+        """
+        Pages for Page.get_content without their Quill content, which only
+        pages rendered by an older renderer need until render_pages has run.
+        Those get it as `stale_content` in the same query instead of loading
+        it one page at a time.
+        """
+        return self.defer("content", "search_vector").annotate(
+            stale_content=Case(
+                When(render_version=MARKDOWN_RENDER_VERSION, then=Value(None)),
+                default=F("content"),
+                output_field=TextField(),
+            )
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 17:01
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_rating_summary(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Rating = apps.get_model('books', 'Rating')
+    ratings = Rating.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.update(
+        rating_count=Coalesce(
+            Subquery(ratings.annotate(c=Count('pk')).values('c'), output_field=IntegerField()),
+            0,
+        ),
+        rating_sum=Coalesce(
+            Subquery(ratings.annotate(s=Sum('rating')).values('s'), output_field=IntegerField()),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_alter_page_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_summary, migrations.RunPython.noop),
+    ]
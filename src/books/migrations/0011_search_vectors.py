@@ -0,0 +1,50 @@
+# Generated by Django 5.1 on 2026-10-18 17:06
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+# the default SEARCH_CONFIG, rebuild_search_vectors refills the vectors
+# for another one
+SEARCH_CONFIG = 'simple'
+
+
+def populate_search_vectors(apps, schema_editor):
+    apps.get_model('books', 'Book').objects.update(
+        search_vector=SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+    apps.get_model('books', 'Page').objects.update(
+        search_vector=SearchVector('title', weight='C', config=SEARCH_CONFIG)
+        + SearchVector('rendered_content', weight='D', config=SEARCH_CONFIG)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_page_rendered_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='page_search_vector_idx'),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
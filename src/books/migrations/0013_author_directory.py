@@ -0,0 +1,66 @@
+# Generated by Django 5.1 on 2026-10-18 17:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def populate_author_directory(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Book = apps.get_model('books', 'Book')
+    AuthorEntry = apps.get_model('books', 'AuthorEntry')
+    released = Q(authored_books__status='r')
+    authors = (
+        User.objects.annotate(
+            released_books=Count('authored_books', filter=released),
+            latest_published=Max('authored_books__published', filter=released),
+        )
+        .filter(released_books__gt=0)
+        .values_list('pk', 'first_name', 'last_name', 'released_books', 'latest_published')
+    )
+    genres = {}
+    for author_id, genre_id in (
+        Book.genre.through.objects.filter(book__status='r')
+        .values_list('book__authors', 'genre_id')
+        .distinct()
+    ):
+        genres.setdefault(author_id, []).append(genre_id)
+    AuthorEntry.objects.bulk_create(
+        AuthorEntry(
+            author_id=author_id,
+            first_name=first_name,
+            last_name=last_name,
+            released_books=count,
+            latest_published=latest,
+            genres=sorted(genres.get(author_id, [])),
+        )
+        for author_id, first_name, last_name, count, latest in authors
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_book_cover_derivatives'),
+        ('users', '0002_alter_user_first_name_alter_user_last_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorEntry',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_entry', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('first_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('released_books', models.PositiveIntegerField(default=0)),
+                ('latest_published', models.DateField(blank=True, null=True)),
+                ('genres', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name_plural': 'author entries',
+                'ordering': ['author'],
+            },
+        ),
+        migrations.RunPython(populate_author_directory, migrations.RunPython.noop),
+    ]
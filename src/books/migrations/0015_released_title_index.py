@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 17:48
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction, but it does not
+    # lock the books table against writes while the index is built
+    atomic = False
+
+    dependencies = [
+        ('books', '0014_readingprogress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='book',
+            index=models.Index(condition=models.Q(('status', 'r')), fields=['title', 'id'], name='book_released_title_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1 on 2026-10-18 18:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_released_title_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookImport',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('archive', models.FileField(blank=True, upload_to='book_imports/')),
+                ('prune', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('p', 'pending'), ('r', 'running'), ('d', 'done'), ('f', 'failed')], default='p', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('stats', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='books.book')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(condition=models.Q(('status__in', ['p', 'r'])), fields=['next_attempt_at'], name='book_import_due_idx')],
+            },
+        ),
+    ]
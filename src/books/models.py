@@ -1,12 +1,20 @@
 import uuid
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.storage import default_storage
+from django.db import models, transaction
 from django.utils import timezone
-from books.managers import ReleasedManager
+from books.managers import BookQuerySet, PageQuerySet, ReleasedManager
 from users.models import User
-from django.db.models import Avg
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django_quill.fields import QuillField
-from markdownify import markdownify
+from books.search import book_search_vector, page_search_vector
+from books.rendering import (
+    MARKDOWN_RENDER_VERSION,
+    content_digest,
+    render_markdown,
+    render_page,
+)
 
 # TODO: clean up image when image changes
 
@@ -41,34 +49,66 @@ class Book(models.Model):
     genre = models.ManyToManyField(Genre, related_name="books")
     description = models.TextField(blank=True)
     cover_image = models.ImageField(upload_to=upload_book_cover, blank=True, null=True)
+    # resized WebP versions of the cover, built off the request path by books.images
+    cover_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     status = models.CharField(max_length=1, choices=STATUS_CHOICES)
+    # denormalized rating summary, maintained by books.signals
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"title", "description"} & set(update_fields):
+            Book.objects.filter(pk=self.pk).update(search_vector=book_search_vector())
+
     def average_rating(self):
-        if self.rating.exists():
-            return str(self.rating.aggregate(avg_rating=Avg("rating"))["avg_rating"])
+        if self.rating_count:
+            return str(self.rating_sum / self.rating_count)
         else:
             return "0"
 
+    def get_cover_srcset(self):
+        """
+        Map of width (in pixels) to the URL of the cover resized to that width.
+        Empty until the derivatives have been generated.
+        """
+        if not self.cover_image or self.cover_derivatives.get("source") != self.cover_image.name:
+            return {}
+        return {
+            width: default_storage.url(name)
+            for width, name in self.cover_derivatives["srcset"].items()
+        }
+
+    def get_cover_placeholder(self):
+        if not self.cover_image or self.cover_derivatives.get("source") != self.cover_image.name:
+            return None
+        return self.cover_derivatives.get("placeholder")
+
     def get_book_contents(self):
-        chapters = self.chapters.all().order_by("chapter_number")
+        chapters = self.chapters.order_by("chapter_number").prefetch_related(
+            models.Prefetch(
+                "pages",
+                queryset=Page.objects.order_by("page_number").for_reading(),
+            )
+        )
         chapters_with_pages = []
         for chapter in chapters:
-            pages = chapter.pages.all().order_by("page_number")
             chapter_data = {
                 "id": chapter.id,
                 "title": chapter.title,
-                "description": chapter.description,
                 "chapter_number": chapter.chapter_number,
                 "pages": [
                     {
                         "id": page.id,
-                        "content": page.content,
+                        "content": page.get_content(),
                         "page_number": page.page_number,
                     }
-                    for page in pages
+                    for page in chapter.pages.all()
                 ],
             }
             chapters_with_pages.append(chapter_data)
@@ -80,10 +120,60 @@ class Book(models.Model):
         }
         return book_data
 
+    def iter_book_contents(self, chunk_size=200):
+        """
+        Yield the book, its chapters and their pages as flat records in reading
+        order, fetching pages in chunks with a server-side cursor. Runs three
+        queries however long the book is.
+        """
+        yield {
+            "type": "book",
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+        }
+        chapters = list(self.chapters.order_by("chapter_number"))
+        positions = {chapter.id: position for position, chapter in enumerate(chapters)}
+        pages = (
+            Page.objects.filter(chapter__book=self)
+            .order_by("chapter__chapter_number", "page_number")
+            .only("id", "chapter_id", "title", "page_number", "rendered_content", "render_version")
+            .iterator(chunk_size=chunk_size)
+        )
+        emitted = 0
+        for page in pages:
+            position = positions.get(page.chapter_id)
+            if position is None:
+                # the chapter was added after the chapters were read
+                continue
+            # chapters without pages are still emitted in their place
+            while emitted <= position:
+                yield chapters[emitted].as_record()
+                emitted += 1
+            yield {
+                "type": "page",
+                "id": page.id,
+                "chapter_id": page.chapter_id,
+                "title": page.title,
+                "page_number": page.page_number,
+                "content": page.get_content(),
+            }
+        for chapter in chapters[emitted:]:
+            yield chapter.as_record()
+
     class Meta:
         ordering = ["title"]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            # released catalog listings, offset and keyset paginated by (title, id)
+            models.Index(
+                fields=["title", "id"],
+                condition=models.Q(status="r"),
+                name="book_released_title_idx",
+            ),
+        ]
 
-    objects = models.Manager()
+    objects = BookQuerySet.as_manager()
     released = ReleasedManager()
 
 
@@ -97,6 +187,14 @@ class Chapter(models.Model):
     def __str__(self):
         return f"{self.book.title} - {self.title}"
 
+    def as_record(self):
+        return {
+            "type": "chapter",
+            "id": self.id,
+            "title": self.title,
+            "chapter_number": self.chapter_number,
+        }
+
     class Meta:
         unique_together = ("book", "chapter_number")
         ordering = ["chapter_number"]
@@ -110,15 +208,58 @@ class Page(models.Model):
     created = models.DateField(auto_now_add=True)
     updated = models.DateField(auto_now=True)
 
+    # Markdown rendered from `content` at save time, see books.rendering
+    rendered_content = models.TextField(blank=True, default="", editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     def __str__(self):
         return f"Page {self.page_number} of {self.chapter.title}"
-    
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "content" in update_fields:
+            if self.render_content() and update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields, "rendered_content", "content_hash", "render_version"
+                }
+        super().save(*args, **kwargs)
+        if update_fields is None or {"title", "content"} & set(update_fields):
+            Page.objects.filter(pk=self.pk).update(search_vector=page_search_vector())
+
+    def render_content(self, force=False):
+        """
+        Re-render `rendered_content` if the content or the renderer changed.
+        Returns True if it was re-rendered.
+        """
+        json_string = self.content.json_string
+        digest = content_digest(json_string)
+        if (
+            not force
+            and digest == self.content_hash
+            and self.render_version == MARKDOWN_RENDER_VERSION
+        ):
+            return False
+        self.content_hash, self.rendered_content = render_page(json_string)
+        self.render_version = MARKDOWN_RENDER_VERSION
+        return True
+
     def get_content(self):
-        return markdownify(self.content.html)
+        if self.render_version == MARKDOWN_RENDER_VERSION:
+            return self.rendered_content
+        # loaded instead of the content by PageQuerySet.for_reading
+        stale_content = getattr(self, "stale_content", None)
+        if stale_content is not None:
+            return render_page(stale_content)[1]
+        return render_markdown(self.content.html)
 
     class Meta:
         unique_together = ("chapter", "page_number")
         ordering = ["page_number"]
+        indexes = [GinIndex(fields=["search_vector"], name="page_search_vector_idx")]
+
+    objects = PageQuerySet.as_manager()
 
 
 class Rating(models.Model):
@@ -134,3 +275,99 @@ class Rating(models.Model):
 
     def __str__(self):
         return f"{self.user} rate {self.book} {self.rating}Star(s)"
+
+    def save(self, *args, **kwargs):
+        # books.signals locks the stored rating in pre_save and applies the
+        # difference to the book in post_save, both within this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class AuthorEntry(models.Model):
+    """
+    Directory of the authors with at least one released book, maintained by
+    books.signals (see books.authors) so author listings read one table.
+    """
+
+    author = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="author_entry"
+    )
+    first_name = models.CharField(max_length=255, blank=True, null=True)
+    last_name = models.CharField(max_length=255, blank=True, null=True)
+    released_books = models.PositiveIntegerField(default=0)
+    latest_published = models.DateField(blank=True, null=True)
+    # ids of the genres of the author's released books
+    genres = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"{self.first_name} {self.last_name}"
+
+    class Meta:
+        ordering = ["author"]
+        verbose_name_plural = "author entries"
+
+
+
+class ReadingProgress(models.Model):
+    """
+    Where a user is in a book. Reports are buffered by books.progress and
+    written here in bulk by the flush_reading_progress command.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reading_progress")
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="reading_progress")
+    chapter = models.ForeignKey(Chapter, on_delete=models.SET_NULL, blank=True, null=True)
+    page = models.ForeignKey(Page, on_delete=models.SET_NULL, blank=True, null=True)
+    percent = models.FloatField(
+        default=0, validators=[MinValueValidator(0), MaxValueValidator(100)]
+    )
+    # when the client reported it, not when it was flushed
+    updated = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "book")
+        verbose_name_plural = "reading progress"
+
+    def __str__(self):
+        return f"{self.user} read {self.percent:.0f}% of {self.book}"
+
+
+class BookImport(models.Model):
+    """
+    An uploaded book archive waiting to be imported by the run_book_imports
+    command (see books.importer.run_pending_imports).
+    """
+
+    STATUS_CHOICES = (
+        ("p", "pending"),
+        ("r", "running"),
+        ("d", "done"),
+        ("f", "failed"),
+    )
+    id = models.BigAutoField(primary_key=True)
+    # removed once the import is done or failed
+    archive = models.FileField(upload_to="book_imports/", blank=True)
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, blank=True, null=True)
+    prune = models.BooleanField(default=False)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="p")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # for running imports, when their worker's lease expires
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    stats = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Import {self.id} ({self.get_status_display()})"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status__in=["p", "r"]),
+                name="book_import_due_idx",
+            )
+        ]
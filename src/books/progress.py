@@ -0,0 +1,254 @@
+import threading
+import time
+from datetime import datetime, timezone
+from functools import cache
+from django.conf import settings
+from django.db import connection
+
+# Delete a flushed report unless a newer one replaced it in the meantime.
+# KEYS[1] is the set of unflushed reports, KEYS[i + 1] a report flushed
+# with ARGV[i] as its time.
+DISCARD_SCRIPT = """
+for i = 2, #KEYS do
+    if redis.call('HGET', KEYS[i], 'at') == ARGV[i - 1] then
+        redis.call('DEL', KEYS[i])
+        redis.call('SREM', KEYS[1], KEYS[i])
+    end
+end
+"""
+
+FIELDS = ("chapter_id", "page_id", "percent", "at")
+
+
+class RedisProgressBuffer:
+    """
+    Latest progress report of each (user, book) in a hash, plus a set of
+    the reports not yet written to the database. Shared by all workers.
+    """
+
+    def __init__(self, client, prefix="progress"):
+        self.client = client
+        self.prefix = prefix
+        self.dirty_key = f"{prefix}:dirty"
+        self.discard_script = client.register_script(DISCARD_SCRIPT)
+
+    def key(self, user_id, book_id):
+        return f"{self.prefix}:{user_id}:{book_id}"
+
+    def record(self, user_id, book_id, progress):
+        key = self.key(user_id, book_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(
+            key,
+            mapping={
+                field: "" if progress[field] is None else progress[field] for field in FIELDS
+            },
+        )
+        pipe.sadd(self.dirty_key, key)
+        pipe.execute()
+
+    def _decode(self, values):
+        if not values:
+            return None
+        values = {field.decode(): value.decode() for field, value in values.items()}
+        return {
+            "chapter_id": int(values["chapter_id"]) if values["chapter_id"] else None,
+            "page_id": int(values["page_id"]) if values["page_id"] else None,
+            "percent": float(values["percent"]),
+            "at": int(values["at"]),
+        }
+
+    def get(self, user_id, book_id):
+        return self._decode(self.client.hgetall(self.key(user_id, book_id)))
+
+    def pending(self, limit):
+        """
+        Up to `limit` unflushed reports, as (user_id, book_id, progress).
+        """
+        keys = self.client.srandmember(self.dirty_key, limit)
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        entries = []
+        for key, values in zip(keys, pipe.execute()):
+            _, user_id, book_id = key.decode().rsplit(":", 2)
+            progress = self._decode(values)
+            if progress is None:
+                # flushed and deleted by another flusher
+                self.client.srem(self.dirty_key, key)
+                continue
+            entries.append((int(user_id), int(book_id), progress))
+        return entries
+
+    def discard(self, entries):
+        if not entries:
+            return
+        self.discard_script(
+            keys=[self.dirty_key, *(self.key(user_id, book_id) for user_id, book_id, _ in entries)],
+            args=[progress["at"] for _, _, progress in entries],
+        )
+
+
+class InMemoryProgressBuffer:
+    """
+    Process-local stand-in for RedisProgressBuffer, for tests and
+    development. Flushed by a background thread that record_progress starts
+    every READING_PROGRESS_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.reports = {}
+        self.lock = threading.Lock()
+        self.flushed = time.monotonic()
+        self.flushing = False
+
+    def record(self, user_id, book_id, progress):
+        with self.lock:
+            self.reports[user_id, book_id] = dict(progress)
+
+    def get(self, user_id, book_id):
+        with self.lock:
+            progress = self.reports.get((user_id, book_id))
+            return dict(progress) if progress else None
+
+    def pending(self, limit):
+        with self.lock:
+            return [
+                (user_id, book_id, dict(progress))
+                for (user_id, book_id), progress in list(self.reports.items())[:limit]
+            ]
+
+    def discard(self, entries):
+        with self.lock:
+            for user_id, book_id, progress in entries:
+                current = self.reports.get((user_id, book_id))
+                if current is not None and current["at"] == progress["at"]:
+                    del self.reports[user_id, book_id]
+
+    def flush_if_due(self, interval):
+        """
+        Start flushing in a background thread if the last flush started
+        `interval` seconds ago and is done.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.flushing or now - self.flushed < interval:
+                return
+            self.flushing = True
+            self.flushed = now
+        threading.Thread(target=self._flush, daemon=True).start()
+
+    def _flush(self):
+        try:
+            flush_reading_progress()
+        finally:
+            # the thread has its own connection
+            connection.close()
+            self.flushing = False
+
+
+@cache
+def get_progress_buffer():
+    if settings.READING_PROGRESS_BACKEND == "memory":
+        return InMemoryProgressBuffer()
+    from core.redis import get_redis
+
+    return RedisProgressBuffer(get_redis())
+
+
+def record_progress(user_id, book_id, chapter_id=None, page_id=None, percent=0):
+    """
+    Buffer a progress report, replacing the user's previous unflushed
+    report for the book. Returns the buffered progress.
+    """
+    progress = {
+        "chapter_id": chapter_id,
+        "page_id": page_id,
+        "percent": percent,
+        "at": int(time.time() * 1000),
+    }
+    buffer = get_progress_buffer()
+    buffer.record(user_id, book_id, progress)
+    if isinstance(buffer, InMemoryProgressBuffer):
+        buffer.flush_if_due(settings.READING_PROGRESS_FLUSH_INTERVAL)
+    return progress
+
+
+def get_progress(user_id, book_id):
+    """
+    The user's progress in the book: the unflushed report if there is one,
+    as it is always newer than the stored row, otherwise the stored row.
+    """
+    from books.models import ReadingProgress
+
+    progress = get_progress_buffer().get(user_id, book_id)
+    if progress is not None:
+        progress["updated"] = datetime.fromtimestamp(progress.pop("at") / 1000, timezone.utc)
+        return progress
+    return (
+        ReadingProgress.objects.filter(user_id=user_id, book_id=book_id)
+        .values("chapter_id", "page_id", "percent", "updated")
+        .first()
+    )
+
+
+def flush_reading_progress(batch_size=1000):
+    """
+    Write the buffered reports to ReadingProgress, `batch_size` per upsert,
+    and drop them from the buffer unless they were replaced meanwhile.
+    Reports on books, chapters or pages deleted since are dropped or
+    cleared. Returns the number of reports written.
+    """
+    from books.models import Book, Chapter, Page, ReadingProgress
+    from users.models import User
+
+    buffer = get_progress_buffer()
+    written = 0
+    while True:
+        entries = buffer.pending(batch_size)
+        if not entries:
+            return written
+        books = set(
+            Book.released.filter(id__in={book_id for _, book_id, _ in entries}).values_list(
+                "id", flat=True
+            )
+        )
+        users = set(
+            User.objects.filter(id__in={user_id for user_id, _, _ in entries}).values_list(
+                "id", flat=True
+            )
+        )
+        chapters = dict(
+            Chapter.objects.filter(
+                id__in={progress["chapter_id"] for _, _, progress in entries}
+            ).values_list("id", "book_id")
+        )
+        pages = dict(
+            Page.objects.filter(
+                id__in={progress["page_id"] for _, _, progress in entries}
+            ).values_list("id", "chapter__book_id")
+        )
+        rows = [
+            ReadingProgress(
+                user_id=user_id,
+                book_id=book_id,
+                chapter_id=(
+                    progress["chapter_id"]
+                    if chapters.get(progress["chapter_id"]) == book_id
+                    else None
+                ),
+                page_id=progress["page_id"] if pages.get(progress["page_id"]) == book_id else None,
+                percent=min(max(progress["percent"], 0), 100),
+                updated=datetime.fromtimestamp(progress["at"] / 1000, timezone.utc),
+            )
+            for user_id, book_id, progress in entries
+            if book_id in books and user_id in users
+        ]
+        ReadingProgress.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["user", "book"],
+            update_fields=["chapter", "page", "percent", "updated"],
+        )
+        buffer.discard(entries)
+        written += len(rows)
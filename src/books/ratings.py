@@ -0,0 +1,26 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def rebuild_rating_aggregates(books):
+    """
+    Recompute the rating summary of every book in `books` with a single UPDATE.
+    """
+    from books.models import Rating
+
+    ratings = Rating.objects.filter(book=OuterRef("pk")).order_by().values("book")
+    return books.update(
+        rating_count=Coalesce(
+            Subquery(
+                ratings.annotate(c=Count("pk")).values("c"), output_field=IntegerField()
+            ),
+            0,
+        ),
+        rating_sum=Coalesce(
+            Subquery(
+                ratings.annotate(s=Sum("rating")).values("s"),
+                output_field=IntegerField(),
+            ),
+            0,
+        ),
+    )
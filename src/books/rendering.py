@@ -0,0 +1,34 @@
+import hashlib
+from django_quill.quill import Quill
+
+# Bump this whenever the HTML -> Markdown conversion changes. Pages rendered
+# with an older version are served through the slow path until the
+# render_pages command has re-rendered them.
+MARKDOWN_RENDER_VERSION = 1
+
+EMPTY_QUILL = '{"delta":"","html":""}'
+
+
+def content_digest(json_string):
+    """
+    Hash of the raw Quill JSON of a page, used to skip re-rendering unchanged content.
+    """
+    return hashlib.sha256((json_string or EMPTY_QUILL).encode()).hexdigest()
+
+
+def render_markdown(html):
+    # imported on first use, most workers only serve pre-rendered pages
+    from markdownify import markdownify
+
+    return markdownify(html)
+
+
+def render_page(json_string):
+    """
+    Render the Quill JSON of a page to Markdown.
+
+    Returns (digest, markdown). It does not touch the database so it can run
+    in a worker process.
+    """
+    html = Quill(json_string or EMPTY_QUILL).html
+    return content_digest(json_string), render_markdown(html)
@@ -0,0 +1,127 @@
+import html
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchVector,
+)
+from django.db import connection
+from django.db.models import TextField, Value
+from django.db.models.functions import Concat
+
+
+def book_search_vector():
+    config = settings.SEARCH_CONFIG
+    return SearchVector("title", weight="A", config=config) + SearchVector(
+        "description", weight="B", config=config
+    )
+
+
+def page_search_vector():
+    config = settings.SEARCH_CONFIG
+    return SearchVector("title", weight="C", config=config) + SearchVector(
+        "rendered_content", weight="D", config=config
+    )
+
+
+# Released books matching a query, ranked by the rank of the book plus the
+# rank of its best matching page, in one statement so only the `limit` best
+# rows leave the database
+RANK_SQL = """
+SELECT book_id, SUM(rank) AS rank, MAX(page_id) AS page_id
+FROM (
+    SELECT id AS book_id, ts_rank(search_vector, {query}) AS rank, NULL::bigint AS page_id
+    FROM books_book
+    WHERE status = 'r' AND search_vector @@ {query}
+    UNION ALL
+    (
+        SELECT DISTINCT ON (chapter.book_id)
+            chapter.book_id, ts_rank(page.search_vector, {query}), page.id
+        FROM books_page page
+        JOIN books_chapter chapter ON chapter.id = page.chapter_id
+        JOIN books_book book ON book.id = chapter.book_id
+        WHERE book.status = 'r' AND page.search_vector @@ {query}
+        ORDER BY chapter.book_id, 2 DESC, page.id
+    )
+) matches
+GROUP BY book_id
+ORDER BY rank DESC, book_id
+LIMIT %(limit)s
+""".format(query="websearch_to_tsquery(%(config)s::regconfig, %(text)s)")
+
+
+# ts_headline marks matches with these instead of <mark> so the text around
+# them can be escaped: titles, descriptions and page content are user input
+# and the headlines are meant to be shown as HTML
+START_SEL, STOP_SEL = "\x02", "\x03"
+
+
+def highlight(headline):
+    """Escape a headline built with START_SEL/STOP_SEL and mark its matches."""
+    if headline is None:
+        return None
+    return (
+        html.escape(headline, quote=False)
+        .replace(START_SEL, "<mark>")
+        .replace(STOP_SEL, "</mark>")
+    )
+
+
+def search_books(text, limit=10):
+    """
+    Released books matching `text` in their title, description or page
+    content, best match first.
+
+    The `limit` best books are ranked in SQL (see RANK_SQL), and headlines
+    are only built for them. Each book is annotated with `rank`, a
+    `headline` of its title and description, and `page_id`/`page_headline`
+    for its best matching page (None if only the book itself matched).
+    Headlines are escaped HTML with the matches in <mark> tags.
+    """
+    from books.models import Book, Page
+
+    config = settings.SEARCH_CONFIG
+    query = SearchQuery(text, config=config, search_type="websearch")
+    with connection.cursor() as cursor:
+        cursor.execute(RANK_SQL, {"config": config, "text": text, "limit": limit})
+        rows = cursor.fetchall()
+    if not rows:
+        return []
+    top = [book_id for book_id, _, _ in rows]
+    ranks = {book_id: rank for book_id, rank, _ in rows}
+    best_pages = {book_id: page_id for book_id, _, page_id in rows if page_id is not None}
+
+    books = Book.released.for_listing().annotate(
+        headline=SearchHeadline(
+            Concat("title", Value(" - "), "description", output_field=TextField()),
+            query,
+            config=config,
+            start_sel=START_SEL,
+            stop_sel=STOP_SEL,
+        )
+    ).in_bulk(top)
+    page_headlines = dict(
+        Page.objects.filter(pk__in=[best_pages[b] for b in top if b in best_pages])
+        .annotate(
+            headline=SearchHeadline(
+                "rendered_content",
+                query,
+                config=config,
+                start_sel=START_SEL,
+                stop_sel=STOP_SEL,
+                max_words=30,
+            )
+        )
+        .values_list("pk", "headline")
+    )
+    results = []
+    for book_id in top:
+        book = books.get(book_id)
+        if book is None:
+            continue  # unreleased since it was ranked
+        book.headline = highlight(book.headline)
+        book.rank = ranks[book_id]
+        book.page_id = best_pages.get(book_id)
+        book.page_headline = highlight(page_headlines.get(book.page_id))
+        results.append(book)
+    return results
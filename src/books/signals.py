@@ -0,0 +1,294 @@
+import datetime
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from books import tasks
+from books.authors import refresh_author_entries
+from books.images import (
+    cover_derivatives_stored,
+    delete_cover_derivatives,
+    generate_cover_derivatives,
+)
+from books.leaderboard import get_leaderboard, sync_book
+from books.models import AuthorEntry, Book, Rating
+from users.models import User
+
+
+def _apply_rating_delta(book_id, count, total):
+    Book.objects.filter(pk=book_id).update(
+        rating_count=F("rating_count") + count,
+        rating_sum=F("rating_sum") + total,
+        # the rating is part of the book's representation, see api conditional GET
+        updated=datetime.date.today(),
+    )
+    _sync_leaderboard_on_commit(book_id)
+
+
+def _sync_leaderboard_on_commit(book_id):
+    # the leaderboard can be rebuilt with rebuild_leaderboard, a redis hiccup
+    # must not break the write that triggered it
+    transaction.on_commit(lambda: sync_book(book_id), robust=True)
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    """
+    Keep the stored (book, rating) of an existing row so post_save can apply
+    the difference. The row stays locked until Rating.save commits, so a
+    concurrent change of the same rating waits instead of applying its
+    difference to the same previous value.
+    """
+    instance._previous_rating = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_rating = (
+        Rating.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list("book_id", "rating")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Rating)
+def add_rating_to_book(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, "_previous_rating", None)
+    if previous is None:
+        _apply_rating_delta(instance.book_id, 1, instance.rating)
+    elif previous[0] == instance.book_id:
+        if previous[1] != instance.rating:
+            _apply_rating_delta(instance.book_id, 0, instance.rating - previous[1])
+    else:
+        _apply_rating_delta(previous[0], -1, -previous[1])
+        _apply_rating_delta(instance.book_id, 1, instance.rating)
+
+
+@receiver(pre_delete, sender=Rating)
+def remember_deleted_rating(sender, instance, **kwargs):
+    """
+    Lock the row and keep its stored (book, rating), the instance may hold a
+    rating that was changed since it was loaded. Deletes run in a transaction.
+    """
+    instance._previous_rating = (
+        Rating.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list("book_id", "rating")
+        .first()
+    )
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_book(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_rating", None)
+    if previous is not None:
+        _apply_rating_delta(previous[0], -1, -previous[1])
+
+
+# ============================
+# Leaderboard
+# ============================
+
+
+@receiver(post_save, sender=Book)
+def sync_book_leaderboard(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _sync_leaderboard_on_commit(instance.pk)
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_genres(sender, instance, **kwargs):
+    instance._genre_ids = list(instance.genre.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_leaderboard(sender, instance, **kwargs):
+    book_id, genre_ids = instance.pk, getattr(instance, "_genre_ids", [])
+    transaction.on_commit(
+        lambda: get_leaderboard().remove(book_id, genre_ids), robust=True
+    )
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def sync_book_genres_leaderboard(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        related = instance.books if reverse else instance.genre
+        instance._cleared_genre_pks = set(related.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action == "post_clear":
+        pk_set = instance._cleared_genre_pks
+    pairs = (
+        [(pk, instance.pk) for pk in pk_set]
+        if reverse
+        else [(instance.pk, pk) for pk in pk_set]
+    )
+
+    def apply():
+        leaderboard = get_leaderboard()
+        for book_id, genre_id in pairs:
+            if action == "post_add":
+                leaderboard.add_to_genres(book_id, [genre_id])
+            else:
+                leaderboard.remove_from_genres(book_id, [genre_id])
+
+    transaction.on_commit(apply, robust=True)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+@receiver(m2m_changed, sender=Book.authors.through)
+def touch_book_on_relation_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Genres and authors are part of the book's representation, so changing
+    them moves Book.updated (the API's Last-Modified) like a save would.
+    """
+    if action not in ("pre_clear", "post_add", "post_remove"):
+        return
+    if not reverse:
+        books = Book.objects.filter(pk=instance.pk)
+    elif action == "pre_clear":
+        field = "genre" if sender is Book.genre.through else "authors"
+        books = Book.objects.filter(**{field: instance})
+    else:
+        books = Book.objects.filter(pk__in=pk_set)
+    books.update(updated=datetime.date.today())
+
+
+# ============================
+# Cover image derivatives
+# ============================
+
+
+@receiver(post_save, sender=Book)
+def schedule_cover_derivatives(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    source = instance.cover_image.name if instance.cover_image else None
+    if instance.cover_derivatives.get("source") == source:
+        return
+    if source is None:
+        # the cover was removed
+        old = instance.cover_derivatives
+        instance.cover_derivatives = {}
+        # an update, saving again would run every Book post_save receiver twice;
+        # the save being handled already invalidates the book
+        Book.objects.filter(pk=instance.pk).update(cover_derivatives={})
+        transaction.on_commit(lambda: delete_cover_derivatives(old), robust=True)
+        return
+    book_id = instance.pk
+    transaction.on_commit(
+        lambda: tasks.submit(
+            generate_cover_derivatives,
+            source,
+            on_done=lambda derivatives: store_cover_derivatives(book_id, derivatives),
+        ),
+        robust=True,
+    )
+
+
+def store_cover_derivatives(book_id, derivatives):
+    book = Book.objects.filter(pk=book_id).first()
+    if book is None or not book.cover_image or book.cover_image.name != derivatives["source"]:
+        # the cover changed again while we worked, its own task will store it
+        delete_cover_derivatives(derivatives)
+        return
+    old = book.cover_derivatives
+    Book.objects.filter(pk=book_id).update(
+        cover_derivatives=derivatives, updated=datetime.date.today()
+    )
+    cover_derivatives_stored.send(sender=Book, book=book)
+    if old.get("source") != derivatives["source"]:
+        delete_cover_derivatives(old)
+
+
+# ============================
+# Author directory
+# ============================
+
+
+def _refresh_authors_on_commit(author_ids):
+    # after the commit, so the refresh neither slows down nor sees the
+    # uncommitted state of the write that triggered it; the directory can be
+    # rebuilt with rebuild_author_directory if it fails
+    author_ids = set(author_ids)
+    if author_ids:
+        transaction.on_commit(lambda: refresh_author_entries(author_ids), robust=True)
+
+
+@receiver(post_save, sender=Book)
+def refresh_book_authors(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or created:
+        # a new book has no authors yet, they are added through m2m_changed
+        return
+    if update_fields is not None and not {"status", "published"} & set(update_fields):
+        return
+    _refresh_authors_on_commit(instance.authors.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_authors(sender, instance, **kwargs):
+    instance._author_ids = list(instance.authors.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def refresh_deleted_book_authors(sender, instance, **kwargs):
+    _refresh_authors_on_commit(getattr(instance, "_author_ids", []))
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def refresh_changed_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        author_ids = [instance.pk]
+    elif action == "pre_clear":
+        instance._cleared_author_ids = list(instance.authors.values_list("id", flat=True))
+        return
+    elif action == "post_clear":
+        author_ids = instance._cleared_author_ids
+    else:
+        author_ids = pk_set
+    if action in ("post_add", "post_remove", "post_clear"):
+        _refresh_authors_on_commit(author_ids)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def refresh_genre_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear", "post_clear"):
+        return
+    if not reverse:
+        if action != "pre_clear":
+            _refresh_authors_on_commit(instance.authors.values_list("id", flat=True))
+        return
+    # a genre gained or lost books
+    if action == "pre_clear":
+        instance._cleared_book_author_ids = list(
+            Book.authors.through.objects.filter(book__genre=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+        return
+    if action == "post_clear":
+        author_ids = instance._cleared_book_author_ids
+    else:
+        author_ids = Book.authors.through.objects.filter(book__in=pk_set).values_list(
+            "user_id", flat=True
+        )
+    _refresh_authors_on_commit(author_ids)
+
+
+@receiver(post_save, sender=User)
+def copy_author_names(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AuthorEntry.objects.filter(pk=instance.pk).update(
+        first_name=instance.first_name, last_name=instance.last_name
+    )
+
@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connection
+
+_executor = None
+
+
+def get_executor():
+    """
+    Process pool for CPU-heavy work that must stay off the request path.
+    Created lazily so that it is never forked along with a preloaded app.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.BACKGROUND_WORKERS)
+    return _executor
+
+
+def submit(func, *args, on_done=None):
+    """
+    Run `func(*args)` in the process pool and hand its result to
+    `on_done(result)` in this process. `func` must not touch the database,
+    `on_done` may.
+
+    With BACKGROUND_WORKERS = 0 everything runs inline, which is what tests
+    and management commands want.
+    """
+    if not settings.BACKGROUND_WORKERS:
+        result = func(*args)
+        if on_done is not None:
+            on_done(result)
+        return
+
+    def callback(future):
+        try:
+            if on_done is not None:
+                on_done(future.result())
+        finally:
+            # callbacks run in a pool thread that has its own connection
+            connection.close()
+
+    get_executor().submit(func, *args).add_done_callback(callback)
@@ -1,3 +1,586 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import zipfile
+from xml.etree import ElementTree
+import tempfile
+import threading
+from unittest import mock
+import fakeredis
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from books import exports, progress
+from books.images import PLACEHOLDER_WIDTH, generate_cover_derivatives
+from books.models import AuthorEntry, Book, Chapter, Page, Rating, ReadingProgress
+from books.rendering import MARKDOWN_RENDER_VERSION, content_digest, render_page
+from books.search import search_books
+from users.models import User
 
-# Create your tests here.
+# Tables whose hot queries must be answered from an index
+INDEXED_TABLES = {"books_book", "books_chapter", "books_page", "books_book_authors"}
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN the queries behind the catalog endpoints against a seeded
+    database and fail when one of them falls back to a sequential scan,
+    e.g. because an index was dropped or a filter stopped matching it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = User.objects.bulk_create(
+            User(email=f"author{i}@example.com") for i in range(1000)
+        )
+        cls.author = authors[0]
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"book {i:05}",
+                description="a book about books",
+                # a fifth of the catalog is not released
+                status="d" if i % 5 == 0 else "r",
+            )
+            for i in range(5000)
+        )
+        Book.authors.through.objects.bulk_create(
+            Book.authors.through(book_id=book.id, user_id=authors[(i + offset) % 1000].id)
+            for i, book in enumerate(books)
+            for offset in (0, 377)
+        )
+        chapters = Chapter.objects.bulk_create(
+            Chapter(book=book, title=f"chapter {number}", chapter_number=number)
+            for book in books[1:200:4]
+            for number in range(1, 11)
+        )
+        Page.objects.bulk_create(
+            Page(
+                chapter=chapter,
+                title=f"page {number}",
+                page_number=number,
+                content='{"delta":"","html":"<p>some book text</p>"}',
+            )
+            for chapter in chapters
+            for number in range(1, 21)
+        )
+        cls.book = books[101]
+        cls.chapter = Chapter.objects.get(book=cls.book, chapter_number=3)
+        with connection.cursor() as cursor:
+            for table in INDEXED_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+
+    def hot_queries(self):
+        book_id, chapter_id = self.book.id, self.chapter.id
+        return {
+            "released listing": Book.released.all()[:51],
+            "released listing, later page": Book.released.all()[500:551],
+            "released listing, keyset": Book.released.filter(
+                Q(title__gt="book 02000") | Q(title="book 02000", id__gt=0)
+            ).order_by("title", "id")[:51],
+            "released book": Book.released.filter(id=book_id),
+            "author books": Book.released.filter(authors__id=self.author.id)[:51],
+            "chapter by number": Chapter.objects.filter(book_id=book_id, chapter_number=3),
+            "chapter pages": Page.objects.filter(
+                chapter__book__in=Book.released.filter(id=book_id), chapter__chapter_number=3
+            ),
+            "page window": Page.objects.filter(
+                chapter__book__in=Book.released.filter(id=book_id)
+            ).order_by("chapter__chapter_number", "page_number")[20:41],
+            "page by number": Page.objects.filter(chapter_id=chapter_id, page_number=5),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                plan = json.loads(queryset.explain(format="json"))[0]["Plan"]
+                scans = [
+                    node["Relation Name"]
+                    for node in plan_nodes(plan)
+                    if node["Node Type"] == "Seq Scan" and node["Relation Name"] in INDEXED_TABLES
+                ]
+                self.assertEqual(
+                    scans,
+                    [],
+                    "{} scans {} sequentially:\n{}".format(
+                        name, ", ".join(scans), queryset.explain()
+                    ),
+                )
+
+
+class RatingSummaryTests(TestCase):
+    def assertSummary(self, book, count, total):
+        book.refresh_from_db()
+        self.assertEqual((book.rating_count, book.rating_sum), (count, total))
+
+    def test_summary_follows_ratings(self):
+        users = User.objects.bulk_create(
+            User(email=f"reader{i}@example.com") for i in range(2)
+        )
+        book, other = Book.objects.bulk_create(Book(title=title) for title in "ab")
+        rating = Rating.objects.create(book=book, user=users[0], rating=4)
+        Rating.objects.create(book=book, user=users[1], rating=2)
+        self.assertSummary(book, 2, 6)
+
+        rating.rating = 5
+        rating.save()
+        self.assertSummary(book, 2, 7)
+
+        rating.book = other
+        rating.save()
+        self.assertSummary(book, 1, 2)
+        self.assertSummary(other, 1, 5)
+
+        # a stale instance removes the stored rating, not the one it holds
+        stale = Rating.objects.get(pk=rating.pk)
+        rating.rating = 3
+        rating.save()
+        self.assertSummary(other, 1, 3)
+        stale.delete()
+        self.assertSummary(other, 0, 0)
+
+
+class BookContentsTests(TestCase):
+    def test_contents_in_reading_order(self):
+        book = Book.objects.create(title="book", status="r")
+        for number in (1, 2, 3):
+            chapter = Chapter.objects.create(
+                book=book, title=f"chapter {number}", chapter_number=number
+            )
+            if number != 2:
+                Page.objects.create(
+                    chapter=chapter,
+                    title="page",
+                    page_number=1,
+                    content='{"delta":"","html":"<p>text</p>"}',
+                )
+        records = [(r["type"], r.get("chapter_number")) for r in book.iter_book_contents()]
+        self.assertEqual(
+            records,
+            [
+                ("book", None),
+                ("chapter", 1),
+                ("page", None),
+                ("chapter", 2),
+                ("chapter", 3),
+                ("page", None),
+            ],
+        )
+
+        # a chapter created between reading the chapters and the pages
+        snapshot = property(lambda self: Chapter.objects.filter(book=self, chapter_number=3))
+        with mock.patch.object(Book, "chapters", snapshot):
+            records = [(r["type"], r.get("chapter_number")) for r in book.iter_book_contents()]
+        self.assertEqual(records, [("book", None), ("chapter", 3), ("page", None)])
+
+
+class PageRenderingTests(TestCase):
+    def setUp(self):
+        book = Book.objects.create(title="book", status="r")
+        self.chapter = Chapter.objects.create(book=book, title="chapter", chapter_number=1)
+
+    def make_page(self, number, html):
+        return Page.objects.create(
+            chapter=self.chapter,
+            title="page",
+            page_number=number,
+            content=json.dumps({"delta": "", "html": html}),
+        )
+
+    def make_stale(self, page):
+        # as if rendered by an older converter
+        Page.objects.filter(pk=page.pk).update(rendered_content="old", render_version=0)
+
+    def test_rendered_at_save(self):
+        page = self.make_page(1, "<p><b>bold</b></p>")
+        page.refresh_from_db()
+        self.assertEqual(page.render_version, MARKDOWN_RENDER_VERSION)
+        self.assertEqual(page.content_hash, content_digest(page.content.json_string))
+        self.assertEqual(page.rendered_content.strip(), "**bold**")
+
+        with mock.patch("books.models.render_page", wraps=render_page) as render:
+            page.title = "renamed"
+            page.save()
+            self.assertFalse(render.called)
+            page.content = json.dumps({"delta": "", "html": "<p>other</p>"})
+            page.save()
+            self.assertEqual(render.call_count, 1)
+        page.refresh_from_db()
+        self.assertEqual(page.rendered_content.strip(), "other")
+
+    def test_stale_pages_read_in_one_query(self):
+        for number in (1, 2, 3):
+            page = self.make_page(number, f"<p>page {number}</p>")
+            if number != 2:
+                self.make_stale(page)
+        with self.assertNumQueries(1):
+            contents = [p.get_content().strip() for p in self.chapter.pages.for_reading()]
+        self.assertEqual(contents, ["page 1", "page 2", "page 3"])
+
+    def test_render_pages_backfill(self):
+        stale = self.make_page(1, "<p>stale</p>")
+        self.make_stale(stale)
+        current = self.make_page(2, "<p>current</p>")
+        out = io.StringIO()
+        call_command("render_pages", workers=1, stdout=out)
+        self.assertIn("Rendered 1 page(s)", out.getvalue())
+        stale.refresh_from_db()
+        self.assertEqual(stale.render_version, MARKDOWN_RENDER_VERSION)
+        self.assertEqual(stale.content_hash, content_digest(stale.content.json_string))
+        self.assertEqual(stale.rendered_content.strip(), "stale")
+        self.assertIsNotNone(stale.search_vector)
+
+        call_command("render_pages", workers=1, stdout=out)
+        self.assertIn("Rendered 0 page(s)", out.getvalue())
+        call_command("render_pages", workers=1, force=True, stdout=out)
+        self.assertIn("Rendered 2 page(s)", out.getvalue())
+        current.refresh_from_db()
+        self.assertEqual(current.rendered_content.strip(), "current")
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.title_match = Book.objects.create(title="whale", description="", status="r")
+        cls.both_match = Book.objects.create(title="whale songs", description="", status="r")
+        cls.page_match = Book.objects.create(title="the sea", description="", status="r")
+        cls.draft = Book.objects.create(title="whale draft", description="", status="d")
+        for book in (cls.both_match, cls.page_match, cls.draft):
+            chapter = Chapter.objects.create(book=book, title="one", chapter_number=1)
+            for number, text in enumerate(["no match", "a whale", "whale and whale"], start=1):
+                Page.objects.create(
+                    chapter=chapter,
+                    title=f"page {number}",
+                    page_number=number,
+                    content=json.dumps({"delta": "", "html": f"<p>{text}</p>"}),
+                )
+
+    def test_ranked_with_best_page(self):
+        results = search_books("whale", limit=10)
+        self.assertEqual(results[0], self.both_match)
+        self.assertCountEqual(results, [self.title_match, self.both_match, self.page_match])
+        self.assertEqual(results, sorted(results, key=lambda book: -book.rank))
+        by_id = {book.id: book for book in results}
+        self.assertIsNone(by_id[self.title_match.id].page_id)
+        best_page = Page.objects.get(chapter__book=self.page_match, page_number=3)
+        self.assertEqual(by_id[self.page_match.id].page_id, best_page.id)
+        self.assertIn("<mark>", by_id[self.page_match.id].page_headline)
+        self.assertIn("<mark>", by_id[self.title_match.id].headline)
+
+    def test_headline_escaped(self):
+        book = Book.objects.create(
+            title="whale & co", description="<img src=x onerror=alert(1) //", status="r"
+        )
+        result = next(b for b in search_books("whale", limit=10) if b == book)
+        # ts_headline drops whole tags but not an unterminated one
+        self.assertEqual(
+            result.headline, "<mark>whale</mark> &amp; co - &lt;img src=x onerror=alert(1) //"
+        )
+
+    def test_limit(self):
+        self.assertEqual(search_books("whale", limit=1), [self.both_match])
+        self.assertEqual(search_books("nothing matches this"), [])
+
+
+class CoverDerivativeTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name, COVER_IMAGE_WIDTHS=[160, 320, 640])
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def save_cover(self, width, height, mode="RGB", image_format="PNG"):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new(mode, (width, height), "red").save(buffer, image_format)
+        return default_storage.save("book_covers/cover.png", ContentFile(buffer.getvalue()))
+
+    def test_derivatives(self):
+        from PIL import Image
+
+        source = self.save_cover(500, 750)
+        derivatives = generate_cover_derivatives(source)
+        self.assertEqual(derivatives["source"], source)
+        # widths above the original are skipped, the original width is added
+        self.assertEqual(list(derivatives["srcset"]), ["160", "320", "500"])
+        for width, name in derivatives["srcset"].items():
+            with default_storage.open(name) as f:
+                image = Image.open(f)
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (int(width), round(int(width) * 1.5)))
+
+        prefix = "data:image/webp;base64,"
+        self.assertTrue(derivatives["placeholder"].startswith(prefix))
+        placeholder = Image.open(
+            io.BytesIO(base64.b64decode(derivatives["placeholder"][len(prefix) :]))
+        )
+        self.assertEqual(placeholder.format, "WEBP")
+        self.assertEqual(placeholder.width, PLACEHOLDER_WIDTH)
+
+    @override_settings(BACKGROUND_WORKERS=0)
+    def test_stored_without_saving_the_book_again(self):
+        source = self.save_cover(400, 600)
+        saves = []
+        receiver = lambda sender, instance, **kwargs: saves.append(instance.pk)
+        post_save.connect(receiver, sender=Book, weak=False)
+        self.addCleanup(post_save.disconnect, receiver, sender=Book)
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title="covered", cover_image=source)
+        self.assertEqual(saves, [book.pk])
+        book.refresh_from_db()
+        self.assertEqual(list(book.get_cover_srcset()), ["160", "320", "400"])
+        self.assertIsNotNone(book.get_cover_placeholder())
+
+    def test_palette_image_converted(self):
+        source = self.save_cover(100, 100, mode="P")
+        derivatives = generate_cover_derivatives(source)
+        self.assertEqual(list(derivatives["srcset"]), ["100"])
+
+
+class AuthorDirectoryTests(TestCase):
+    def test_refreshed_on_commit(self):
+        author = User.objects.create(email="writer@example.com", first_name="Writer")
+        book = Book.objects.create(title="book", status="d")
+        with self.captureOnCommitCallbacks() as callbacks:
+            book.authors.add(author)
+            book.status = "r"
+            book.save()
+            # nothing is recomputed inside the transaction
+            self.assertFalse(AuthorEntry.objects.exists())
+        for callback in callbacks:
+            callback()
+        entry = AuthorEntry.objects.get(author=author)
+        self.assertEqual((entry.first_name, entry.released_books), ("Writer", 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.status = "d"
+            book.save()
+        self.assertFalse(AuthorEntry.objects.exists())
+
+
+class EpubExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="A & B", description="about <things>", status="r")
+        cls.book.authors.add(
+            User.objects.create(email="writer@example.com", first_name="Writer")
+        )
+        for number in (1, 2):
+            chapter = Chapter.objects.create(
+                book=cls.book, title=f"chapter {number}", chapter_number=number
+            )
+            Page.objects.create(
+                chapter=chapter,
+                title="page",
+                page_number=1,
+                content=json.dumps(
+                    {"delta": "", "html": "<p>line<br>break</p><script>alert(1)</script>"}
+                ),
+            )
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def test_build_epub(self):
+        path = os.path.join(self.root, "book.epub")
+        exports.build_epub(exports.epub_contents(self.book), path)
+        with zipfile.ZipFile(path) as epub:
+            first = epub.infolist()[0]
+            self.assertEqual(first.filename, "mimetype")
+            self.assertEqual(first.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(epub.read("mimetype"), b"application/epub+zip")
+            self.assertEqual(
+                epub.namelist()[1:],
+                [
+                    "META-INF/container.xml",
+                    "OEBPS/content.opf",
+                    "OEBPS/nav.xhtml",
+                    "OEBPS/chapter-1.xhtml",
+                    "OEBPS/chapter-2.xhtml",
+                ],
+            )
+            # every document is well-formed XML
+            for name in epub.namelist()[1:]:
+                ElementTree.fromstring(epub.read(name))
+            opf = epub.read("OEBPS/content.opf").decode()
+            self.assertIn("<dc:title>A &amp; B</dc:title>", opf)
+            self.assertIn("<dc:creator>Writer</dc:creator>", opf)
+            chapter = epub.read("OEBPS/chapter-1.xhtml").decode()
+            self.assertIn("<br/>", chapter)
+            self.assertNotIn("script", chapter)
+        self.assertEqual([entry for entry in os.listdir(self.root)], ["book.epub"])
+
+    def test_digest_follows_contents(self):
+        digest = exports.export_digest(self.book)
+        self.assertEqual(exports.export_digest(self.book), digest)
+        page = Page.objects.filter(chapter__book=self.book).first()
+        page.content = json.dumps({"delta": "", "html": "<p>changed</p>"})
+        page.save()
+        changed = exports.export_digest(self.book)
+        self.assertNotEqual(changed, digest)
+        self.book.title = "C"
+        self.assertNotEqual(exports.export_digest(self.book), changed)
+
+    def test_digest_follows_author_names(self):
+        # the EPUB shows the names, not the email
+        digest = exports.export_digest(self.book)
+        author = self.book.authors.get()
+        author.last_name = "Renamed"
+        author.save()
+        renamed = exports.export_digest(self.book)
+        self.assertNotEqual(renamed, digest)
+        self.assertEqual(
+            exports.epub_contents(self.book)["authors"], ["Writer Renamed"]
+        )
+        author.email = "elsewhere@example.com"
+        author.save()
+        self.assertEqual(exports.export_digest(self.book), renamed)
+
+    def test_collect_least_recently_used(self):
+        with override_settings(EXPORTS_ROOT=self.root):
+            for age, name in enumerate(["new", "middle", "old"]):
+                path = os.path.join(self.root, f"{name}.epub")
+                with open(path, "wb") as f:
+                    f.write(b"x" * 100)
+                os.utime(path, (1000 - age, 1000 - age))
+            self.assertEqual(exports.collect_exports(quota=250), 1)
+            self.assertEqual(sorted(os.listdir(self.root)), ["middle.epub", "new.epub"])
+            self.assertEqual(exports.collect_exports(quota=250), 0)
+
+
+def report(at, chapter_id=None, page_id=None, percent=10.0):
+    return {"chapter_id": chapter_id, "page_id": page_id, "percent": percent, "at": at}
+
+
+class ProgressBufferTestsMixin:
+    def test_latest_report_kept(self):
+        buffer = self.buffer()
+        self.assertIsNone(buffer.get(1, 2))
+        buffer.record(1, 2, report(1000, chapter_id=3))
+        buffer.record(1, 2, report(2000, page_id=4, percent=55.5))
+        buffer.record(1, 5, report(1500))
+        self.assertEqual(buffer.get(1, 2), report(2000, page_id=4, percent=55.5))
+        self.assertEqual(
+            sorted(buffer.pending(10)),
+            [(1, 2, report(2000, page_id=4, percent=55.5)), (1, 5, report(1500))],
+        )
+        self.assertEqual(len(buffer.pending(1)), 1)
+
+    def test_discard_keeps_newer_reports(self):
+        buffer = self.buffer()
+        buffer.record(1, 2, report(1000))
+        buffer.record(1, 5, report(1000))
+        flushed = buffer.pending(10)
+        # reported again while the flush was writing
+        buffer.record(1, 5, report(2000))
+        buffer.discard(flushed)
+        self.assertIsNone(buffer.get(1, 2))
+        self.assertEqual(buffer.pending(10), [(1, 5, report(2000))])
+
+
+class RedisProgressBufferTests(ProgressBufferTestsMixin, SimpleTestCase):
+    def buffer(self):
+        return progress.RedisProgressBuffer(fakeredis.FakeRedis())
+
+    def test_pending_skips_deleted_reports(self):
+        client = fakeredis.FakeRedis()
+        buffer = progress.RedisProgressBuffer(client)
+        buffer.record(1, 2, report(1000))
+        client.delete(buffer.key(1, 2))
+        self.assertEqual(buffer.pending(10), [])
+        self.assertEqual(client.scard(buffer.dirty_key), 0)
+
+
+class InMemoryProgressBufferTests(ProgressBufferTestsMixin, SimpleTestCase):
+    def buffer(self):
+        return progress.InMemoryProgressBuffer()
+
+
+@override_settings(READING_PROGRESS_BACKEND="memory")
+class ReadingProgressFlushTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="reader@example.com")
+        cls.book = Book.objects.create(title="book", status="r")
+        cls.chapter = Chapter.objects.create(book=cls.book, title="chapter", chapter_number=1)
+        cls.page = Page.objects.create(chapter=cls.chapter, title="page", page_number=1)
+        cls.draft = Book.objects.create(title="draft", status="d")
+        other = Book.objects.create(title="other", status="r")
+        cls.other_chapter = Chapter.objects.create(book=other, title="chapter", chapter_number=1)
+
+    def setUp(self):
+        progress.get_progress_buffer.cache_clear()
+        self.addCleanup(progress.get_progress_buffer.cache_clear)
+        self.buffer = progress.get_progress_buffer()
+
+    def test_flush_upserts(self):
+        self.buffer.record(self.user.id, self.book.id, report(1000, self.chapter.id, self.page.id))
+        self.assertEqual(progress.flush_reading_progress(), 1)
+        self.assertEqual(self.buffer.pending(10), [])
+        row = ReadingProgress.objects.get(user=self.user, book=self.book)
+        self.assertEqual((row.chapter_id, row.page_id, row.percent), (self.chapter.id, self.page.id, 10))
+
+        self.buffer.record(self.user.id, self.book.id, report(2000, percent=150))
+        self.assertEqual(progress.flush_reading_progress(), 1)
+        row = ReadingProgress.objects.get(user=self.user, book=self.book)
+        self.assertEqual((row.chapter_id, row.page_id, row.percent), (None, None, 100))
+        self.assertEqual(row.updated.timestamp(), 2)
+        self.assertEqual(ReadingProgress.objects.count(), 1)
+
+    def test_flush_in_batches(self):
+        users = User.objects.bulk_create(
+            [User(email=f"reader{i}@example.com") for i in range(5)]
+        )
+        for user in users:
+            self.buffer.record(user.id, self.book.id, report(1000))
+        # book and user lookups and the upsert per batch of 2, the chapter
+        # and page lookups are skipped as no report has one
+        with self.assertNumQueries(3 * 3):
+            self.assertEqual(progress.flush_reading_progress(batch_size=2), 5)
+        self.assertEqual(ReadingProgress.objects.count(), 5)
+
+    def test_flush_drops_unknown_ids(self):
+        self.buffer.record(self.user.id, self.draft.id, report(1000))
+        self.buffer.record(self.user.id, 0, report(1000))
+        self.buffer.record(0, self.book.id, report(1000))
+        # a chapter of another book is cleared rather than stored
+        self.buffer.record(self.user.id, self.book.id, report(1000, self.other_chapter.id, 0))
+        self.assertEqual(progress.flush_reading_progress(), 1)
+        self.assertEqual(self.buffer.pending(10), [])
+        row = ReadingProgress.objects.get()
+        self.assertEqual((row.book_id, row.chapter_id, row.page_id), (self.book.id, None, None))
+
+    def test_get_progress_prefers_buffer(self):
+        self.assertIsNone(progress.get_progress(self.user.id, self.book.id))
+        self.buffer.record(self.user.id, self.book.id, report(1000, percent=20))
+        progress.flush_reading_progress()
+        self.assertEqual(progress.get_progress(self.user.id, self.book.id)["percent"], 20)
+        self.buffer.record(self.user.id, self.book.id, report(2000, percent=30))
+        self.assertEqual(progress.get_progress(self.user.id, self.book.id)["percent"], 30)
+
+    @override_settings(READING_PROGRESS_FLUSH_INTERVAL=0)
+    def test_record_does_not_flush_inline(self):
+        with mock.patch.object(threading, "Thread") as thread, mock.patch.object(
+            progress, "flush_reading_progress"
+        ) as flush:
+            progress.record_progress(self.user.id, self.book.id, percent=5)
+            # a flush is still running
+            progress.record_progress(self.user.id, self.book.id, percent=6)
+        flush.assert_not_called()
+        thread.assert_called_once_with(target=self.buffer._flush, daemon=True)
+        thread.return_value.start.assert_called_once()
+        self.assertEqual(self.buffer.get(self.user.id, self.book.id)["percent"], 6)
@@ -0,0 +1,12 @@
+from functools import cache
+import redis
+from django.conf import settings
+
+
+@cache
+def get_redis():
+    """
+    Shared redis client for features that need more than the cache API
+    (sorted sets, scripts). One connection pool per process.
+    """
+    return redis.Redis.from_url(settings.REDIS_LOCATION)
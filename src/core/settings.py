@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # load dotenv
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_quill",
     "users",
     "books",
@@ -55,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that its latency covers the whole stack
+    "api.middleware.PrometheusMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -103,6 +107,36 @@ DATABASES = {
     }
 }
 
+# How connections are reused across requests (compare them with the
+# benchmark_connections command):
+#   "close"       a new connection per request
+#   "persistent"  one connection per worker thread, kept for
+#                 DATABASE_CONN_MAX_AGE seconds and checked before reuse
+#   "pool"        a psycopg 3 pool per process, shared by its threads;
+#                 the default under ASGI, where persistent connections
+#                 would pile up in the sync_to_async threads
+DATABASE_CONNECTIONS = os.environ.get(
+    "DATABASE_CONNECTIONS", "pool" if os.environ.get("SERVER_MODE") == "asgi" else "persistent"
+)
+if DATABASE_CONNECTIONS == "persistent":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get("DATABASE_CONN_MAX_AGE", 600))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+elif DATABASE_CONNECTIONS == "pool":
+    DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+        "min_size": int(os.environ.get("DATABASE_POOL_MIN_SIZE", 2)),
+        "max_size": int(os.environ.get("DATABASE_POOL_MAX_SIZE", 10)),
+        # seconds a request waits for a free connection before failing
+        "timeout": int(os.environ.get("DATABASE_POOL_TIMEOUT", 10)),
+    }
+elif DATABASE_CONNECTIONS != "close":
+    raise ImproperlyConfigured(
+        f'DATABASE_CONNECTIONS must be "close", "persistent" or "pool", not {DATABASE_CONNECTIONS!r}'
+    )
+
+# Text search configuration of the full-text search vectors, "simple" since
+# PostgreSQL ships no Persian stemmer
+SEARCH_CONFIG = os.environ.get("SEARCH_CONFIG", "simple")
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -122,13 +156,47 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 # Cache
+REDIS_LOCATION = os.environ.get("REDIS_LOCATION")
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",
-        "LOCATION": os.environ.get("REDIS_LOCATION"),
+        "LOCATION": REDIS_LOCATION,
     }
 }
 
+# Lifetime of cached API responses, they are invalidated on change (see api.cache)
+API_CACHE_TIMEOUT = int(os.environ.get("API_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+# How long clients and shared caches may reuse an API response before
+# revalidating it, they are not told about changes
+API_CLIENT_MAX_AGE = int(os.environ.get("API_CLIENT_MAX_AGE", 0))
+
+# Top books leaderboard, "redis" or "memory" (single process, for tests)
+BOOK_LEADERBOARD_BACKEND = os.environ.get("BOOK_LEADERBOARD_BACKEND", "redis")
+# Bayesian average: every book starts with this many votes of the prior mean
+BOOK_LEADERBOARD_PRIOR_MEAN = float(os.environ.get("BOOK_LEADERBOARD_PRIOR_MEAN", 3.0))
+BOOK_LEADERBOARD_PRIOR_WEIGHT = int(os.environ.get("BOOK_LEADERBOARD_PRIOR_WEIGHT", 5))
+
+# Authenticated users are cached by api.auth: in the shared cache for
+# AUTH_USER_CACHE_TIMEOUT seconds and in a per-process LRU of
+# AUTH_USER_LOCAL_SIZE users for AUTH_USER_LOCAL_TTL seconds
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get("AUTH_USER_CACHE_TIMEOUT", 300))
+AUTH_USER_LOCAL_TTL = int(os.environ.get("AUTH_USER_LOCAL_TTL", 5))
+AUTH_USER_LOCAL_SIZE = 1024
+
+# Request throttling (api.throttling), "redis" or "memory" (single process, for tests)
+THROTTLE_BACKEND = os.environ.get("THROTTLE_BACKEND", "redis")
+
+# Reading progress reports are buffered (books.progress) and written to the
+# database in bulk: "redis" buffers for the flush_reading_progress command,
+# "memory" (single process) flushes in a background thread every
+# READING_PROGRESS_FLUSH_INTERVAL seconds
+READING_PROGRESS_BACKEND = os.environ.get("READING_PROGRESS_BACKEND", "redis")
+READING_PROGRESS_FLUSH_INTERVAL = int(os.environ.get("READING_PROGRESS_FLUSH_INTERVAL", 30))
+
+# Bearer token required to scrape /metrics, closed if empty
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -166,6 +234,28 @@ MEDIA_ROOT = BASE_DIR.joinpath("media")
 # URL to access media files in development
 MEDIA_URL = "/media/"
 
+# Cover image derivatives (see books.images)
+COVER_IMAGE_WIDTHS = [160, 320, 640, 1024]
+COVER_IMAGE_QUALITY = 80
+
+# Built EPUB exports (see books.exports), the least recently downloaded are
+# deleted once they take more than EXPORTS_QUOTA bytes
+EXPORTS_ROOT = MEDIA_ROOT.joinpath("exports")
+EXPORTS_QUOTA = int(os.environ.get("EXPORTS_QUOTA", 2 * 1024**3))
+
+# Book archives uploaded to /books/import (see books.importer), in bytes:
+# the largest upload accepted and the most it may extract to
+IMPORT_MAX_UPLOAD_SIZE = int(os.environ.get("IMPORT_MAX_UPLOAD_SIZE", 50 * 1024**2))
+IMPORT_MAX_EXTRACTED_SIZE = int(os.environ.get("IMPORT_MAX_EXTRACTED_SIZE", 500 * 1024**2))
+# imports a run_book_imports worker claimed are due again after IMPORT_LEASE
+# seconds if it did not report back, and given up after IMPORT_MAX_ATTEMPTS
+IMPORT_LEASE = int(os.environ.get("IMPORT_LEASE", 60 * 60))
+IMPORT_MAX_ATTEMPTS = int(os.environ.get("IMPORT_MAX_ATTEMPTS", 3))
+
+# Size of the process pool for background work such as cover images,
+# 0 runs it inline in the calling process
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 2))
+
 # Cors setting
 CSRF_USE_SESSIONS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -183,7 +273,11 @@ NINJA_JWT = {
 CORS_ALLOW_HEADERS = ("*",)
 
 # Setup email backend
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# emails are queued in the outbox (api.outbox) and sent by the send_outbox
+# command through this backend, e.g. the locmem or file backends in tests
+EMAIL_BACKEND = os.environ.get(
+    "EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend"
+)
 DEFAULT_FROM_EMAIL = str(os.getenv("DEFAULT_FROM_EMAIL"))
 EMAIL_HOST = str(os.getenv("EMAIL_HOST"))
 EMAIL_PORT = str(os.getenv("EMAIL_PORT"))
@@ -191,3 +285,11 @@ EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS", "False") == "True"
 EMAIL_HOST_USER = str(os.getenv("EMAIL_HOST_USER"))
 EMAIL_HOST_PASSWORD = str(os.getenv("EMAIL_HOST_PASSWORD"))
 SERVER_EMAIL = str(os.getenv("SERVER_EMAIL"))
+# a failed email is retried after OUTBOX_RETRY_DELAY seconds, doubling each
+# time, and given up after OUTBOX_MAX_ATTEMPTS attempts
+OUTBOX_RETRY_DELAY = int(os.environ.get("OUTBOX_RETRY_DELAY", 60))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+# emails a worker claimed are due again after OUTBOX_LEASE seconds if it
+# did not report back, e.g. because it died while sending; that counts as an
+# attempt too
+OUTBOX_LEASE = int(os.environ.get("OUTBOX_LEASE", 600))
@@ -1,4 +1,11 @@
 #!ash
-python manage.py collectstatic --noinput 
+# With arguments the container runs that management command instead of the
+# web server, so the background workers run as services of their own, e.g.
+#   docker run --restart unless-stopped <image> send_outbox
+if [ "$#" -gt 0 ]; then
+    exec python manage.py "$@"
+fi
 python manage.py migrate
-gunicorn --workers=3 --bind=0.0.0.0:8000 core.wsgi:application
\ No newline at end of file
+python manage.py render_pages
+python manage.py rebuild_leaderboard
+exec gunicorn --config gunicorn.conf.py
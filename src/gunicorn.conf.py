@@ -0,0 +1,40 @@
+# Gunicorn settings, see docker-entrypoint.sh
+import os
+import shutil
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 3))
+
+# SERVER_MODE=asgi serves core.asgi with uvicorn workers, so the async
+# endpoints under /api/v1/async/ do not block a worker while they wait on
+# Postgres or Redis. The default is the synchronous WSGI application.
+if os.environ.get("SERVER_MODE") == "asgi":
+    wsgi_app = "core.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "core.wsgi:application"
+    worker_class = "sync"
+
+# Import the application once in the master before forking the workers:
+# they share its code and data copy-on-write, use less memory and start
+# faster. Nothing opens a connection (database, redis, process pool) at
+# import time, so no socket is shared across the fork; GUNICORN_PRELOAD=false
+# imports the app in each worker instead.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true") == "true"
+
+# Prometheus metrics (api.metrics) of all workers are merged through files
+# in this directory. It must be set before the workers import the app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+
+
+def on_starting(server):
+    # drop the values of a previous run
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)